@@ -47,13 +47,19 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro da lista, para a latência medida incluir os demais (ver avaliacoes/metricas.py)
+    'avaliacoes.metricas.MetricasMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # Perfil sob demanda (staff, ?_perfil=1) ou por amostragem (avaliacoes/perfilamento.py)
+    'avaliacoes.perfilamento.PerfilMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Detector de N+1 (avaliacoes/consultas_repetidas.py); desligado em produção
+    'avaliacoes.consultas_repetidas.ConsultasRepetidasMiddleware',
 ]
 
 ROOT_URLCONF = 'avaliacao_professores.urls'
@@ -83,9 +89,23 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Escritas concorrentes (ver avaliacoes/escrita.py):
+        # - timeout: espera até 20s pelo lock antes de "database is locked"
+        # - IMMEDIATE: a transação já começa com o lock de escrita (sem falha ao promover leitura)
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 
+# WAL (leituras não bloqueiam a escrita e vice-versa) só quando SQLITE_WAL=1. O WAL usa
+# memória compartilhada entre os processos e não funciona em sistema de arquivos de rede,
+# como o do PythonAnywhere; ligue apenas com o banco num disco local.
+SQLITE_WAL = os.getenv('SQLITE_WAL') == '1'
+if SQLITE_WAL:
+    DATABASES['default']['OPTIONS']['init_command'] = 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -158,4 +178,49 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_PASSWORD')
 
-DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
\ No newline at end of file
+DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+# Ranking bayesiano (avaliacoes/ranking.py)
+# Peso da média geral em "avaliações fictícias" e quanto ela pode variar antes de recalcular tudo.
+# O recálculo é do comando recalcular_ranking, que deve ser agendado (ex.: cron a cada 10 min)
+RANKING_PESO_PRIOR = 10
+RANKING_TOLERANCIA_PRIOR = '0.05'
+
+# Segundos até o índice em memória das sugestões (avaliacoes/autocompletar.py) ser remontado
+# para atualizar as contagens de avaliações. Um nome novo invalida o índice na hora no processo
+# que o salvou; sem um CACHES compartilhado, os demais processos só o veem depois deste prazo.
+AUTOCOMPLETAR_TTL = 300
+
+# Segundos até o registro de categorias (avaliacoes/categorias.py) ser recarregado. Sem um
+# CACHES compartilhado, é o atraso com que os outros processos veem uma categoria nova.
+CATEGORIAS_TTL = 60
+
+# Segundos que uma resposta fica guardada para reenvios com o mesmo Idempotency-Key
+# (avaliacoes/idempotencia.py)
+IDEMPOTENCIA_TTL = 24 * 60 * 60
+
+# Caixa de saída de e-mails (avaliacoes/caixa_saida.py, worker: manage.py send_outbox)
+# Espera entre tentativas: EMAIL_ESPERA_INICIAL * 2^(tentativas-1), até EMAIL_ESPERA_MAXIMA
+EMAIL_MAX_TENTATIVAS = 5
+EMAIL_ESPERA_INICIAL = 60  # segundos
+EMAIL_ESPERA_MAXIMA = 60 * 60
+
+# Métricas por view em memória (avaliacoes/metricas.py): máximo de nomes de view guardados
+# (o excedente é somado em "(outras)") e o token com que o coletor lê /metrics/ sem login
+# ("Authorization: Bearer <token>"). Sem token, só staff vê /metrics/.
+METRICAS_MAX_VIEWS = 200
+METRICAS_TOKEN = os.getenv('METRICAS_TOKEN')
+
+# Perfis de requisição (avaliacoes/perfilamento.py): pasta dos relatórios, quantos manter
+# e fração das requisições perfiladas por amostragem (0 = só quando um staff pede)
+PERFIL_DIR = BASE_DIR / 'perfis'
+PERFIL_MAX_ARQUIVOS = 200
+PERFIL_AMOSTRAGEM = 0.0
+
+# Detector de N+1 (avaliacoes/consultas_repetidas.py): a mesma consulta (ignorando os valores)
+# mais de CONSULTAS_REPETIDAS_LIMITE vezes numa requisição vira um aviso no log ('avisar',
+# com DEBUG) ou uma exceção ('erro'). None desliga o middleware. Nos testes, o TEST_RUNNER
+# abaixo troca para 'erro' (avaliacoes/executor_testes.py).
+CONSULTAS_REPETIDAS_ACAO = 'avisar' if DEBUG else None
+CONSULTAS_REPETIDAS_LIMITE = 5
+
+TEST_RUNNER = 'avaliacoes.executor_testes.ExecutorTestes'
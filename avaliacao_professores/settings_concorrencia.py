@@ -0,0 +1,18 @@
+# avaliacao_professores/settings_concorrencia.py
+"""
+Configuração do teste de escrita concorrente (EscritaConcorrenteTests em avaliacoes/tests.py):
+
+    python manage.py test avaliacoes.tests.EscritaConcorrenteTests --settings=avaliacao_professores.settings_concorrencia
+
+O banco de teste fica num arquivo com WAL, para reproduzir o lock real do SQLite entre
+threads; o SQLite em memória compartilhado entre threads trava por tabela, sem WAL nem
+busy timeout. Fica num módulo à parte porque o Django cria o banco de teste uma vez por
+alias para a execução inteira, e as views usam o alias default: os demais testes seguem
+no banco em memória das configurações normais.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES
+
+DATABASES['default']['OPTIONS']['init_command'] = 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;'
+DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
@@ -1,19 +1,30 @@
+import io
+
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import (
     CustomUser, Professor, Aluno, Materia, DisciplinaPessoa, 
-    Categoria, Avaliacao, AvaliacaoCategoria
+    Categoria, Avaliacao, AvaliacaoCategoria, EmailPendente
 )
+from .caixa_saida import enfileirar
+from .forms import ImportarUsuariosForm
+from .importacao import importar_usuarios
 
 # Importações necessárias para o envio de e-mail e geração de link
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.urls import reverse
-from django.core.mail import send_mail
 from django.conf import settings
+from django.contrib import messages
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
 
 class CustomUserAdmin(UserAdmin):
+    # Lista de usuários com o botão "Importar CSV" (ver importar_csv abaixo)
+    change_list_template = 'admin/avaliacoes/customuser/change_list.html'
+
     # Copia os campos do UserAdmin padrão e adiciona os seus
     fieldsets = UserAdmin.fieldsets + (
         ('Campos Personalizados', {
@@ -33,7 +44,7 @@ class CustomUserAdmin(UserAdmin):
 
     def save_model(self, request, obj, form, change):
         """
-        Sobrescreve o método de salvar para enviar e-mail quando um novo usuário é criado.
+        Sobrescreve o método de salvar para enfileirar o e-mail quando um novo usuário é criado.
         """
         # Verifica se é um usuário novo (não tem ID ainda)
         eh_novo = not obj.pk
@@ -52,7 +63,7 @@ class CustomUserAdmin(UserAdmin):
 
     def enviar_email_convite(self, request, user):
         """
-        Gera o token de reset de senha e envia o e-mail de boas-vindas.
+        Gera o token de reset de senha e coloca o e-mail de boas-vindas na caixa de saída.
         """
         try:
             # Gera o token e o ID codificado
@@ -79,17 +90,55 @@ class CustomUserAdmin(UserAdmin):
             Equipe de Administração
             """
             
-            send_mail(
-                subject,
-                message,
-                settings.DEFAULT_FROM_EMAIL,
-                [user.email],
-                fail_silently=False,
-            )
-            self.message_user(request, f"E-mail de convite enviado com sucesso para {user.email}")
+            # Só entra na caixa de saída (mesma transação do save do admin);
+            # quem envia é o worker `manage.py send_outbox`
+            enfileirar(subject, message, [user.email], remetente=settings.DEFAULT_FROM_EMAIL)
+            self.message_user(request, f"E-mail de convite para {user.email} adicionado à fila de envio")
             
         except Exception as e:
-            self.message_user(request, f"Erro ao enviar e-mail para {user.email}: {str(e)}", level='error')
+            self.message_user(request, f"Erro ao preparar o e-mail para {user.email}: {str(e)}", level='error')
+
+    def get_urls(self):
+        urls = [
+            path('importar-csv/', self.admin_site.admin_view(self.importar_csv), name='avaliacoes_customuser_importar_csv'),
+        ]
+        return urls + super().get_urls()
+
+    def importar_csv(self, request):
+        """
+        Cadastro em massa de alunos e professores por upload de CSV (avaliacoes/importacao.py).
+        Mostra o resumo e o relatório de erros por linha na mesma página.
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        relatorio = None
+        form = ImportarUsuariosForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            arquivo = io.TextIOWrapper(form.cleaned_data['arquivo'].file, encoding='utf-8-sig', newline='')
+            try:
+                relatorio = importar_usuarios(
+                    arquivo,
+                    dominio=request.get_host() if form.cleaned_data['enviar_email'] else None,
+                    usar_https=request.is_secure(),
+                )
+            except (ValueError, UnicodeDecodeError) as erro:
+                form.add_error('arquivo', str(erro))
+            else:
+                self.message_user(
+                    request,
+                    f"{relatorio.total_criados} usuário(s) criado(s), {len(relatorio.erros)} linha(s) com erro.",
+                    level=messages.WARNING if relatorio.erros else messages.SUCCESS,
+                )
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Importar usuários (CSV)',
+            'form': form,
+            'relatorio': relatorio,
+        }
+        return TemplateResponse(request, 'admin/avaliacoes/customuser/importar_csv.html', context)
 
 # --- REGISTROS ---
 
@@ -103,4 +152,12 @@ admin.site.register(Materia)
 admin.site.register(DisciplinaPessoa)
 admin.site.register(Categoria)
 admin.site.register(Avaliacao)
-admin.site.register(AvaliacaoCategoria)
\ No newline at end of file
+admin.site.register(AvaliacaoCategoria)
+
+@admin.register(EmailPendente)
+class EmailPendenteAdmin(admin.ModelAdmin):
+    # Acompanhamento da caixa de saída: o que falhou e por quê
+    list_display = ('assunto', 'status', 'tentativas', 'proxima_tentativa', 'criado_em', 'enviado_em')
+    list_filter = ('status',)
+    search_fields = ('assunto', 'ultimo_erro')
+    readonly_fields = ('criado_em', 'enviado_em')
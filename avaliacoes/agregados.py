@@ -0,0 +1,656 @@
+# avaliacoes/agregados.py
+"""
+Manutenção incremental das tabelas de médias (MediaDisciplina, MediaDisciplinaCategoria,
+MediaProfessor e MediaUniversidade) e dos histogramas de notas (HistogramaNota).
+
+Em vez de recalcular Avg() sobre toda a AvaliacaoCategoria a cada página, guardamos a
+SOMA e a QUANTIDADE de notas e aplicamos só a diferença (delta) de cada escrita.
+Assim cada atualização custa O(1) e a média continua exata (soma / quantidade): uma
+escrita faz um upsert (INSERT ... ON CONFLICT DO UPDATE) por tabela, para todas as
+turmas dela de uma vez (ver _somar).
+
+As mesmas atualizações mantêm a pontuação do ranking (ver avaliacoes/ranking.py).
+
+Regras:
+- Todas as funções daqui devem ser chamadas DENTRO da transação da escrita original.
+- Só existem linhas para turmas/professores que têm pelo menos uma avaliação com notas;
+  quando a quantidade chega a zero a linha é apagada (a MediaUniversidade é a exceção,
+  é uma linha única com pk=UNIVERSIDADE_PK).
+"""
+
+import math
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import ranking
+from .models import (
+    Avaliacao, AvaliacaoCategoria, HistogramaNota, MediaDisciplina, MediaDisciplinaCategoria, MediaProfessor,
+    MediaUniversidade
+)
+
+UNIVERSIDADE_PK = 1
+
+DUAS_CASAS = Decimal('0.01')
+
+
+def _decimal(valor):
+    """Converte a nota (float, str ou Decimal) para Decimal com 2 casas, igual ao banco."""
+    return Decimal(str(valor)).quantize(DUAS_CASAS)
+
+
+def _media(soma, qtde):
+    return (soma / qtde).quantize(DUAS_CASAS) if qtde > 0 else Decimal('0')
+
+
+def _somar(modelo, chave, linhas, somados, calculados=None, retornar=()):
+    """
+    Soma deltas em várias linhas de `modelo` com UM comando por lote:
+    INSERT ... ON CONFLICT (chave) DO UPDATE, em vez de um UPDATE (e talvez um INSERT) por linha.
+
+    - `linhas` = [{campo: valor}], todas com os mesmos campos: a `chave`, os deltas dos
+      campos `somados` e os valores que só valem para a linha nova (ex.: disciplina_id);
+    - na linha que já existe cada campo `somado` recebe atual + delta, ultima_atualizacao
+      é trocada e os demais ficam como estão;
+    - `calculados` = {campo: função(valor) -> SQL}: campos refeitos a partir dos valores
+      finais (valor(campo) é o SQL do valor do campo já somado), na criação e na soma.
+
+    Devolve as colunas `retornar` (RETURNING) de cada linha gravada.
+    """
+    if not linhas:
+        return []
+    calculados = calculados or {}
+    tabela = connection.ops.quote_name(modelo._meta.db_table)
+    campos = list(linhas[0])
+
+    def coluna(campo):
+        return connection.ops.quote_name(modelo._meta.get_field(campo).column)
+
+    # Na criação os valores vêm da lista VALUES (colunas column1, column2, ...)
+    posicoes = {campo: f'v.column{i}' for i, campo in enumerate(campos, start=1)}
+    inseridos = [posicoes[campo] for campo in campos]
+    inseridos += [calcular(lambda campo: posicoes[campo]) for calcular in calculados.values()]
+
+    def somado(campo):
+        return f'({tabela}.{coluna(campo)} + excluded.{coluna(campo)})'
+
+    atribuicoes = [f'{coluna(campo)} = {somado(campo)}' for campo in somados]
+    atribuicoes += [
+        f'{coluna(campo)} = {calcular(lambda c: somado(c) if c in somados else f"excluded.{coluna(c)}")}'
+        for campo, calcular in calculados.items()
+    ]
+    if 'ultima_atualizacao' in campos:
+        atribuicoes.append(f'{coluna("ultima_atualizacao")} = excluded.{coluna("ultima_atualizacao")}')
+
+    sql = (
+        f'INSERT INTO {tabela} ({", ".join(coluna(campo) for campo in [*campos, *calculados])}) '
+        f'SELECT {", ".join(inseridos)} FROM (VALUES {{valores}}) AS v '
+        # O "WHERE true" evita que o SQLite leia o ON CONFLICT como parte de um JOIN
+        f'WHERE true ON CONFLICT ({", ".join(coluna(campo) for campo in chave)}) '
+        f'DO UPDATE SET {", ".join(atribuicoes)}'
+    )
+    if retornar:
+        sql += f' RETURNING {", ".join(coluna(campo) for campo in retornar)}'
+
+    marcadores = f'({", ".join(["%s"] * len(campos))})'
+    tamanho_lote = max(1, (connection.features.max_query_params or 999) // len(campos))
+    retorno = []
+    with connection.cursor() as cursor:
+        for inicio in range(0, len(linhas), tamanho_lote):
+            lote = linhas[inicio:inicio + tamanho_lote]
+            params = [
+                modelo._meta.get_field(campo).get_db_prep_save(linha[campo], connection)
+                for linha in lote for campo in campos
+            ]
+            cursor.execute(sql.format(valores=', '.join([marcadores] * len(lote))), params)
+            if retornar:
+                retorno += cursor.fetchall()
+    return retorno
+
+
+def _calcular_media(campo_soma, campo_qtde):
+    """Campo calculado do _somar: soma / quantidade, ou 0 sem notas."""
+    def calcular(valor):
+        # O CAST evita a divisão inteira do SQLite quando a soma é um número "redondo"
+        return (
+            f'CASE WHEN {valor(campo_qtde)} <= 0 THEN 0 '
+            f'ELSE CAST({valor(campo_soma)} AS DOUBLE PRECISION) / {valor(campo_qtde)} END'
+        )
+    return calcular
+
+
+def _calcular_pontuacao(campo_soma, campo_qtde, campo_avaliacoes, media_prior):
+    """Campo calculado do _somar: a pontuação do ranking (ver avaliacoes/ranking.py)."""
+    def calcular(valor):
+        return ranking.sql_pontuacao(valor(campo_soma), valor(campo_qtde), valor(campo_avaliacoes), media_prior)
+    return calcular
+
+
+def _criadas_e_vazias(retorno, deltas):
+    """
+    Separa as linhas devolvidas por _somar (chave, qtde_avaliacoes) em criadas agora e
+    esvaziadas agora. Uma linha existente nunca tem qtde_avaliacoes 0 (é apagada antes),
+    então a linha foi criada se o total gravado é igual ao delta aplicado.
+    """
+    criadas, vazias = set(), set()
+    for chave, qtde in retorno:
+        if qtde == deltas[chave]:
+            criadas.add(chave)
+        elif qtde <= 0:
+            vazias.add(chave)
+    return criadas, vazias
+
+
+def _nova_turma(pessoa_id, disciplina_id=None):
+    return {
+        'pessoa_id': pessoa_id,
+        # Só é necessário quando a MediaDisciplina da turma ainda não existe
+        'disciplina_id': disciplina_id,
+        'avaliacoes': 0,
+        'categorias': defaultdict(lambda: [Decimal('0'), 0]),
+        # {(categoria_id, nota): qtde}; vazio quando o histograma some junto com a turma
+        'notas': defaultdict(int),
+    }
+
+
+def _propagar(turmas):
+    """
+    Aplica os deltas de cada turma em MediaDisciplina(+Categoria), HistogramaNota,
+    MediaProfessor e MediaUniversidade: um upsert (_somar) por tabela para todas as turmas.
+
+    `turmas` = {disciplina_pessoa_id: {'pessoa_id': ..., 'avaliacoes': n,
+                                       'categorias': {categoria_id: [soma, qtde]},
+                                       'notas': {(categoria_id, nota): qtde}}}
+    Deltas negativos representam remoções. Uma remoção de algo que nunca foi contabilizado
+    cria uma linha negativa, que é apagada no fim junto com as que ficaram vazias.
+    """
+    if not turmas:
+        return
+    removendo = any(turma['avaliacoes'] < 0 for turma in turmas.values())
+    agora = timezone.now()
+
+    totais = {}
+    for dp_id, turma in turmas.items():
+        totais[dp_id] = (
+            sum((s for s, _ in turma['categorias'].values()), Decimal('0')),
+            sum(q for _, q in turma['categorias'].values()),
+        )
+
+    # Média "a priori" do ranking: a que está gravada em MediaUniversidade.media_ranking, lida
+    # dentro dos próprios upserts (o comando recalcular_ranking a atualiza, ver ranking.py).
+    # Antes da primeira avaliação ela não existe e vale a média destas notas, que é a que a
+    # MediaUniversidade recebe ao ser criada.
+    media_inicial = _media(sum((s for s, _ in totais.values()), Decimal('0')), sum(q for _, q in totais.values()))
+    media_prior = (
+        f'COALESCE((SELECT {connection.ops.quote_name("media_ranking")} '
+        f'FROM {connection.ops.quote_name(MediaUniversidade._meta.db_table)} '
+        f'WHERE {connection.ops.quote_name("id")} = {UNIVERSIDADE_PK}), {media_inicial})'
+    )
+
+    # 1. Nível turma
+    retorno = _somar(
+        MediaDisciplina, ('disciplina_pessoa_id',),
+        [
+            {
+                'disciplina_pessoa_id': dp_id, 'disciplina_id': turma['disciplina_id'],
+                'soma_notas': totais[dp_id][0], 'qtde_notas': totais[dp_id][1],
+                'qtde_avaliacoes': turma['avaliacoes'], 'ultima_atualizacao': agora,
+            }
+            for dp_id, turma in turmas.items()
+        ],
+        somados=('soma_notas', 'qtde_notas', 'qtde_avaliacoes'),
+        calculados={
+            'media': _calcular_media('soma_notas', 'qtde_notas'),
+            'pontuacao': _calcular_pontuacao('soma_notas', 'qtde_notas', 'qtde_avaliacoes', media_prior),
+        },
+        retornar=('disciplina_pessoa_id', 'qtde_avaliacoes'),
+    )
+    criadas, vazias = _criadas_e_vazias(retorno, {dp_id: turma['avaliacoes'] for dp_id, turma in turmas.items()})
+
+    _somar(
+        MediaDisciplinaCategoria, ('disciplina_pessoa_id', 'categoria_id'),
+        [
+            {
+                'disciplina_pessoa_id': dp_id, 'categoria_id': cat_id, 'soma_notas': soma,
+                'qtde_avaliacoes': qtde, 'ultima_atualizacao': agora,
+            }
+            for dp_id, turma in turmas.items() for cat_id, (soma, qtde) in turma['categorias'].items()
+        ],
+        somados=('soma_notas', 'qtde_avaliacoes'),
+        calculados={
+            'media': _calcular_media('soma_notas', 'qtde_avaliacoes'),
+            'pontuacao': _calcular_pontuacao('soma_notas', 'qtde_avaliacoes', 'qtde_avaliacoes', media_prior),
+        },
+    )
+    _somar(
+        HistogramaNota, ('disciplina_pessoa_id', 'categoria_id', 'nota'),
+        [
+            {'disciplina_pessoa_id': dp_id, 'categoria_id': cat_id, 'nota': nota, 'qtde': qtde}
+            for dp_id, turma in turmas.items() for (cat_id, nota), qtde in turma.get('notas', {}).items()
+        ],
+        somados=('qtde',),
+    )
+
+    # [soma, qtde_notas, qtde_avaliacoes, qtde_disciplinas]
+    professores = defaultdict(lambda: [Decimal('0'), 0, 0, 0])
+    for dp_id, turma in turmas.items():
+        acumulado = professores[turma['pessoa_id']]
+        acumulado[0] += totais[dp_id][0]
+        acumulado[1] += totais[dp_id][1]
+        acumulado[2] += turma['avaliacoes']
+        # Turmas avaliadas pela primeira vez passam a contar para o professor; as que ficaram
+        # sem avaliações deixam de contar
+        if dp_id in criadas and turma['avaliacoes'] > 0:
+            acumulado[3] += 1
+        elif dp_id in vazias:
+            acumulado[3] -= 1
+
+    if removendo:
+        MediaDisciplina.objects.filter(disciplina_pessoa_id__in=turmas.keys(), qtde_avaliacoes__lte=0).delete()
+        MediaDisciplinaCategoria.objects.filter(
+            disciplina_pessoa_id__in=turmas.keys(), qtde_avaliacoes__lte=0
+        ).delete()
+        HistogramaNota.objects.filter(disciplina_pessoa_id__in=turmas.keys(), qtde__lte=0).delete()
+
+    # 2. Nível professor
+    retorno = _somar(
+        MediaProfessor, ('pessoa_id',),
+        [
+            {
+                'pessoa_id': pessoa_id, 'soma_notas': soma, 'qtde_notas': qtde, 'qtde_avaliacoes': avaliacoes,
+                'qtde_disciplinas': disciplinas, 'ultima_atualizacao': agora,
+            }
+            for pessoa_id, (soma, qtde, avaliacoes, disciplinas) in professores.items()
+        ],
+        somados=('soma_notas', 'qtde_notas', 'qtde_avaliacoes', 'qtde_disciplinas'),
+        calculados={'media': _calcular_media('soma_notas', 'qtde_notas')},
+        retornar=('pessoa_id', 'qtde_avaliacoes'),
+    )
+    criados, vazios = _criadas_e_vazias(retorno, {pessoa_id: total[2] for pessoa_id, total in professores.items()})
+    if removendo:
+        MediaProfessor.objects.filter(pessoa_id__in=professores.keys(), qtde_avaliacoes__lte=0).delete()
+
+    # 3. Nível universidade (linha única)
+    soma = sum((total[0] for total in professores.values()), Decimal('0'))
+    qtde = sum(total[1] for total in professores.values())
+    _somar(
+        MediaUniversidade, ('id',),
+        [{
+            'id': UNIVERSIDADE_PK, 'soma_notas': soma, 'qtde_notas': qtde,
+            'qtde_avaliacoes': sum(total[2] for total in professores.values()),
+            'qtde_disciplinas': sum(total[3] for total in professores.values()),
+            'qtde_professores': sum(
+                1 for pessoa_id, total in professores.items() if pessoa_id in criados and total[2] > 0
+            ) - len(vazios),
+            # Só vale na criação: depois quem muda a média do ranking é o recalcular_ranking
+            'media_ranking': _media(soma, qtde),
+            'ultima_atualizacao': agora,
+        }],
+        somados=('soma_notas', 'qtde_notas', 'qtde_avaliacoes', 'qtde_disciplinas', 'qtde_professores'),
+        calculados={'media': _calcular_media('soma_notas', 'qtde_notas')},
+    )
+
+
+def atualizar_media_ranking(forcar=False):
+    """
+    Troca a média "a priori" do ranking pela média geral atual e recalcula todas as
+    pontuações, se ela andou mais que ranking.TOLERANCIA_PRIOR (ou com `forcar`).
+    Chamada pelo comando recalcular_ranking, fora das requisições: é um UPDATE em todas
+    as turmas. Devolve (média antiga, média nova), ou None se nada mudou.
+    """
+    with transaction.atomic():
+        universidade = MediaUniversidade.objects.select_for_update().filter(pk=UNIVERSIDADE_PK).first()
+        if universidade is None:
+            return None
+        antiga, nova = universidade.media_ranking, _media(universidade.soma_notas, universidade.qtde_notas)
+        if not forcar and abs(nova - antiga) <= ranking.TOLERANCIA_PRIOR:
+            return None
+        ranking.recalcular_pontuacoes(nova)
+        MediaUniversidade.objects.filter(pk=UNIVERSIDADE_PK).update(media_ranking=nova)
+    return antiga, nova
+
+
+def registrar_avaliacao(disciplina_pessoa, notas):
+    """
+    Contabiliza uma avaliação recém-criada.
+    `notas` = {categoria_id: nota}. Custa 5 comandos (um upsert por tabela), existindo as linhas ou não.
+    """
+    registrar_avaliacoes([(disciplina_pessoa, notas)])
+
+
+def registrar_avaliacoes(avaliacoes):
+    """
+    Contabiliza várias avaliações recém-criadas de uma vez.
+    `avaliacoes` = [(disciplina_pessoa, {categoria_id: nota})]. As turmas são agregadas
+    antes, então o custo é por turma/professor distinto, não por avaliação.
+    """
+    turmas = {}
+    for disciplina_pessoa, notas in avaliacoes:
+        turma = turmas.setdefault(
+            disciplina_pessoa.pk, _nova_turma(disciplina_pessoa.pessoa_id, disciplina_pessoa.disciplina_id)
+        )
+        if not notas:
+            continue
+        turma['avaliacoes'] += 1
+        for categoria_id, nota in notas.items():
+            nota = _decimal(nota)
+            turma['categorias'][categoria_id][0] += nota
+            turma['categorias'][categoria_id][1] += 1
+            turma['notas'][(categoria_id, nota)] += 1
+    _propagar({dp_id: turma for dp_id, turma in turmas.items() if turma['avaliacoes']})
+
+
+def descontar_avaliacoes(avaliacoes):
+    """
+    Retira das médias as notas das avaliações do queryset `avaliacoes`.
+    Deve ser chamada ANTES de `avaliacoes.delete()` (ou de um delete em cascata).
+    """
+    turmas = {}
+
+    notas = AvaliacaoCategoria.objects.filter(avaliacao__in=avaliacoes).values(
+        'avaliacao__disciplina_pessoa_id', 'avaliacao__disciplina_pessoa__pessoa_id', 'categoria_id', 'nota'
+    ).annotate(qtde=Count('id')).order_by()
+
+    for linha in notas:
+        dp_id = linha['avaliacao__disciplina_pessoa_id']
+        if dp_id is None:
+            continue
+        turma = turmas.setdefault(dp_id, _nova_turma(linha['avaliacao__disciplina_pessoa__pessoa_id']))
+        categoria = turma['categorias'][linha['categoria_id']]
+        categoria[0] -= linha['nota'] * linha['qtde']
+        categoria[1] -= linha['qtde']
+        turma['notas'][(linha['categoria_id'], linha['nota'])] -= linha['qtde']
+
+    if not turmas:
+        return
+
+    # Só contam as avaliações que têm notas (as de "apenas comentário" nunca foram somadas)
+    por_turma = avaliacoes.filter(
+        disciplina_pessoa_id__in=turmas.keys(), categorias_avaliacao__isnull=False
+    ).values('disciplina_pessoa_id').annotate(qtde=Count('id', distinct=True)).order_by()
+    for linha in por_turma:
+        turmas[linha['disciplina_pessoa_id']]['avaliacoes'] = -linha['qtde']
+
+    _propagar(turmas)
+
+
+def descontar_turmas(turmas_qs):
+    """
+    Retira das médias tudo o que as turmas (DisciplinaPessoa) do queryset acumularam.
+    Usa as linhas já agregadas, então custa O(turmas), não O(avaliações).
+    Deve ser chamada ANTES de apagar as turmas (ou o professor, que apaga em cascata);
+    os HistogramaNota das turmas somem junto com elas.
+    """
+    turmas = {}
+
+    for media in MediaDisciplina.objects.filter(disciplina_pessoa__in=turmas_qs).values(
+        'disciplina_pessoa_id', 'disciplina_pessoa__pessoa_id', 'qtde_avaliacoes'
+    ):
+        turma = _nova_turma(media['disciplina_pessoa__pessoa_id'])
+        turma['avaliacoes'] = -media['qtde_avaliacoes']
+        turmas[media['disciplina_pessoa_id']] = turma
+
+    for media in MediaDisciplinaCategoria.objects.filter(disciplina_pessoa_id__in=turmas.keys()).values(
+        'disciplina_pessoa_id', 'categoria_id', 'soma_notas', 'qtde_avaliacoes'
+    ):
+        turmas[media['disciplina_pessoa_id']]['categorias'][media['categoria_id']] = [
+            -media['soma_notas'], -media['qtde_avaliacoes']
+        ]
+
+    _propagar(turmas)
+
+
+def apagar_avaliacoes(avaliacoes):
+    """
+    Apaga as avaliações do queryset `avaliacoes` e as notas delas com um DELETE por tabela.
+    O delete() em cascata do Django lê os ids e apaga de 100 em 100, ou seja, faz mais
+    consultas quanto mais avaliações a turma/aluno tiver. Não mexe nas médias: chame
+    descontar_avaliacoes()/descontar_turmas() antes. Devolve quantas avaliações foram apagadas.
+    """
+    ids = avaliacoes.order_by().values('pk')
+    AvaliacaoCategoria.objects.filter(avaliacao__in=ids).delete()
+    # As notas (única dependência da Avaliacao) já foram apagadas e não há sinais de exclusão
+    return Avaliacao.objects.filter(pk__in=ids)._raw_delete(avaliacoes.db)
+
+
+def histogramas_por_turma(disciplina_pessoa_ids):
+    """
+    Lê os histogramas das turmas informadas (uma consulta, no máximo ~21 linhas por
+    turma e categoria). Retorna {disciplina_pessoa_id: {categoria_id: {nota: qtde}}}.
+    """
+    histogramas = defaultdict(lambda: defaultdict(dict))
+    for linha in HistogramaNota.objects.filter(disciplina_pessoa_id__in=disciplina_pessoa_ids).values(
+        'disciplina_pessoa_id', 'categoria_id', 'nota', 'qtde'
+    ):
+        histogramas[linha['disciplina_pessoa_id']][linha['categoria_id']][linha['nota']] = linha['qtde']
+    return histogramas
+
+
+def estatisticas_histograma(histograma):
+    """
+    Estatísticas exatas de um histograma {nota: qtde}, sem expandir as notas:
+    qtde, min, q1, mediana, q3, max, média e desvio padrão (populacional).
+    Os quartis usam interpolação linear (mesmo método padrão do box plot do gráfico).
+    Retorna None para um histograma vazio.
+    """
+    faixas = sorted((float(nota), qtde) for nota, qtde in histograma.items() if qtde > 0)
+    total = sum(qtde for _, qtde in faixas)
+    if total == 0:
+        return None
+
+    def valor_na_posicao(indice):
+        acumulado = 0
+        for nota, qtde in faixas:
+            acumulado += qtde
+            if indice < acumulado:
+                return nota
+        return faixas[-1][0]
+
+    def quantil(p):
+        posicao = (total - 1) * p
+        abaixo = math.floor(posicao)
+        valor = valor_na_posicao(abaixo)
+        fracao = posicao - abaixo
+        return valor if fracao == 0 else valor + fracao * (valor_na_posicao(abaixo + 1) - valor)
+
+    media = sum(nota * qtde for nota, qtde in faixas) / total
+    variancia = sum(qtde * (nota - media) ** 2 for nota, qtde in faixas) / total
+    return {
+        'qtde': total,
+        'min': faixas[0][0],
+        'q1': quantil(0.25),
+        'mediana': quantil(0.5),
+        'q3': quantil(0.75),
+        'max': faixas[-1][0],
+        'media': media,
+        'desvio_padrao': math.sqrt(variancia),
+    }
+
+
+def somar_histogramas(histogramas):
+    """Junta vários histogramas {nota: qtde} em um só (ex.: todas as turmas do professor)."""
+    total = defaultdict(int)
+    for histograma in histogramas:
+        for nota, qtde in histograma.items():
+            total[nota] += qtde
+    return dict(total)
+
+
+def resumo_universidade():
+    """
+    Números gerais da universidade lidos da linha única de MediaUniversidade
+    (uma consulta por chave primária, independente do volume de avaliações).
+    Antes da primeira avaliação (ou do rebuild_aggregates) devolve zeros.
+    """
+    universidade = MediaUniversidade.objects.filter(pk=UNIVERSIDADE_PK).values(
+        'media', 'qtde_avaliacoes', 'qtde_professores', 'qtde_disciplinas'
+    ).first()
+    return universidade or {
+        'media': Decimal('0'), 'qtde_avaliacoes': 0, 'qtde_professores': 0, 'qtde_disciplinas': 0,
+    }
+
+
+# =======================================================
+# RECÁLCULO COMPLETO (usado pelo comando rebuild_aggregates)
+# =======================================================
+
+def calcular_turmas(disciplina_pessoa_ids, categoria_ids):
+    """
+    Recalcula do zero, a partir da AvaliacaoCategoria, os agregados das turmas informadas
+    usando UMA consulta GROUP BY (as categorias viram colunas com agregação filtrada)
+    e mais uma agrupada por nota para os histogramas.
+    Retorna no mesmo formato usado por _propagar (com deltas positivos).
+    """
+    colunas = {}
+    for cat_id in categoria_ids:
+        colunas[f'soma_{cat_id}'] = Sum('nota', filter=Q(categoria_id=cat_id))
+        colunas[f'qtde_{cat_id}'] = Count('id', filter=Q(categoria_id=cat_id))
+
+    linhas = AvaliacaoCategoria.objects.filter(
+        avaliacao__disciplina_pessoa_id__in=disciplina_pessoa_ids
+    ).values(
+        'avaliacao__disciplina_pessoa_id', 'avaliacao__disciplina_pessoa__pessoa_id',
+        'avaliacao__disciplina_pessoa__disciplina_id'
+    ).annotate(
+        avaliacoes=Count('avaliacao_id', distinct=True), **colunas
+    ).order_by()
+
+    turmas = {}
+    for linha in linhas:
+        # dict simples (sem defaultdict) para poder ser devolvido pelos workers do pool
+        turma = {
+            'pessoa_id': linha['avaliacao__disciplina_pessoa__pessoa_id'],
+            'disciplina_id': linha['avaliacao__disciplina_pessoa__disciplina_id'],
+            'avaliacoes': linha['avaliacoes'],
+            'categorias': {},
+            'notas': {},
+        }
+        for cat_id in categoria_ids:
+            if linha[f'qtde_{cat_id}']:
+                turma['categorias'][cat_id] = [linha[f'soma_{cat_id}'], linha[f'qtde_{cat_id}']]
+        turmas[linha['avaliacao__disciplina_pessoa_id']] = turma
+
+    # Segunda consulta do lote: contagem por nota para o HistogramaNota
+    for linha in AvaliacaoCategoria.objects.filter(
+        avaliacao__disciplina_pessoa_id__in=turmas.keys()
+    ).values(
+        'avaliacao__disciplina_pessoa_id', 'categoria_id', 'nota'
+    ).annotate(qtde=Count('id')).order_by():
+        turma = turmas[linha['avaliacao__disciplina_pessoa_id']]
+        turma['notas'][(linha['categoria_id'], linha['nota'])] = linha['qtde']
+    return turmas
+
+
+def assinatura_notas(disciplina_pessoa_ids):
+    """
+    (quantidade, maior id) das notas das turmas: muda com qualquer avaliação criada ou
+    apagada nelas (as notas não são editadas). Serve para saber se um cálculo feito fora
+    da transação de escrita ainda vale.
+    """
+    totais = AvaliacaoCategoria.objects.filter(
+        avaliacao__disciplina_pessoa_id__in=disciplina_pessoa_ids
+    ).aggregate(qtde=Count('id'), maior=Max('id'))
+    return totais['qtde'], totais['maior']
+
+
+def regravar_turmas(disciplina_pessoa_ids, categoria_ids, assinatura=None, turmas=None):
+    """
+    Chamar dentro da transação de escrita: grava os agregados das turmas recalculados.
+    `turmas` calculadas antes (fora da transação, ex.: num worker) só são aproveitadas se a
+    `assinatura` lida antes do cálculo ainda for a atual; senão o lote é recalculado aqui,
+    com o lock, para que uma avaliação gravada no meio não seja sobrescrita.
+    Devolve True se recalculou.
+    """
+    recalculou = turmas is None or assinatura_notas(disciplina_pessoa_ids) != assinatura
+    if recalculou:
+        turmas = calcular_turmas(disciplina_pessoa_ids, categoria_ids)
+    gravar_turmas(disciplina_pessoa_ids, turmas)
+    return recalculou
+
+
+def gravar_turmas(disciplina_pessoa_ids, turmas):
+    """Substitui as linhas de MediaDisciplina(+Categoria) e HistogramaNota das turmas pelos valores recalculados."""
+    HistogramaNota.objects.filter(disciplina_pessoa_id__in=disciplina_pessoa_ids).delete()
+    MediaDisciplinaCategoria.objects.filter(disciplina_pessoa_id__in=disciplina_pessoa_ids).delete()
+    MediaDisciplina.objects.filter(disciplina_pessoa_id__in=disciplina_pessoa_ids).delete()
+
+    medias = []
+    medias_categoria = []
+    histogramas = []
+    for dp_id, turma in turmas.items():
+        for (cat_id, nota), qtde in turma['notas'].items():
+            histogramas.append(HistogramaNota(disciplina_pessoa_id=dp_id, categoria_id=cat_id, nota=nota, qtde=qtde))
+        soma = sum((s for s, _ in turma['categorias'].values()), Decimal('0'))
+        qtde = sum(q for _, q in turma['categorias'].values())
+        # A pontuação do ranking é preenchida no fim, por gravar_professores_e_universidade
+        medias.append(MediaDisciplina(
+            disciplina_pessoa_id=dp_id, disciplina_id=turma['disciplina_id'], soma_notas=soma, qtde_notas=qtde,
+            qtde_avaliacoes=turma['avaliacoes'], media=_media(soma, qtde),
+        ))
+        for cat_id, (soma_cat, qtde_cat) in turma['categorias'].items():
+            medias_categoria.append(MediaDisciplinaCategoria(
+                disciplina_pessoa_id=dp_id, categoria_id=cat_id, soma_notas=soma_cat,
+                qtde_avaliacoes=qtde_cat, media=_media(soma_cat, qtde_cat),
+            ))
+    MediaDisciplina.objects.bulk_create(medias)
+    MediaDisciplinaCategoria.objects.bulk_create(medias_categoria)
+    HistogramaNota.objects.bulk_create(histogramas)
+
+
+def totais_professores():
+    """
+    Soma as MediaDisciplina por professor (GROUP BY sobre a tabela de turmas, não sobre as notas).
+    Retorna {pessoa_id: {'soma_notas', 'qtde_notas', 'qtde_avaliacoes', 'qtde_disciplinas'}}.
+    """
+    linhas = MediaDisciplina.objects.values('disciplina_pessoa__pessoa_id').annotate(
+        soma=Sum('soma_notas'), qtde=Sum('qtde_notas'), avaliacoes=Sum('qtde_avaliacoes'), disciplinas=Count('id')
+    ).order_by()
+    return {
+        linha['disciplina_pessoa__pessoa_id']: {
+            'soma_notas': linha['soma'],
+            'qtde_notas': linha['qtde'],
+            'qtde_avaliacoes': linha['avaliacoes'],
+            'qtde_disciplinas': linha['disciplinas'],
+        }
+        for linha in linhas
+    }
+
+
+def totais_universidade(professores):
+    """Soma os totais por professor (saída de totais_professores) na visão da universidade."""
+    totais = {
+        'soma_notas': sum((p['soma_notas'] for p in professores.values()), Decimal('0')),
+        'qtde_notas': sum(p['qtde_notas'] for p in professores.values()),
+        'qtde_avaliacoes': sum(p['qtde_avaliacoes'] for p in professores.values()),
+        'qtde_disciplinas': sum(p['qtde_disciplinas'] for p in professores.values()),
+        'qtde_professores': len(professores),
+    }
+    totais['media'] = _media(totais['soma_notas'], totais['qtde_notas'])
+    return totais
+
+
+def gravar_professores_e_universidade(tamanho_lote=500):
+    """
+    Reconstrói MediaProfessor e MediaUniversidade a partir das MediaDisciplina já gravadas
+    e recalcula as pontuações do ranking com a nova média geral. Os totais são lidos dentro
+    da transação, para não perder uma avaliação gravada entre a leitura e a escrita.
+    """
+    with transaction.atomic():
+        professores = totais_professores()
+        universidade = totais_universidade(professores)
+        MediaProfessor.objects.all().delete()
+        MediaProfessor.objects.bulk_create(
+            [
+                MediaProfessor(pessoa_id=pessoa_id, media=_media(t['soma_notas'], t['qtde_notas']), **t)
+                for pessoa_id, t in professores.items()
+            ],
+            batch_size=tamanho_lote,
+        )
+        MediaUniversidade.objects.update_or_create(
+            pk=UNIVERSIDADE_PK, defaults={**universidade, 'media_ranking': universidade['media']}
+        )
+        ranking.recalcular_pontuacoes(universidade['media'])
+    return professores
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class AvaliacoesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'avaliacoes'
+
+    def ready(self):
+        # Registra os receivers que invalidam o índice das sugestões e o registro de categorias
+        from . import autocompletar, categorias  # noqa: F401
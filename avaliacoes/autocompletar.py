@@ -0,0 +1,171 @@
+# avaliacoes/autocompletar.py
+"""
+Índice em memória (por processo) para as APIs de sugestão (autocomplete).
+
+Cada nome normalizado gera uma chave por sufixo de palavras ("joao carlos silva",
+"carlos silva", "silva"), guardadas numa lista ordenada. Uma busca por prefixo vira
+duas buscas binárias (bisect), sem tocar no banco. As sugestões saem ordenadas pela
+quantidade de avaliações.
+
+Fica separado do índice FTS (avaliacoes/busca.py) porque é chamado a cada tecla: trocar
+uma consulta por requisição por uma busca em memória é o objetivo. As páginas de busca
+usam o FTS, que está sempre em dia com o banco.
+
+O índice é montado na primeira busca (3 consultas) e remontado quando:
+- a versão no cache muda: save/delete de Materia, Professor ou do nome de um
+  CustomUser incrementa o contador (ver os receivers no fim do arquivo);
+- passa de AUTOCOMPLETAR_TTL segundos, para atualizar as contagens de avaliações.
+
+O contador fica no cache padrão do Django, que sem CACHES configurado é local de cada
+processo: a invalidação só alcança o processo que salvou o nome, e os demais o veem
+quando o TTL vence. Com um cache compartilhado (Redis/Memcached) todos remontam na
+próxima busca.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CustomUser, MediaDisciplina, Materia, Professor, normalizar_busca
+
+CHAVE_VERSAO = 'avaliacoes:autocompletar:versao'
+
+# Tempo máximo (segundos) até remontar o índice para atualizar as contagens
+TTL = getattr(settings, 'AUTOCOMPLETAR_TTL', 300)
+
+
+@dataclass
+class _Indice:
+    """Lista ordenada de (chave, posição do nome) + nomes e pesos."""
+    chaves: list = field(default_factory=list)
+    posicoes: list = field(default_factory=list)
+    nomes: list = field(default_factory=list)
+    pesos: list = field(default_factory=list)
+
+    @classmethod
+    def montar(cls, itens):
+        """`itens` = [(nome_exibido, qtde_avaliacoes)]."""
+        indice = cls()
+        entradas = []
+        for nome, peso in itens:
+            palavras = normalizar_busca(nome).split()
+            if not palavras:
+                continue
+            posicao = len(indice.nomes)
+            indice.nomes.append(nome)
+            indice.pesos.append(peso)
+            entradas += [(' '.join(palavras[i:]), posicao) for i in range(len(palavras))]
+        entradas.sort()
+        indice.chaves = [chave for chave, _ in entradas]
+        indice.posicoes = [posicao for _, posicao in entradas]
+        return indice
+
+    def buscar(self, termo, limite):
+        prefixo = normalizar_busca(termo)
+        if not prefixo:
+            return []
+        inicio = bisect_left(self.chaves, prefixo)
+        fim = bisect_left(self.chaves, prefixo + '\uffff', inicio)
+        encontrados = set(self.posicoes[inicio:fim])
+        melhores = sorted(encontrados, key=lambda p: (-self.pesos[p], self.nomes[p]))
+
+        # Nomes repetidos (ex.: duas matérias com o mesmo nome) aparecem uma vez só
+        return list(dict.fromkeys(self.nomes[p] for p in melhores))[:limite]
+
+
+_lock = threading.Lock()
+_estado = {'versao': None, 'montado_em': 0.0, 'professores': None, 'disciplinas': None}
+
+
+def _versao_atual():
+    return cache.get(CHAVE_VERSAO, 0)
+
+
+def _montar():
+    professores = _Indice.montar(
+        (
+            f"{p['user__first_name']} {p['user__last_name']}".strip(),
+            p['user__media_professor__qtde_avaliacoes'] or 0,
+        )
+        for p in Professor.objects.values(
+            'user__first_name', 'user__last_name', 'user__media_professor__qtde_avaliacoes'
+        )
+    )
+    avaliacoes_por_materia = dict(
+        MediaDisciplina.objects.values('disciplina_id').annotate(
+            total=Sum('qtde_avaliacoes')
+        ).values_list('disciplina_id', 'total')
+    )
+    disciplinas = _Indice.montar(
+        (nome, avaliacoes_por_materia.get(pk, 0))
+        for pk, nome in Materia.objects.values_list('pk', 'nome')
+    )
+    return professores, disciplinas
+
+
+def _indices():
+    """Devolve (professores, disciplinas), remontando se a versão mudou ou o TTL venceu."""
+    versao = _versao_atual()
+    if _estado['versao'] == versao and time.monotonic() - _estado['montado_em'] < TTL:
+        return _estado['professores'], _estado['disciplinas']
+
+    with _lock:
+        # Outra thread pode ter remontado enquanto esperávamos o lock
+        if _estado['versao'] != versao or time.monotonic() - _estado['montado_em'] >= TTL:
+            professores, disciplinas = _montar()
+            _estado.update(
+                versao=versao, montado_em=time.monotonic(),
+                professores=professores, disciplinas=disciplinas,
+            )
+        return _estado['professores'], _estado['disciplinas']
+
+
+def sugerir_professores(termo, limite=10):
+    return _indices()[0].buscar(termo, limite)
+
+
+def sugerir_disciplinas(termo, limite=10):
+    return _indices()[1].buscar(termo, limite)
+
+
+def invalidar():
+    """
+    Incrementa a versão: este processo remonta o índice na próxima busca, e os demais
+    também se o cache for compartilhado (senão, quando o AUTOCOMPLETAR_TTL vencer).
+    """
+    cache.add(CHAVE_VERSAO, 0, timeout=None)
+    try:
+        cache.incr(CHAVE_VERSAO)
+    except ValueError:
+        # A chave expirou/foi despejada entre o add e o incr
+        cache.set(CHAVE_VERSAO, 1, timeout=None)
+
+
+def _invalidar_no_commit():
+    # Só depois do commit: antes disso outro processo remontaria com os dados antigos
+    transaction.on_commit(invalidar)
+
+
+@receiver(post_save, sender=Materia)
+@receiver(post_delete, sender=Materia)
+@receiver(post_save, sender=Professor)
+@receiver(post_delete, sender=Professor)
+def _materia_ou_professor_alterado(sender, **kwargs):
+    _invalidar_no_commit()
+
+
+@receiver(post_save, sender=CustomUser)
+def _usuario_alterado(sender, instance, update_fields=None, **kwargs):
+    # Saves parciais que não mexem no nome (ex.: last_login no login) não invalidam
+    if update_fields is not None and not {'first_name', 'last_name'} & set(update_fields):
+        return
+    if instance.user_type == 'professor':
+        _invalidar_no_commit()
@@ -0,0 +1,220 @@
+# avaliacoes/benchmark.py
+"""
+Benchmark das views mais usadas, sobre dados gerados pelo seed_data.
+
+Usado pelo comando `python manage.py benchmark` (que cria um banco de teste
+descartável, como o `manage.py test`) e pelo teste BenchmarkTests em tests.py:
+
+1. Para cada tamanho pedido (DATASETS: small, medium, large), o banco é populado
+   com `seed_data` com semente fixa, ou seja, sempre os mesmos dados.
+2. Cada cenário (CENARIOS) é chamado pelo Client de teste do Django: algumas
+   requisições de aquecimento e depois `repeticoes` medidas.
+3. Por cenário: latência p50/p95 (ms), número de consultas SQL e tempo total de SQL
+   (medido com connection.execute_wrapper), além das respostas que não foram 2xx.
+4. O resultado vira um dicionário serializável em JSON; comparar() aponta as
+   regressões em relação a um resultado anterior guardado como referência (baseline).
+"""
+
+import platform
+import time
+from dataclasses import dataclass
+from io import StringIO
+from statistics import median
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, Exists, OuterRef
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import autocompletar, categorias
+from .models import Aluno, Avaliacao, CustomUser, MatriculaAluno, Professor
+
+# Opções do seed_data para cada tamanho
+DATASETS = {
+    'small': {'professors': 15, 'disciplines': 10, 'ratings': 500},
+    'medium': {'professors': 200, 'disciplines': 40, 'ratings': 20_000},
+    'large': {'professors': 1000, 'disciplines': 100, 'ratings': 200_000},
+}
+SEMENTE = 42
+REPETICOES = 20
+AQUECIMENTO = 2
+
+# Regressão: p95 acima de (1 + TOLERANCIA) vezes a referência E pelo menos
+# TOLERANCIA_MS mais lento (abaixo disso é ruído), ou consultas a mais
+TOLERANCIA = 0.2
+TOLERANCIA_MS = 2.0
+
+
+@dataclass
+class Cenario:
+    nome: str
+    metodo: str
+    # Recebe o Contexto e o número da repetição; devolve (url, corpo ou None, usuário logado)
+    montar: object
+
+
+@dataclass
+class Contexto:
+    """Objetos do dataset usados pelos cenários, buscados uma vez antes das medições."""
+    aluno: CustomUser
+    professor_popular: Professor
+    matriculas_sem_avaliacao: list  # [(CustomUser do aluno, disciplina_pessoa_id)]
+
+
+def _corpo_avaliacao(contexto, i):
+    usuario, disciplina_pessoa_id = contexto.matriculas_sem_avaliacao[i]
+    corpo = {'disciplina_pessoa_id': disciplina_pessoa_id}
+    corpo.update({categoria.slug: 7.5 for categoria in categorias.registro()})
+    return reverse('salvar_avaliacao_api'), corpo, usuario
+
+
+# Os de escrita ficam por último: as leituras medem sempre o mesmo banco
+CENARIOS = [
+    Cenario('lista_professores', 'get', lambda c, i: (reverse('lista_professores'), None, c.aluno)),
+    Cenario('detalhes_professor', 'get', lambda c, i: (
+        reverse('detalhes_professor', args=[c.professor_popular.pk]), None, c.aluno
+    )),
+    Cenario('ranking_geral', 'get', lambda c, i: (reverse('ranking_geral'), None, c.aluno)),
+    Cenario('salvar_avaliacao_api', 'post', _corpo_avaliacao),
+]
+
+
+class _ContadorSQL:
+    """execute_wrapper que conta as consultas e soma o tempo delas (o connection.queries
+    do Django arredonda cada tempo para milissegundos, e consultas rápidas viram 0)."""
+
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.consultas += 1
+
+
+def _percentil(valores, p):
+    # Nearest-rank: o menor valor com pelo menos p% das amostras abaixo ou iguais
+    ordenados = sorted(valores)
+    posicao = max(0, min(len(ordenados) - 1, -(-len(ordenados) * p // 100) - 1))
+    return ordenados[int(posicao)]
+
+
+def popular(dataset, semente=SEMENTE):
+    """Recria os dados do tamanho `dataset` com o seed_data."""
+    call_command('seed_data', seed=semente, stdout=StringIO(), **DATASETS[dataset])
+    # Dentro de um TestCase o on_commit não dispara: os registros em memória são zerados aqui
+    categorias.invalidar()
+    autocompletar.invalidar()
+
+
+def _contexto(repeticoes):
+    # O professor com mais avaliações é o pior caso de detalhes_professor
+    professor_popular = Professor.objects.select_related('user').annotate(
+        total=Count('user__disciplinas_pessoa__avaliacoes')
+    ).order_by('-total', 'pk').first()
+    aluno = Aluno.objects.select_related('user').order_by('pk').first().user
+    # Matrículas ainda sem avaliação: cada POST de salvar_avaliacao_api grava uma nova
+    # (um aluno diferente por repetição, para não esbarrar no unique_together)
+    pendentes = list(
+        MatriculaAluno.objects.filter(~Exists(Avaliacao.objects.filter(
+            aluno_id=OuterRef('aluno_id'), disciplina_pessoa_id=OuterRef('disciplina_professor_id')
+        )))
+        .select_related('aluno__user').order_by('pk')[:repeticoes + AQUECIMENTO]
+    )
+    return Contexto(
+        aluno=aluno,
+        professor_popular=professor_popular,
+        matriculas_sem_avaliacao=[(m.aluno.user, m.disciplina_professor_id) for m in pendentes],
+    )
+
+
+def medir(cenario, contexto, repeticoes=REPETICOES):
+    """Roda o cenário e devolve as estatísticas (tempos em ms)."""
+    client = Client()
+    usuario_logado = None
+    latencias, consultas, tempos_sql, erros = [], [], [], 0
+
+    for i in range(AQUECIMENTO + repeticoes):
+        url, corpo, usuario = cenario.montar(contexto, i)
+        if usuario != usuario_logado:
+            # Login fora da medição; a sessão/usuário de cada requisição continuam contando
+            client.force_login(usuario)
+            usuario_logado = usuario
+        argumentos = {'data': corpo, 'content_type': 'application/json'} if corpo is not None else {}
+
+        contador = _ContadorSQL()
+        with connection.execute_wrapper(contador):
+            inicio = time.perf_counter()
+            resposta = getattr(client, cenario.metodo)(url, **argumentos)
+            duracao = time.perf_counter() - inicio
+        if i < AQUECIMENTO:
+            continue
+        if not 200 <= resposta.status_code < 300:
+            erros += 1
+        latencias.append(duracao * 1000)
+        consultas.append(contador.consultas)
+        tempos_sql.append(contador.segundos * 1000)
+
+    return {
+        'repeticoes': repeticoes,
+        'p50_ms': round(_percentil(latencias, 50), 3),
+        'p95_ms': round(_percentil(latencias, 95), 3),
+        'consultas': max(consultas),
+        'consultas_mediana': median(consultas),
+        'tempo_sql_ms': round(median(tempos_sql), 3),
+        'erros': erros,
+    }
+
+
+def executar(datasets=('small',), repeticoes=REPETICOES, cenarios=None, semente=SEMENTE, progresso=None):
+    """
+    Popula cada dataset e mede os cenários (todos, ou só os nomes em `cenarios`).
+    `progresso(dataset, cenario, resultado)` é chamado depois de cada medição.
+    Devolve o dicionário do resultado (ver comparar()).
+    """
+    resultado = {
+        'gerado_em': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'semente': semente,
+        'datasets': {},
+    }
+    for dataset in datasets:
+        popular(dataset, semente)
+        contexto = _contexto(repeticoes)
+        medidas = resultado['datasets'][dataset] = {}
+        for cenario in CENARIOS:
+            if cenarios and cenario.nome not in cenarios:
+                continue
+            medidas[cenario.nome] = medir(cenario, contexto, repeticoes)
+            if progresso:
+                progresso(dataset, cenario.nome, medidas[cenario.nome])
+    return resultado
+
+
+def comparar(atual, referencia, tolerancia=TOLERANCIA, tolerancia_ms=TOLERANCIA_MS):
+    """
+    Regressões de `atual` em relação a `referencia` (ambos no formato de executar()),
+    só para os pares dataset/cenário presentes nos dois. Lista de mensagens.
+    """
+    regressoes = []
+    for dataset, medidas in atual['datasets'].items():
+        for nome, medida in medidas.items():
+            base = referencia.get('datasets', {}).get(dataset, {}).get(nome)
+            if base is None:
+                continue
+            if (medida['p95_ms'] > base['p95_ms'] * (1 + tolerancia)
+                    and medida['p95_ms'] - base['p95_ms'] > tolerancia_ms):
+                regressoes.append(
+                    f"{dataset}/{nome}: p95 {medida['p95_ms']:.1f} ms (referência {base['p95_ms']:.1f} ms)"
+                )
+            if medida['consultas'] > base['consultas']:
+                regressoes.append(
+                    f"{dataset}/{nome}: {medida['consultas']} consultas (referência {base['consultas']})"
+                )
+    return regressoes
@@ -0,0 +1,116 @@
+# avaliacoes/busca.py
+"""
+Busca textual (FTS5 do SQLite) sobre nomes de professores, nomes de matérias e comentários.
+
+As tabelas virtuais são criadas pela migração 0011_busca_fts e mantidas por TRIGGERS no
+próprio banco, então qualquer escrita (save, update(), bulk_create, delete em cascata)
+atualiza o índice na mesma transação:
+
+- busca_professor  (rowid = Professor.id)  -> "first_name last_name" do usuário
+- busca_materia    (rowid = Materia.id)    -> Materia.nome
+- busca_comentario (rowid = Avaliacao.id)  -> Avaliacao.comentario (conteúdo externo:
+  o texto não é duplicado, o índice aponta para a própria tabela de avaliações)
+
+O tokenizador remove acentos ("quimica" acha "Química") e cada palavra digitada vira
+um prefixo ("prog web" acha "Programação Web"). Os resultados vêm ordenados por
+relevância (bm25). Fora do SQLite as funções caem para icontains, sem ranking.
+
+É a única busca do servidor sobre esses nomes (lista_professores, comparação, /api/busca/).
+As sugestões enquanto o usuário digita vêm de avaliacoes/autocompletar.py, que responde
+da memória sem consultar o banco; as duas casam o início das palavras, sem acento.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from unidecode import unidecode
+
+from .models import Avaliacao, Materia, Professor
+
+# Tabela FTS -> (modelo, campos usados no fallback sem FTS)
+_TABELAS = {
+    'busca_professor': (Professor, ('user__first_name', 'user__last_name')),
+    'busca_materia': (Materia, ('nome',)),
+    'busca_comentario': (Avaliacao, ('comentario',)),
+}
+
+
+def fts_disponivel():
+    return connection.vendor == 'sqlite'
+
+
+def expressao_fts(termo):
+    """
+    Converte o texto digitado numa consulta FTS5 segura: cada palavra vira "palavra"*
+    (prefixo, entre aspas para neutralizar operadores como AND, NEAR, -, :).
+    Retorna None se não sobrar nenhuma palavra.
+    """
+    palavras = re.findall(r'\w+', unidecode(termo or '').lower())
+    if not palavras:
+        return None
+    return ' '.join(f'"{palavra}"*' for palavra in palavras)
+
+
+def _fallback(tabela, termo):
+    modelo, campos = _TABELAS[tabela]
+    filtro = Q()
+    for palavra in termo.split():
+        q_palavra = Q()
+        for campo in campos:
+            q_palavra |= Q(**{f'{campo}__icontains': palavra})
+        filtro &= q_palavra
+    return modelo.objects.filter(filtro)
+
+
+def _ids_ranqueados(tabela, expressao, limite):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {tabela} WHERE {tabela} MATCH %s ORDER BY rank LIMIT %s',
+            [expressao, limite],
+        )
+        return [linha[0] for linha in cursor.fetchall()]
+
+
+def _buscar(tabela, termo, limite, queryset=None):
+    """Top `limite` objetos por relevância: 1 consulta no índice + 1 para carregar os objetos."""
+    modelo, _ = _TABELAS[tabela]
+    queryset = queryset if queryset is not None else modelo.objects.all()
+    expressao = expressao_fts(termo)
+    if expressao is None:
+        return []
+    if not fts_disponivel():
+        return list(_fallback(tabela, termo).filter(pk__in=queryset.values('pk'))[:limite])
+
+    ids = _ids_ranqueados(tabela, expressao, limite)
+    objetos = queryset.in_bulk(ids)
+    return [objetos[pk] for pk in ids if pk in objetos]
+
+
+def filtro_busca(tabela, termo, campo='pk'):
+    """
+    Q que restringe `campo` aos ids que casam com `termo` (sem ranking), para compor com
+    outros filtros numa única consulta. Termo vazio não filtra nada.
+    """
+    expressao = expressao_fts(termo)
+    if expressao is None:
+        return Q()
+    if not fts_disponivel():
+        return Q(**{f'{campo}__in': _fallback(tabela, termo).values('pk')})
+    return Q(**{f'{campo}__in': RawSQL(f'SELECT rowid FROM {tabela} WHERE {tabela} MATCH %s', [expressao])})
+
+
+def buscar_professores(termo, limite=20):
+    return _buscar('busca_professor', termo, limite, Professor.objects.select_related('user'))
+
+
+def buscar_materias(termo, limite=20):
+    return _buscar('busca_materia', termo, limite)
+
+
+def buscar_comentarios(termo, limite=50):
+    return _buscar(
+        'busca_comentario', termo, limite,
+        Avaliacao.objects.select_related('disciplina_pessoa__pessoa', 'disciplina_pessoa__disciplina'),
+    )
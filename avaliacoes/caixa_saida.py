@@ -0,0 +1,157 @@
+# avaliacoes/caixa_saida.py
+"""
+Caixa de saída de e-mails (modelo EmailPendente).
+
+Antes, o cadastro de usuários (views.adicionar_usuario e o admin) enviava o e-mail pelo
+SMTP do Gmail dentro da requisição: segundos de espera e uma conexão nova por mensagem.
+Agora:
+
+1. As views só chamam enfileirar(): um INSERT, na mesma transação que cria o usuário
+   (se o cadastro for desfeito, o e-mail some junto).
+2. O comando `python manage.py send_outbox` (worker) chama enviar_pendentes(), que
+   envia em lotes por UMA conexão SMTP aberta e reaproveitada entre as mensagens.
+3. Falhas voltam para a fila com espera exponencial (EMAIL_ESPERA_INICIAL * 2^tentativas,
+   até EMAIL_ESPERA_MAXIMA). Depois de EMAIL_MAX_TENTATIVAS o e-mail fica como 'falhou',
+   com o último erro gravado para consulta no admin.
+
+Rode um worker só: as linhas não são "reservadas", dois workers enviariam em dobro.
+"""
+
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.forms import PasswordResetForm
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import loader
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from .models import EmailPendente
+
+logger = logging.getLogger(__name__)
+
+MAX_TENTATIVAS = getattr(settings, 'EMAIL_MAX_TENTATIVAS', 5)
+ESPERA_INICIAL = getattr(settings, 'EMAIL_ESPERA_INICIAL', 60)  # segundos
+ESPERA_MAXIMA = getattr(settings, 'EMAIL_ESPERA_MAXIMA', 60 * 60)
+TAMANHO_LOTE = 50
+
+
+def enfileirar(assunto, corpo, destinatarios, corpo_html=None, remetente=''):
+    """Grava o e-mail na caixa de saída. Não envia nada."""
+    return EmailPendente.objects.create(
+        assunto=assunto, corpo=corpo, corpo_html=corpo_html,
+        remetente=remetente or '', destinatarios=list(destinatarios),
+    )
+
+
+TEMPLATE_ASSUNTO_SENHA = 'avaliacoes/password_reset_subject.txt'
+TEMPLATE_CORPO_SENHA = 'avaliacoes/password_reset_email.html'
+
+
+def _renderizar(subject_template_name, email_template_name, context, html_email_template_name=None):
+    # Mesma montagem do PasswordResetForm.send_mail do Django
+    assunto = ''.join(loader.render_to_string(subject_template_name, context).splitlines())
+    corpo = loader.render_to_string(email_template_name, context)
+    corpo_html = (
+        loader.render_to_string(html_email_template_name, context)
+        if html_email_template_name else None
+    )
+    return assunto, corpo, corpo_html
+
+
+class RedefinicaoSenhaEnfileirada(PasswordResetForm):
+    """PasswordResetForm que coloca o e-mail na caixa de saída em vez de enviar na hora."""
+
+    def send_mail(self, subject_template_name, email_template_name, context, from_email,
+                  to_email, html_email_template_name=None):
+        assunto, corpo, corpo_html = _renderizar(
+            subject_template_name, email_template_name, context, html_email_template_name
+        )
+        enfileirar(assunto, corpo, [to_email], corpo_html=corpo_html, remetente=from_email)
+
+
+def email_definir_senha(usuario, dominio, usar_https=False):
+    """
+    EmailPendente NÃO salvo com o link para o usuário definir a senha (o mesmo e-mail do
+    cadastro individual). Para cadastros em lote, que gravam vários com bulk_create.
+    """
+    contexto = {
+        'email': usuario.email,
+        'domain': dominio,
+        'site_name': dominio,
+        'uid': urlsafe_base64_encode(force_bytes(usuario.pk)),
+        'user': usuario,
+        'token': default_token_generator.make_token(usuario),
+        'protocol': 'https' if usar_https else 'http',
+    }
+    assunto, corpo, corpo_html = _renderizar(TEMPLATE_ASSUNTO_SENHA, TEMPLATE_CORPO_SENHA, contexto)
+    return EmailPendente(
+        assunto=assunto, corpo=corpo, corpo_html=corpo_html, remetente='',
+        destinatarios=[usuario.email],
+    )
+
+
+def _espera(tentativas):
+    return timedelta(seconds=min(ESPERA_INICIAL * 2 ** (tentativas - 1), ESPERA_MAXIMA))
+
+
+def _mensagem(pendente, conexao):
+    mensagem = EmailMultiAlternatives(
+        subject=pendente.assunto,
+        body=pendente.corpo,
+        from_email=pendente.remetente or None,
+        to=pendente.destinatarios,
+        connection=conexao,
+    )
+    if pendente.corpo_html:
+        mensagem.attach_alternative(pendente.corpo_html, 'text/html')
+    return mensagem
+
+
+def enviar_pendentes(conexao, tamanho_lote=TAMANHO_LOTE):
+    """
+    Envia até `tamanho_lote` e-mails vencidos pela `conexao` (já aberta; quem chama
+    decide quando fechar). Devolve (enviados, falhas).
+    """
+    agora = timezone.now()
+    lote = list(
+        EmailPendente.objects.filter(status=EmailPendente.PENDENTE, proxima_tentativa__lte=agora)
+        .order_by('proxima_tentativa', 'pk')[:tamanho_lote]
+    )
+
+    enviados = falhas = 0
+    for pendente in lote:
+        try:
+            _mensagem(pendente, conexao).send()
+        except Exception as erro:
+            falhas += 1
+            tentativas = pendente.tentativas + 1
+            desistir = tentativas >= MAX_TENTATIVAS
+            logger.warning('Falha ao enviar e-mail %s (tentativa %s): %s', pendente.pk, tentativas, erro)
+            # Cada resultado é gravado na hora (autocommit, sem transação longa):
+            # se o worker cair no meio do lote, só o e-mail em andamento é reenviado
+            EmailPendente.objects.filter(pk=pendente.pk).update(
+                tentativas=tentativas,
+                status=EmailPendente.FALHOU if desistir else EmailPendente.PENDENTE,
+                proxima_tentativa=timezone.now() + _espera(tentativas),
+                ultimo_erro=str(erro),
+            )
+            # A conexão pode ter caído (SMTPServerDisconnected etc.): reabre para o resto do lote
+            conexao.close()
+            conexao.open()
+        else:
+            enviados += 1
+            EmailPendente.objects.filter(pk=pendente.pk).update(
+                status=EmailPendente.ENVIADO, enviado_em=timezone.now(), ultimo_erro='',
+            )
+    return enviados, falhas
+
+
+def abrir_conexao():
+    """Conexão do EMAIL_BACKEND configurado, aberta uma vez e reaproveitada pelo worker."""
+    conexao = get_connection(fail_silently=False)
+    conexao.open()
+    return conexao
@@ -0,0 +1,121 @@
+# avaliacoes/categorias.py
+"""
+Registro das categorias de avaliação (Didática, Dificuldade, ...), carregado uma vez por processo.
+
+As views não procuram mais Categoria pelo nome a cada requisição. Elas pedem
+registro() e usam os ids direto nos filtros (categoria_id=...). Cada categoria também
+tem um slug ('didatica', 'carga_horaria', ...), que é a chave usada no JSON da API
+de avaliação e no gráfico. Assim, uma categoria nova cadastrada no admin aparece
+no formulário, no gráfico e na comparação sem mexer em código.
+
+Igual ao índice de sugestões (avaliacoes/autocompletar.py), o registro guarda a
+versão do cache com que foi montado e é recarregado quando:
+- a versão muda: save/delete de Categoria a incrementam no commit;
+- passa de CATEGORIAS_TTL segundos.
+
+A versão fica no cache padrão do Django, que sem CACHES configurado é local de cada
+processo: a invalidação só alcança o processo que salvou a categoria, e os demais a veem
+quando o TTL vence. Com um cache compartilhado (Redis/Memcached) todos recarregam na
+próxima consulta.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.text import slugify
+from unidecode import unidecode
+
+from .models import Categoria
+
+CHAVE_VERSAO = 'avaliacoes:categorias:versao'
+
+# Tempo máximo (segundos) que um processo usa o registro sem recarregar
+TTL = getattr(settings, 'CATEGORIAS_TTL', 60)
+
+
+def slug_categoria(nome):
+    # 'Carga Horária' -> 'carga_horaria' (um identificador válido também em JS)
+    return slugify(unidecode(nome)).replace('-', '_')
+
+
+@dataclass(frozen=True)
+class CategoriaInfo:
+    id: int
+    nome: str
+    slug: str
+
+
+class RegistroCategorias:
+    def __init__(self, categorias):
+        # Ordem de cadastro (pk): é a ordem do formulário e do gráfico
+        self.todas = tuple(categorias)
+        self.por_id = {c.id: c for c in self.todas}
+        self.por_nome = {c.nome: c for c in self.todas}
+        self.por_slug = {c.slug: c for c in self.todas}
+
+    def __iter__(self):
+        return iter(self.todas)
+
+    def __len__(self):
+        return len(self.todas)
+
+    def id_de(self, nome_ou_slug):
+        """Id da categoria pelo nome ('Didática') ou slug ('didatica'); None se não existir."""
+        categoria = self.por_nome.get(nome_ou_slug) or self.por_slug.get(nome_ou_slug)
+        return categoria.id if categoria else None
+
+    def como_lista(self):
+        """Formato serializável (ex.: para json.dumps no template)."""
+        return [{'id': c.id, 'nome': c.nome, 'slug': c.slug} for c in self.todas]
+
+
+_lock = threading.Lock()
+_estado = {'versao': None, 'carregado_em': 0.0, 'registro': None}
+
+
+def _atual(versao):
+    return _estado['versao'] == versao and time.monotonic() - _estado['carregado_em'] < TTL
+
+
+def registro():
+    """Registro atual; consulta o banco na primeira vez, após uma invalidação ou o TTL."""
+    versao = cache.get(CHAVE_VERSAO, 0)
+    if _atual(versao):
+        return _estado['registro']
+
+    with _lock:
+        # Outra thread pode ter recarregado enquanto esperávamos o lock
+        if not _atual(versao):
+            _estado['registro'] = RegistroCategorias(
+                CategoriaInfo(id=pk, nome=nome, slug=slug_categoria(nome))
+                for pk, nome in Categoria.objects.order_by('pk').values_list('pk', 'nome_categoria')
+            )
+            _estado.update(versao=versao, carregado_em=time.monotonic())
+        return _estado['registro']
+
+
+def invalidar():
+    """
+    Incrementa a versão: este processo recarrega na próxima consulta, e os demais também
+    se o cache for compartilhado (senão, quando o TTL vencer).
+    """
+    _estado['versao'] = None
+    cache.add(CHAVE_VERSAO, 0, timeout=None)
+    try:
+        cache.incr(CHAVE_VERSAO)
+    except ValueError:
+        # A chave expirou/foi despejada entre o add e o incr
+        cache.set(CHAVE_VERSAO, 1, timeout=None)
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def _categoria_alterada(sender, **kwargs):
+    # Só depois do commit: antes disso outro processo recarregaria os dados antigos
+    transaction.on_commit(invalidar)
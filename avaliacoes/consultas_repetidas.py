@@ -0,0 +1,171 @@
+# avaliacoes/consultas_repetidas.py
+"""
+Detector de N+1 para desenvolvimento e testes: acusa quando a mesma consulta (o mesmo
+"formato" de SQL, ignorando os valores) roda muitas vezes numa requisição. O caso típico
+é um template acessando uma relação sem select_related/prefetch_related dentro de um
+{% for %} (ex.: professor.user.disciplinas_pessoa.all em lista_professores.html).
+
+1. Cada SQL vira uma impressão digital (impressao_digital()): literais de texto e números
+   viram "?" e listas IN (...) de qualquer tamanho ficam iguais.
+2. O Detector (execute_wrapper) conta as impressões; na consulta que passa do limite
+   (CONSULTAS_REPETIDAS_LIMITE), guarda de onde ela veio: a linha do template que estava
+   sendo renderizada e a pilha de chamadas do código do projeto.
+3. No fim da requisição, ConsultasRepetidasMiddleware avisa no log
+   (CONSULTAS_REPETIDAS_ACAO = 'avisar', padrão com DEBUG) ou levanta ConsultaRepetida
+   ('erro', ligado nos testes pelo TEST_RUNNER, ver avaliacoes/executor_testes.py). Com
+   None (produção) o middleware se desliga.
+
+O erro é levantado no fim, e não no meio da consulta, porque várias views têm
+`except Exception` que o engoliriam.
+"""
+
+import logging
+import re
+import sys
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connection
+from django.template.base import TokenType
+
+from . import metricas, perfilamento
+
+logger = logging.getLogger(__name__)
+
+ACOES = ('avisar', 'erro')
+LIMITE = 5
+LINHAS_PILHA = 6
+
+_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTA_IN = re.compile(r'\bIN \((?:\s*(?:\?|%s)\s*,?)+\)', re.IGNORECASE)
+_ESPACOS = re.compile(r'\s+')
+
+
+class ConsultaRepetida(Exception):
+    """Uma requisição repetiu o mesmo formato de consulta acima do limite (N+1)."""
+
+
+def impressao_digital(sql):
+    """O SQL sem os valores: consultas que só mudam de parâmetro ficam iguais."""
+    sql = _TEXTO.sub('?', sql)
+    sql = _NUMERO.sub('?', sql)
+    sql = _LISTA_IN.sub('IN (...)', sql)
+    return _ESPACOS.sub(' ', sql).strip()
+
+
+@dataclass
+class Repeticao:
+    impressao: str
+    vezes: int
+    template: str = None  # "arquivo.html, linha N: {% ... %}" se veio de um template
+    pilha: list = field(default_factory=list)  # "arquivo.py:linha em função: código"
+
+
+def _linha_template():
+    """A linha do template sendo renderizada agora (o nó mais interno), ou None."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            no = frame.f_locals.get('self')
+            token, origem = getattr(no, 'token', None), getattr(no, 'origin', None)
+            if token is not None and origem is not None:
+                trecho = f'{{{{ {token.contents} }}}}' if token.token_type == TokenType.VAR else f'{{% {token.contents} %}}'
+                return f'{origem.template_name or origem.name}, linha {token.lineno}: {trecho}'
+        frame = frame.f_back
+    return None
+
+
+def _pilha_do_projeto():
+    """
+    As últimas chamadas em arquivos do projeto: sem Django, bibliotecas, manage.py e os
+    middlewares de instrumentação (este módulo, metricas e perfilamento).
+    """
+    base = Path(settings.BASE_DIR).resolve()
+    ignorados = {Path(modulo).resolve() for modulo in (__file__, metricas.__file__, perfilamento.__file__)}
+    ignorados.add(base / 'manage.py')
+    linhas = []
+    for quadro in traceback.extract_stack():
+        arquivo = Path(quadro.filename).resolve()
+        if arquivo in ignorados or base not in arquivo.parents or 'site-packages' in arquivo.parts:
+            continue
+        linhas.append(f'{arquivo.relative_to(base)}:{quadro.lineno} em {quadro.name}: {quadro.line}')
+    return linhas[-LINHAS_PILHA:]
+
+
+class Detector:
+    """
+    Conta as consultas da conexão por impressão digital enquanto ativo:
+
+        with Detector(limite=3) as detector:
+            ...
+        detector.repeticoes()
+    """
+
+    def __init__(self, limite=None, conexao=None):
+        self.limite = limite if limite is not None else getattr(settings, 'CONSULTAS_REPETIDAS_LIMITE', LIMITE)
+        self.conexao = conexao or connection
+        self.contagem = Counter()
+        self._origens = {}
+        self._pilha = ExitStack()
+
+    def __call__(self, execute, sql, params, many, context):
+        impressao = impressao_digital(sql)
+        self.contagem[impressao] += 1
+        if self.contagem[impressao] == self.limite + 1:
+            # Só a primeira consulta acima do limite: o custo de inspecionar a pilha fica limitado
+            self._origens[impressao] = (_linha_template(), _pilha_do_projeto())
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._pilha.enter_context(self.conexao.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *excecao):
+        return self._pilha.__exit__(*excecao)
+
+    def repeticoes(self):
+        """[Repeticao] das consultas acima do limite, da mais repetida para a menos."""
+        return sorted(
+            (Repeticao(impressao, self.contagem[impressao], *origem) for impressao, origem in self._origens.items()),
+            key=lambda repeticao: -repeticao.vezes,
+        )
+
+    def relatorio(self, onde):
+        linhas = []
+        for repeticao in self.repeticoes():
+            linhas.append(
+                f'Consulta repetida {repeticao.vezes} vezes em {onde} (limite {self.limite}), provável N+1:'
+            )
+            linhas.append(f'  SQL: {repeticao.impressao}')
+            if repeticao.template:
+                linhas.append(f'  Template: {repeticao.template}')
+            linhas += [f'  {chamada}' for chamada in repeticao.pilha]
+        return '\n'.join(linhas)
+
+
+class ConsultasRepetidasMiddleware:
+    """Roda o Detector em cada requisição e avisa/levanta no fim (ver o topo do arquivo)."""
+
+    def __init__(self, get_response):
+        self.acao = getattr(settings, 'CONSULTAS_REPETIDAS_ACAO', None)
+        if self.acao is None:
+            raise MiddlewareNotUsed
+        if self.acao not in ACOES:
+            raise ImproperlyConfigured(f'CONSULTAS_REPETIDAS_ACAO deve ser um de {ACOES} ou None.')
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with Detector() as detector:
+            response = self.get_response(request)
+        if detector.repeticoes():
+            relatorio = detector.relatorio(f'{request.method} {request.get_full_path()}')
+            if self.acao == 'erro':
+                raise ConsultaRepetida(relatorio)
+            logger.warning(relatorio)
+        return response
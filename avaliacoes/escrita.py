@@ -0,0 +1,86 @@
+# avaliacoes/escrita.py
+"""
+Coordenação das escritas no SQLite.
+
+O SQLite aceita um escritor por vez. Quando muitos alunos enviam avaliações juntos,
+as transações concorrentes esbarram em "database is locked". Três camadas evitam isso:
+
+1. settings.DATABASES: timeout de espera pelo lock e transaction_mode IMMEDIATE (a
+   transação pega o lock de escrita no BEGIN, em vez de falhar na hora ao tentar promover
+   uma leitura para escrita). Com SQLITE_WAL=1, também WAL (leitores não bloqueiam o
+   escritor), só para o banco em disco local.
+2. Um único escritor por processo: as views decoradas com @escrita_atomica entram numa
+   fila (threading.Lock), então threads do mesmo processo não disputam o arquivo.
+3. Se outro processo ainda segurar o lock além do timeout, a view inteira é repetida com
+   espera exponencial (com jitter). Esgotadas as tentativas, responde 503 + Retry-After.
+
+Só os métodos que escrevem (POST, PUT, PATCH, DELETE) passam por aqui; GET roda direto.
+"""
+
+import random
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import OperationalError, transaction
+from django.http import HttpResponse, JsonResponse
+
+TENTATIVAS = getattr(settings, 'ESCRITA_TENTATIVAS', 5)
+ESPERA_INICIAL = getattr(settings, 'ESCRITA_ESPERA_INICIAL', 0.05)  # segundos
+ESPERA_MAXIMA = getattr(settings, 'ESCRITA_ESPERA_MAXIMA', 2.0)
+
+METODOS_DE_ESCRITA = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Fila de escritores deste processo
+_escritor = threading.Lock()
+
+
+def banco_ocupado(erro):
+    """True para os erros de lock do SQLite que valem uma nova tentativa."""
+    mensagem = str(erro).lower()
+    return isinstance(erro, OperationalError) and ('locked' in mensagem or 'busy' in mensagem)
+
+
+def executar_escrita(funcao, *args, **kwargs):
+    """
+    Executa `funcao` numa transação, como único escritor do processo, repetindo em caso de
+    banco ocupado. Levanta o último OperationalError se todas as tentativas falharem.
+    Dentro de uma transação já aberta só executa (não dá para repetir um pedaço dela).
+    """
+    if transaction.get_connection().in_atomic_block:
+        return funcao(*args, **kwargs)
+
+    for tentativa in range(TENTATIVAS):
+        try:
+            with _escritor, transaction.atomic():
+                return funcao(*args, **kwargs)
+        except OperationalError as erro:
+            if not banco_ocupado(erro) or tentativa == TENTATIVAS - 1:
+                raise
+        espera = min(ESPERA_INICIAL * 2 ** tentativa, ESPERA_MAXIMA)
+        time.sleep(espera * random.uniform(0.5, 1.5))
+
+
+def escrita_atomica(view):
+    """
+    Decorator para views que gravam: substitui o @transaction.atomic.
+    A view precisa deixar o OperationalError subir (não pode engolir no except genérico).
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in METODOS_DE_ESCRITA:
+            return view(request, *args, **kwargs)
+        try:
+            return executar_escrita(view, request, *args, **kwargs)
+        except OperationalError as erro:
+            if not banco_ocupado(erro):
+                raise
+            mensagem = 'O sistema está ocupado no momento. Tente novamente em instantes.'
+            if request.content_type == 'application/json':
+                resposta = JsonResponse({'success': False, 'error': mensagem}, status=503)
+            else:
+                resposta = HttpResponse(mensagem, status=503)
+            resposta['Retry-After'] = '1'
+            return resposta
+    return wrapper
@@ -0,0 +1,21 @@
+# avaliacoes/executor_testes.py
+"""
+Runner do `manage.py test` (TEST_RUNNER em settings.py): o DiscoverRunner do Django com
+o detector de N+1 (avaliacoes/consultas_repetidas.py) em modo 'erro' durante toda a
+execução, para que qualquer view com N+1 quebre o teste que a chama.
+"""
+
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class ExecutorTestes(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._consultas_repetidas = override_settings(CONSULTAS_REPETIDAS_ACAO='erro')
+        self._consultas_repetidas.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._consultas_repetidas.disable()
+        super().teardown_test_environment(**kwargs)
@@ -16,23 +16,17 @@ class ProfessorSelect(forms.Select):
     def create_option(self, name, value, label, selected, index, subindex=None, attrs=None):
         option = super().create_option(name, value, label, selected, index, subindex=subindex, attrs=attrs)
         if value:
-            try:
-                # Lógica para extrair o ID corretamente, seja de um objeto ou valor direto
-                val = value
-                if hasattr(value, 'instance'):
-                    val = value.instance.pk
-                elif hasattr(value, 'value'):
-                    val = value.value()
-                elif hasattr(value, '__iter__') and not isinstance(value, (str, bytes)):
-                    val = list(value)[0]
-                
-                # Busca o professor para pegar a URL da foto
-                professor = Professor.objects.get(pk=val)
-                foto_url = professor.foto.url if professor.foto else ''
-                option['attrs']['data-foto-url'] = foto_url
-            except (Professor.DoesNotExist, ValueError, TypeError):
-                # Se der erro ou não encontrar, deixa sem foto
-                option['attrs']['data-foto-url'] = ''
+            # O ModelChoiceField já entrega o Professor da opção (value.instance):
+            # sem ele, seria uma consulta por opção da lista
+            professor = getattr(value, 'instance', None)
+            if professor is None:
+                try:
+                    # Valor direto (id), sem o objeto
+                    professor = Professor.objects.get(pk=value)
+                except (Professor.DoesNotExist, ValueError, TypeError):
+                    # Se der erro ou não encontrar, deixa sem foto
+                    professor = None
+            option['attrs']['data-foto-url'] = professor.foto.url if professor and professor.foto else ''
         return option
 
 # --- FORMULÁRIOS DE AVALIAÇÃO ---
@@ -40,7 +34,7 @@ class ProfessorSelect(forms.Select):
 class AvaliacaoForm(forms.ModelForm):
     disciplina_pessoa = forms.ModelChoiceField(
         # OBS: Certifique-se que seu model tem o campo 'status', senão remova o .filter(status='ativo')
-        queryset=DisciplinaPessoa.objects.all(), 
+        queryset=DisciplinaPessoa.objects.select_related('pessoa', 'disciplina'), 
         label="Disciplina e Professor"
     )
 
@@ -145,4 +139,18 @@ class DisciplinaPessoaForm(forms.ModelForm):
 
     class Meta:
         model = DisciplinaPessoa
-        fields = ['disciplina']
\ No newline at end of file
+        fields = ['disciplina']
+
+
+class ImportarUsuariosForm(forms.Form):
+    """
+    Upload do CSV de usuários no admin (ver avaliacoes/importacao.py).
+    """
+    arquivo = forms.FileField(
+        label="Arquivo CSV",
+        help_text="Colunas: tipo,nome,email,cpf,nascimento,disciplina (UTF-8, com cabeçalho)."
+    )
+    enviar_email = forms.BooleanField(
+        required=False, initial=True,
+        label="Enviar a cada usuário o e-mail para definir a senha"
+    )
@@ -0,0 +1,133 @@
+# avaliacoes/idempotencia.py
+"""
+Cabeçalho Idempotency-Key nas APIs JSON de escrita.
+
+O front-end gera uma chave por envio e repete a MESMA chave quando reenvia depois de
+um timeout. Sem isso, o reenvio roda toda a validação de novo e falha com um erro
+enganoso ("você já avaliou") ou cria um comentário em dobro.
+
+Com a chave:
+1. Antes da transação, UMA consulta procura a resposta guardada para
+   (usuário, endpoint, chave). Se ela existir, é devolvida como está, sem executar a view.
+2. Se não existir, a view roda dentro do @escrita_atomica e, na MESMA transação, a
+   resposta é guardada. Um reenvio que chegue enquanto o original ainda está na fila de
+   escrita repete a busca já com o lock e recebe a resposta do original.
+
+Só as respostas 2xx ficam guardadas: um erro de validação pode ser corrigido e reenviado.
+A mesma chave com outro corpo é recusada com 422. As linhas vencem após IDEMPOTENCIA_TTL
+segundos e são apagadas aos poucos pelas próprias escritas.
+"""
+
+import hashlib
+import random
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .escrita import escrita_atomica
+from .models import RespostaIdempotente
+
+CABECALHO = 'Idempotency-Key'
+TTL = getattr(settings, 'IDEMPOTENCIA_TTL', 24 * 60 * 60)  # segundos
+TAMANHO_MAXIMO_CHAVE = 255
+
+# Fração das escritas que também apagam as respostas vencidas
+CHANCE_PODA = 0.01
+
+
+def _limite():
+    return timezone.now() - timedelta(seconds=TTL)
+
+
+def podar():
+    """Apaga as respostas mais antigas que o TTL. Devolve quantas foram apagadas."""
+    apagadas, _ = RespostaIdempotente.objects.filter(criada_em__lt=_limite()).delete()
+    return apagadas
+
+
+def _hash_corpo(request):
+    return hashlib.sha256(request.body).hexdigest()
+
+
+def _repetir(guardada, hash_corpo):
+    if guardada.hash_corpo != hash_corpo:
+        return JsonResponse(
+            {'success': False, 'error': f'{CABECALHO} já usada com outro conteúdo.'}, status=422
+        )
+    resposta = HttpResponse(guardada.corpo, status=guardada.status, content_type=guardada.content_type)
+    resposta['Idempotent-Replayed'] = 'true'
+    return resposta
+
+
+def idempotente(view):
+    """
+    Decorator para as views JSON que gravam. Inclui o @escrita_atomica: a view e a resposta
+    guardada entram na mesma transação. Sem o cabeçalho, é só o @escrita_atomica.
+    Deve ficar abaixo do @login_required (a chave é por usuário).
+    """
+    endpoint = view.__name__
+
+    def executar_e_guardar(request, chave, hash_corpo, *args, **kwargs):
+        # Já dentro da transação e com o lock de escrita: o original pode ter terminado
+        guardada = RespostaIdempotente.objects.filter(
+            usuario=request.user, endpoint=endpoint, chave=chave
+        ).first()
+        if guardada is not None:
+            if guardada.criada_em >= _limite():
+                return _repetir(guardada, hash_corpo)
+            guardada.delete()
+
+        resposta = view(request, *args, **kwargs)
+        if not 200 <= resposta.status_code < 300 or transaction.get_rollback():
+            return resposta
+
+        try:
+            with transaction.atomic():
+                RespostaIdempotente.objects.create(
+                    usuario=request.user, endpoint=endpoint, chave=chave, hash_corpo=hash_corpo,
+                    status=resposta.status_code, content_type=resposta['Content-Type'],
+                    corpo=resposta.content.decode(resposta.charset),
+                )
+        except IntegrityError:
+            # Outro processo gravou a mesma chave antes (fora do SQLite, sem fila única):
+            # desfaz este envio e o cliente recebe a resposta dele na próxima tentativa
+            transaction.set_rollback(True)
+            conflito = JsonResponse(
+                {'success': False, 'error': 'Requisição repetida ainda em andamento.'}, status=409
+            )
+            conflito['Retry-After'] = '1'
+            return conflito
+
+        if random.random() < CHANCE_PODA:
+            podar()
+        return resposta
+
+    escrever = escrita_atomica(executar_e_guardar)
+    sem_chave = escrita_atomica(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        chave = request.headers.get(CABECALHO)
+        if not chave:
+            return sem_chave(request, *args, **kwargs)
+        if len(chave) > TAMANHO_MAXIMO_CHAVE:
+            return JsonResponse(
+                {'success': False, 'error': f'{CABECALHO} maior que {TAMANHO_MAXIMO_CHAVE} caracteres.'},
+                status=400,
+            )
+
+        # 1 consulta, sem transação: reenvios não entram na fila de escrita
+        hash_corpo = _hash_corpo(request)
+        guardada = RespostaIdempotente.objects.filter(
+            usuario=request.user, endpoint=endpoint, chave=chave, criada_em__gte=_limite()
+        ).first()
+        if guardada is not None:
+            return _repetir(guardada, hash_corpo)
+
+        return escrever(request, chave, hash_corpo, *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,281 @@
+# avaliacoes/importacao.py
+"""
+Importação de usuários (alunos e professores) em massa a partir de um CSV.
+
+Usado pelo comando `python manage.py import_users arquivo.csv` e pelo upload no admin
+(Usuários > Importar CSV). O cadastro individual (views.adicionar_usuario) faz 2 consultas
+de unicidade, um hash PBKDF2 e um e-mail por usuário; para uma turma de calouros
+(milhares de linhas) isso não serve. Aqui:
+
+1. O CSV é lido em streaming, em lotes de `tamanho_lote` linhas (o arquivo nunca fica
+   inteiro na memória).
+2. Cada lote é validado linha a linha; a unicidade de e-mail/CPF é checada para o lote
+   INTEIRO com uma consulta (e-mail sem diferenciar maiúsculas / cpf__in), além das
+   repetições dentro do arquivo.
+3. Os hashes das senhas (a parte cara) são calculados num pool de processos quando
+   `workers` > 1, o que só o comando faz: no upload do admin, subir processos dentro de
+   uma requisição HTTP não compensa. O pool só é criado no primeiro lote com usuários novos.
+4. Cada lote é gravado numa transação de escrita (avaliacoes/escrita.py) com bulk_create
+   de CustomUser, Aluno/Professor, DisciplinaPessoa e dos e-mails de definição de senha
+   (caixa de saída, ver avaliacoes/caixa_saida.py).
+
+Linhas com problema não interrompem a importação: vão para o relatório de erros
+(número da linha, e-mail, CPF e motivo). Um conflito que só o banco pega (IntegrityError,
+ex.: outro processo gravou o mesmo CPF no meio) desfaz só aquele lote, e as linhas dele
+vão para o relatório; os lotes anteriores continuam gravados.
+
+Colunas do CSV (cabeçalho obrigatório; `disciplina` só para professor, com o código da matéria):
+    tipo,nome,email,cpf,nascimento,disciplina
+    aluno,Maria Souza,maria@exemplo.com,12345678901,01/02/2005,
+    professor,João Lima,joao@exemplo.com,10987654321,15/08/1980,MAT101
+"""
+
+import csv
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import datetime
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from django.utils.crypto import get_random_string
+
+from . import autocompletar
+from .caixa_saida import email_definir_senha
+from .escrita import executar_escrita
+from .models import (
+    Aluno, CustomUser, DisciplinaPessoa, EmailPendente, Materia, Professor
+)
+
+COLUNAS_OBRIGATORIAS = ('tipo', 'nome', 'email', 'cpf', 'nascimento')
+TIPOS = ('aluno', 'professor')
+TAMANHO_LOTE = 500
+
+
+@dataclass
+class ErroLinha:
+    linha: int
+    email: str
+    cpf: str
+    motivo: str
+
+
+@dataclass
+class RelatorioImportacao:
+    criados: Counter = field(default_factory=Counter)  # tipo -> quantidade
+    erros: list = field(default_factory=list)          # [ErroLinha]
+
+    @property
+    def total_criados(self):
+        return sum(self.criados.values())
+
+    @property
+    def criados_por_tipo(self):
+        # Lista, e não o Counter: no template, criados.items viraria criados['items']
+        return sorted(self.criados.items())
+
+    def escrever_csv(self, arquivo):
+        """Relatório de erros em CSV (uma linha por linha rejeitada do arquivo original)."""
+        escritor = csv.writer(arquivo)
+        escritor.writerow(['linha', 'email', 'cpf', 'motivo'])
+        for erro in self.erros:
+            escritor.writerow([erro.linha, erro.email, erro.cpf, erro.motivo])
+
+
+def _iniciar_worker():
+    # Os workers só calculam hashes, mas precisam das settings (PASSWORD_HASHERS)
+    django.setup()
+    connections.close_all()
+
+
+def _validar(linha):
+    """Dados limpos de uma linha do CSV; ValueError com o motivo se algo estiver errado."""
+    tipo = (linha.get('tipo') or '').strip().lower()
+    nome = ' '.join((linha.get('nome') or '').split())
+    email = (linha.get('email') or '').strip().lower()
+    cpf = (linha.get('cpf') or '').strip()
+    nascimento = (linha.get('nascimento') or '').strip()
+    disciplina = (linha.get('disciplina') or '').strip()
+
+    if not all([tipo, nome, email, cpf, nascimento]):
+        raise ValueError('Preencha tipo, nome, email, cpf e nascimento.')
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo inválido '{tipo}' (use {' ou '.join(TIPOS)}).")
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValueError('E-mail inválido.')
+    if len(cpf) > CustomUser._meta.get_field('cpf').max_length:
+        raise ValueError('CPF longo demais.')
+    try:
+        data_nascimento = datetime.strptime(nascimento, '%d/%m/%Y').date()
+    except ValueError:
+        raise ValueError('Data inválida (DD/MM/AAAA).')
+    if tipo == 'professor' and not disciplina:
+        raise ValueError('Informe o código da disciplina do professor.')
+
+    # Mesma divisão do nome do cadastro individual
+    primeiro, _, resto = nome.partition(' ')
+    return {
+        'tipo': tipo, 'email': email, 'cpf': cpf, 'data_nascimento': data_nascimento,
+        'first_name': primeiro, 'last_name': resto, 'disciplina': disciplina,
+    }
+
+
+def _ja_cadastrados(emails, cpfs):
+    """
+    (e-mails, CPFs) que já existem no banco, numa consulta para o lote todo. Os `emails` vêm
+    em minúsculas; os do banco são comparados também em minúsculas (cadastros antigos).
+    """
+    existentes = CustomUser.objects.annotate(
+        email_minusculo=Lower('email'), username_minusculo=Lower('username')
+    ).filter(
+        Q(email_minusculo__in=emails) | Q(username_minusculo__in=emails) | Q(cpf__in=cpfs)
+    ).values_list('email', 'username', 'cpf')
+    emails_existentes, cpfs_existentes = set(), set()
+    for email, username, cpf in existentes:
+        emails_existentes.update((email.lower(), username.lower()))
+        cpfs_existentes.add(cpf)
+    return emails_existentes, cpfs_existentes
+
+
+def _gravar_lote(validas, senhas, dominio, usar_https):
+    """
+    Dentro da transação de escrita: confere de novo a unicidade e grava tudo com bulk_create.
+    Devolve (tipos dos usuários criados, erros). Pode ser repetida se o banco estiver ocupado.
+    """
+    # Segunda conferência, agora com o lock de escrita: alguém pode ter cadastrado no meio
+    emails_existentes, cpfs_existentes = _ja_cadastrados(
+        [d['email'] for _, d in validas], [d['cpf'] for _, d in validas]
+    )
+    materias = dict(
+        Materia.objects.filter(codigo__in={d['disciplina'] for _, d in validas if d['disciplina']})
+        .values_list('codigo', 'pk')
+    )
+
+    novos, erros = [], []
+    for (numero, dados), senha in zip(validas, senhas):
+        if dados['email'] in emails_existentes:
+            erros.append(ErroLinha(numero, dados['email'], dados['cpf'], 'E-mail já cadastrado.'))
+        elif dados['cpf'] in cpfs_existentes:
+            erros.append(ErroLinha(numero, dados['email'], dados['cpf'], 'CPF já cadastrado.'))
+        elif dados['tipo'] == 'professor' and dados['disciplina'] not in materias:
+            erros.append(ErroLinha(numero, dados['email'], dados['cpf'], f"Disciplina '{dados['disciplina']}' não encontrada."))
+        else:
+            usuario = CustomUser(
+                username=dados['email'], email=dados['email'], password=senha,
+                user_type=dados['tipo'], cpf=dados['cpf'], data_nascimento=dados['data_nascimento'],
+                first_name=dados['first_name'], last_name=dados['last_name'], is_active=True,
+            )
+            novos.append((usuario, dados))
+
+    # bulk_create não chama save() nem dispara sinais: perfis e a invalidação das
+    # sugestões são feitos aqui (o índice FTS é mantido por triggers). O atomic garante que
+    # um IntegrityError desfaça o lote inteiro mesmo dentro de uma transação já aberta
+    with transaction.atomic():
+        CustomUser.objects.bulk_create([usuario for usuario, _ in novos])
+        Aluno.objects.bulk_create([Aluno(user=u) for u, d in novos if d['tipo'] == 'aluno'])
+        professores = Professor.objects.bulk_create(
+            [Professor(user=u) for u, d in novos if d['tipo'] == 'professor']
+        )
+        if professores:
+            DisciplinaPessoa.objects.bulk_create([
+                DisciplinaPessoa(pessoa=u, disciplina_id=materias[d['disciplina']])
+                for u, d in novos if d['tipo'] == 'professor'
+            ])
+            transaction.on_commit(autocompletar.invalidar)
+        if dominio:
+            EmailPendente.objects.bulk_create(
+                [email_definir_senha(usuario, dominio, usar_https) for usuario, _ in novos]
+            )
+
+    return [d['tipo'] for _, d in novos], erros
+
+
+def _senhas(quantidade, pool, workers):
+    """Hashes de senhas aleatórias (o usuário define a dele pelo e-mail), no pool se houver."""
+    aleatorias = [get_random_string(12) for _ in range(quantidade)]
+    if pool is None:
+        return [make_password(senha) for senha in aleatorias]
+    return list(pool.map(make_password, aleatorias, chunksize=max(1, quantidade // (workers * 4))))
+
+
+def importar_usuarios(arquivo, dominio=None, usar_https=False, workers=1, tamanho_lote=TAMANHO_LOTE):
+    """
+    Importa o CSV aberto em modo texto (`arquivo`). Com `dominio`, cada usuário criado
+    recebe (pela caixa de saída) o e-mail para definir a senha, com links para esse domínio.
+    Com `workers` > 1, os hashes são calculados nesse número de processos.
+    Devolve um RelatorioImportacao. ValueError se faltar alguma coluna obrigatória.
+    """
+    leitor = csv.DictReader(arquivo)
+    colunas = {(c or '').strip().lower() for c in leitor.fieldnames or []}
+    faltando = [c for c in COLUNAS_OBRIGATORIAS if c not in colunas]
+    if faltando:
+        raise ValueError(f"Colunas obrigatórias ausentes no CSV: {', '.join(faltando)}.")
+    leitor.fieldnames = [(c or '').strip().lower() for c in leitor.fieldnames]
+
+    relatorio = RelatorioImportacao()
+    emails_no_arquivo, cpfs_no_arquivo = set(), set()
+    linhas = enumerate(leitor, start=2)  # a linha 1 é o cabeçalho
+
+    with ExitStack() as pilha:
+        pool = None
+        while lote := list(islice(linhas, tamanho_lote)):
+            # 1. Validação de cada linha e repetições dentro do próprio arquivo
+            validas = []
+            for numero, linha in lote:
+                try:
+                    dados = _validar(linha)
+                except ValueError as erro:
+                    relatorio.erros.append(ErroLinha(numero, linha.get('email') or '', linha.get('cpf') or '', str(erro)))
+                    continue
+                if dados['email'] in emails_no_arquivo:
+                    relatorio.erros.append(ErroLinha(numero, dados['email'], dados['cpf'], 'E-mail repetido no arquivo.'))
+                elif dados['cpf'] in cpfs_no_arquivo:
+                    relatorio.erros.append(ErroLinha(numero, dados['email'], dados['cpf'], 'CPF repetido no arquivo.'))
+                else:
+                    emails_no_arquivo.add(dados['email'])
+                    cpfs_no_arquivo.add(dados['cpf'])
+                    validas.append((numero, dados))
+
+            # 2. Unicidade no banco para o lote inteiro, ANTES de gastar tempo com hashes
+            emails_existentes, cpfs_existentes = _ja_cadastrados(
+                [d['email'] for _, d in validas], [d['cpf'] for _, d in validas]
+            )
+            novas = []
+            for numero, dados in validas:
+                if dados['email'] in emails_existentes:
+                    relatorio.erros.append(ErroLinha(numero, dados['email'], dados['cpf'], 'E-mail já cadastrado.'))
+                elif dados['cpf'] in cpfs_existentes:
+                    relatorio.erros.append(ErroLinha(numero, dados['email'], dados['cpf'], 'CPF já cadastrado.'))
+                else:
+                    novas.append((numero, dados))
+            if not novas:
+                continue
+
+            # 3. Senhas aleatórias, com o pool criado só quando há hashes a calcular
+            if workers > 1 and pool is None:
+                pool = pilha.enter_context(ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker))
+            senhas = _senhas(len(novas), pool, workers)
+
+            # 4. Uma transação de escrita por lote
+            try:
+                criados, erros = executar_escrita(_gravar_lote, novas, senhas, dominio, usar_https)
+            except IntegrityError as erro:
+                criados = []
+                erros = [
+                    ErroLinha(numero, dados['email'], dados['cpf'], f'Lote não gravado (conflito no banco: {erro}).')
+                    for numero, dados in novas
+                ]
+            relatorio.criados.update(criados)
+            relatorio.erros.extend(erros)
+
+    relatorio.erros.sort(key=lambda erro: erro.linha)
+    return relatorio
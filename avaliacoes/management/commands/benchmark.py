@@ -0,0 +1,86 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from avaliacoes import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede latência (p50/p95), consultas e tempo de SQL das views principais sobre dados do '
+        'seed_data, num banco de teste descartável (o banco configurado não é tocado). '
+        'Grava o resultado em JSON e, com --baseline, aponta as regressões.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset', action='append', choices=list(benchmark.DATASETS),
+            help='Tamanho dos dados; pode repetir (padrão: small).'
+        )
+        parser.add_argument(
+            '--view', action='append', choices=[c.nome for c in benchmark.CENARIOS],
+            help='Mede só esta view; pode repetir (padrão: todas).'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=benchmark.REPETICOES,
+            help=f'Requisições medidas por view (padrão: {benchmark.REPETICOES}).'
+        )
+        parser.add_argument('--seed', type=int, default=benchmark.SEMENTE, help='Semente do seed_data.')
+        parser.add_argument('--output', help='Grava o resultado neste arquivo JSON.')
+        parser.add_argument('--baseline', help='JSON de uma execução anterior para comparar.')
+        parser.add_argument(
+            '--tolerance', type=float, default=benchmark.TOLERANCIA,
+            help=f'Aumento de p95 tolerado antes de acusar regressão (padrão: {benchmark.TOLERANCIA} = 20%%).'
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat precisa ser maior que zero.')
+        referencia = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as arquivo:
+                    referencia = json.load(arquivo)
+            except (OSError, ValueError) as erro:
+                raise CommandError(f'Não foi possível ler a referência: {erro}')
+
+        # Banco de teste descartável, como no `manage.py test`
+        setup_test_environment()
+        nome_original = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            resultado = benchmark.executar(
+                datasets=options['dataset'] or ['small'],
+                repeticoes=options['repeat'],
+                cenarios=options['view'],
+                semente=options['seed'],
+                progresso=self._mostrar,
+            )
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as saida:
+                json.dump(resultado, saida, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Resultado gravado em {options['output']}.")
+
+        if referencia is not None:
+            regressoes = benchmark.comparar(resultado, referencia, tolerancia=options['tolerance'])
+            if regressoes:
+                for regressao in regressoes:
+                    self.stdout.write(self.style.ERROR(regressao))
+                raise CommandError(f'{len(regressoes)} regressão(ões) em relação a {options["baseline"]}.')
+            self.stdout.write(self.style.SUCCESS('Nenhuma regressão em relação à referência.'))
+
+    def _mostrar(self, dataset, cenario, medida):
+        linha = (
+            f"{dataset:<7} {cenario:<22} p50 {medida['p50_ms']:8.2f} ms  p95 {medida['p95_ms']:8.2f} ms  "
+            f"{medida['consultas']:3d} consultas  SQL {medida['tempo_sql_ms']:7.2f} ms"
+        )
+        if medida['erros']:
+            linha += f"  {medida['erros']} resposta(s) com erro"
+            self.stdout.write(self.style.WARNING(linha))
+        else:
+            self.stdout.write(linha)
@@ -0,0 +1,64 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from avaliacoes.importacao import TAMANHO_LOTE, importar_usuarios
+
+ERROS_EXIBIDOS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa alunos e professores de um CSV (colunas: tipo,nome,email,cpf,nascimento,disciplina) '
+        'em lotes, com hash das senhas em paralelo. Linhas com erro vão para o relatório; '
+        'cada usuário criado recebe pela caixa de saída o e-mail para definir a senha.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do CSV (UTF-8, com cabeçalho).')
+        parser.add_argument(
+            '--domain',
+            help='Domínio usado nos links dos e-mails (ex.: avaliacao.exemplo.com). Obrigatório sem --no-email.'
+        )
+        parser.add_argument('--https', action='store_true', help='Links dos e-mails com https.')
+        parser.add_argument('--no-email', action='store_true', help='Não enfileira os e-mails de definição de senha.')
+        parser.add_argument(
+            '--batch-size', type=int, default=TAMANHO_LOTE,
+            help=f'Linhas por lote/transação (padrão: {TAMANHO_LOTE}).'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Processos para o hash das senhas (padrão: um por CPU).'
+        )
+        parser.add_argument('--report', help='Grava o relatório de erros completo neste CSV.')
+
+    def handle(self, *args, **options):
+        if not options['no_email'] and not options['domain']:
+            raise CommandError('Informe --domain para os links dos e-mails (ou use --no-email).')
+
+        try:
+            with open(options['arquivo'], encoding='utf-8-sig', newline='') as arquivo:
+                relatorio = importar_usuarios(
+                    arquivo,
+                    dominio=None if options['no_email'] else options['domain'],
+                    usar_https=options['https'],
+                    workers=options['workers'] or os.cpu_count() or 1,
+                    tamanho_lote=options['batch_size'],
+                )
+        except (OSError, ValueError) as erro:
+            raise CommandError(str(erro))
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8', newline='') as saida:
+                relatorio.escrever_csv(saida)
+
+        for erro in relatorio.erros[:ERROS_EXIBIDOS]:
+            self.stdout.write(f'Linha {erro.linha} ({erro.email or erro.cpf or "-"}): {erro.motivo}')
+        if len(relatorio.erros) > ERROS_EXIBIDOS:
+            self.stdout.write(f'... e mais {len(relatorio.erros) - ERROS_EXIBIDOS} erro(s).')
+
+        detalhes = ', '.join(f'{quantidade} {tipo}(s)' for tipo, quantidade in relatorio.criados_por_tipo)
+        self.stdout.write(self.style.SUCCESS(
+            f'{relatorio.total_criados} usuário(s) criado(s){f" ({detalhes})" if detalhes else ""}, '
+            f'{len(relatorio.erros)} linha(s) com erro.'
+        ))
@@ -0,0 +1,201 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from avaliacoes import ranking
+from avaliacoes.agregados import (
+    UNIVERSIDADE_PK, assinatura_notas, calcular_turmas, gravar_professores_e_universidade,
+    regravar_turmas, totais_universidade
+)
+from avaliacoes.escrita import executar_escrita
+from avaliacoes.models import (
+    Categoria, DisciplinaPessoa, HistogramaNota, MediaDisciplina, MediaDisciplinaCategoria,
+    MediaProfessor, MediaUniversidade
+)
+
+TAMANHO_LOTE_PADRAO = 500
+
+
+def _iniciar_worker():
+    # Cada processo do pool abre a sua própria conexão (conexões não podem ser herdadas)
+    django.setup()
+    connections.close_all()
+
+
+def _calcular_lote(args):
+    """
+    Executado nos workers: só LÊ o banco, quem grava é o processo principal. A assinatura
+    é lida ANTES do cálculo: se uma avaliação entrar no meio, a conferência na gravação falha.
+    """
+    ids, categoria_ids = args
+    return ids, assinatura_notas(ids), calcular_turmas(ids, categoria_ids)
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstrói as tabelas MediaDisciplina, MediaDisciplinaCategoria, HistogramaNota, '
+        'MediaProfessor e MediaUniversidade a partir das notas (AvaliacaoCategoria), em lotes de turmas. '
+        'Com --verify apenas compara os valores gravados com um recálculo, sem gravar nada.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=TAMANHO_LOTE_PADRAO,
+            help=f'Quantidade de turmas (DisciplinaPessoa) por consulta GROUP BY (padrão: {TAMANHO_LOTE_PADRAO}).'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Quantidade de processos para calcular os lotes em paralelo (padrão: 1, sem pool).'
+        )
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Não grava nada: apenas relata as diferenças entre o que está gravado e o recálculo.'
+        )
+
+    def handle(self, *args, **options):
+        tamanho_lote = options['chunk_size']
+        workers = options['workers']
+        if tamanho_lote < 1 or workers < 1:
+            raise CommandError('--chunk-size e --workers precisam ser maiores que zero.')
+
+        categoria_ids = list(Categoria.objects.order_by('pk').values_list('pk', flat=True))
+        turma_ids = list(DisciplinaPessoa.objects.order_by('pk').values_list('pk', flat=True))
+        lotes = [
+            (turma_ids[i:i + tamanho_lote], categoria_ids)
+            for i in range(0, len(turma_ids), tamanho_lote)
+        ]
+        self.stdout.write(f'{len(turma_ids)} turmas em {len(lotes)} lote(s), {workers} worker(s).')
+
+        if options['verify']:
+            divergencias = self._verificar(self._resultados(lotes, workers))
+            if divergencias:
+                raise CommandError(f'{divergencias} divergência(s) encontrada(s). Rode sem --verify para corrigir.')
+            self.stdout.write(self.style.SUCCESS('Nenhuma divergência: os agregados estão corretos.'))
+            return
+
+        # Uma transação de escrita curta por lote, com o cálculo e a gravação dentro dela: uma
+        # avaliação salva no meio não é sobrescrita por totais velhos
+        if workers == 1 or len(lotes) <= 1:
+            for ids, categoria_ids in lotes:
+                executar_escrita(regravar_turmas, ids, categoria_ids)
+        else:
+            # Os workers calculam fora da transação; o lote cuja assinatura mudou desde então
+            # é recalculado já com o lock
+            recalculados = sum(
+                executar_escrita(regravar_turmas, ids, categoria_ids, assinatura, turmas)
+                for (ids, assinatura, turmas), (_, categoria_ids) in zip(self._resultados(lotes, workers), lotes)
+            )
+            if recalculados:
+                self.stdout.write(f'{recalculados} lote(s) recalculado(s) por avaliações gravadas durante o cálculo.')
+
+        professores = gravar_professores_e_universidade(tamanho_lote)
+        self.stdout.write(self.style.SUCCESS(
+            f'Agregados reconstruídos: {MediaDisciplina.objects.count()} turma(s) avaliada(s), '
+            f'{len(professores)} professor(es).'
+        ))
+
+    def _resultados(self, lotes, workers):
+        """Gera (ids, assinatura, turmas_recalculadas) por lote, em série ou num pool de processos."""
+        if workers == 1 or len(lotes) <= 1:
+            for lote in lotes:
+                yield _calcular_lote(lote)
+            return
+
+        # Fecha as conexões antes de criar os processos filhos
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_iniciar_worker) as pool:
+            yield from pool.map(_calcular_lote, lotes)
+
+    def _verificar(self, resultados):
+        divergencias = 0
+        professores = {}
+        media_prior = MediaUniversidade.objects.filter(pk=UNIVERSIDADE_PK).values_list(
+            'media_ranking', flat=True
+        ).first()
+
+        def _relatar(descricao, gravado, esperado):
+            nonlocal divergencias
+            divergencias += 1
+            self.stdout.write(self.style.ERROR(f'{descricao}: gravado={gravado} esperado={esperado}'))
+
+        for ids, _, turmas in resultados:
+            gravadas = {
+                m['disciplina_pessoa_id']: m
+                for m in MediaDisciplina.objects.filter(disciplina_pessoa_id__in=ids).values(
+                    'disciplina_pessoa_id', 'soma_notas', 'qtde_notas', 'qtde_avaliacoes', 'pontuacao'
+                )
+            }
+            gravadas_categoria = {
+                (m['disciplina_pessoa_id'], m['categoria_id']): (m['soma_notas'], m['qtde_avaliacoes'])
+                for m in MediaDisciplinaCategoria.objects.filter(disciplina_pessoa_id__in=ids).values(
+                    'disciplina_pessoa_id', 'categoria_id', 'soma_notas', 'qtde_avaliacoes'
+                )
+            }
+
+            gravados_histograma = defaultdict(dict)
+            for h in HistogramaNota.objects.filter(disciplina_pessoa_id__in=ids).values(
+                'disciplina_pessoa_id', 'categoria_id', 'nota', 'qtde'
+            ):
+                gravados_histograma[h['disciplina_pessoa_id']][(h['categoria_id'], h['nota'])] = h['qtde']
+
+            for dp_id in ids:
+                turma = turmas.get(dp_id)
+                esperado = None
+                if turma:
+                    soma = sum(s for s, _ in turma['categorias'].values())
+                    qtde = sum(q for _, q in turma['categorias'].values())
+                    esperado = (soma, qtde, turma['avaliacoes'])
+
+                    total = professores.setdefault(turma['pessoa_id'], [0, 0, 0, 0])
+                    total[0] += soma
+                    total[1] += qtde
+                    total[2] += turma['avaliacoes']
+                    total[3] += 1
+
+                linha = gravadas.get(dp_id)
+                gravado = (linha['soma_notas'], linha['qtde_notas'], linha['qtde_avaliacoes']) if linha else None
+                if gravado != esperado:
+                    _relatar(f'MediaDisciplina turma={dp_id}', gravado, esperado)
+                elif linha and media_prior is not None:
+                    pontuacao = ranking.pontuacao(*esperado, media_prior)
+                    if abs(linha['pontuacao'] - pontuacao) > 1e-6:
+                        _relatar(f'Pontuação do ranking turma={dp_id}', linha['pontuacao'], pontuacao)
+
+                categorias = turma['categorias'] if turma else {}
+                for cat_id in set(categorias) | {c for (d, c) in gravadas_categoria if d == dp_id}:
+                    esperado_cat = tuple(categorias[cat_id]) if cat_id in categorias else None
+                    gravado_cat = gravadas_categoria.get((dp_id, cat_id))
+                    if gravado_cat != esperado_cat:
+                        _relatar(f'MediaDisciplinaCategoria turma={dp_id} categoria={cat_id}', gravado_cat, esperado_cat)
+
+                esperado_hist = turma['notas'] if turma else {}
+                if gravados_histograma.get(dp_id, {}) != esperado_hist:
+                    _relatar(f'HistogramaNota turma={dp_id}', gravados_histograma.get(dp_id, {}), esperado_hist)
+
+        gravados_prof = {
+            m['pessoa_id']: (m['soma_notas'], m['qtde_notas'], m['qtde_avaliacoes'], m['qtde_disciplinas'])
+            for m in MediaProfessor.objects.values(
+                'pessoa_id', 'soma_notas', 'qtde_notas', 'qtde_avaliacoes', 'qtde_disciplinas'
+            )
+        }
+        for pessoa_id in set(professores) | set(gravados_prof):
+            esperado = tuple(professores[pessoa_id]) if pessoa_id in professores else None
+            if gravados_prof.get(pessoa_id) != esperado:
+                _relatar(f'MediaProfessor pessoa={pessoa_id}', gravados_prof.get(pessoa_id), esperado)
+
+        esperado_univ = totais_universidade({
+            pessoa_id: dict(zip(('soma_notas', 'qtde_notas', 'qtde_avaliacoes', 'qtde_disciplinas'), total))
+            for pessoa_id, total in professores.items()
+        })
+        campos = ('soma_notas', 'qtde_notas', 'qtde_avaliacoes', 'qtde_disciplinas', 'qtde_professores')
+        universidade = MediaUniversidade.objects.filter(pk=UNIVERSIDADE_PK).values(*campos).first()
+        gravado_univ = tuple(universidade[c] for c in campos) if universidade else None
+        esperado_tupla = tuple(esperado_univ[c] for c in campos)
+        # Sem nenhuma avaliação, a ausência da linha também está correta
+        if gravado_univ != esperado_tupla and not (gravado_univ is None and not professores):
+            _relatar('MediaUniversidade', gravado_univ, esperado_tupla)
+
+        return divergencias
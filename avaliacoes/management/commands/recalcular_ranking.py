@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from avaliacoes import ranking
+from avaliacoes.agregados import atualizar_media_ranking
+
+
+class Command(BaseCommand):
+    help = (
+        'Atualiza a média "a priori" do ranking (MediaUniversidade.media_ranking) para a média geral '
+        f'atual e recalcula todas as pontuações, se ela andou mais que {ranking.TOLERANCIA_PRIOR} '
+        '(RANKING_TOLERANCIA_PRIOR). Feito para rodar agendado (ex.: cron a cada 10 minutos).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Recalcula mesmo que a média geral não tenha passado da tolerância.'
+        )
+
+    def handle(self, *args, **options):
+        resultado = atualizar_media_ranking(forcar=options['force'])
+        if resultado is None:
+            self.stdout.write('Média do ranking em dia; nada a recalcular.')
+            return
+        antiga, nova = resultado
+        self.stdout.write(self.style.SUCCESS(f'Média do ranking: {antiga} -> {nova}. Pontuações recalculadas.'))
@@ -1,18 +1,27 @@
+import math
 import random
-from decimal import Decimal
-from django.core.management.base import BaseCommand
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from faker import Faker
+from unidecode import unidecode
 
+from avaliacoes import autocompletar
 from avaliacoes.models import (
-    Materia, CustomUser, Professor, DisciplinaPessoa,
+    Materia, CustomUser, Professor, Aluno, DisciplinaPessoa, MatriculaAluno,
     Avaliacao, Categoria, AvaliacaoCategoria
 )
 
-# --- CONFIGURAÇÕES ---
+# --- CONFIGURAÇÕES PADRÃO (todas ajustáveis pela linha de comando) ---
 NUM_PROFESSORES = 15
 NUM_DISCIPLINAS = 10
-NUM_AVALIACOES_POR_TURMA = 25 # Gera X avaliações para CADA turma
+NUM_AVALIACOES_POR_TURMA = 25 # Sem --ratings, gera X avaliações por turma em média
+SEMENTE = 42
+TAMANHO_LOTE = 5000
+SENHA = '123'
 
 # --- DADOS FAKE ---
 LISTA_DISCIPLINAS = [
@@ -23,148 +32,257 @@ LISTA_DISCIPLINAS = [
     'Economia I', 'Literatura Brasileira'
 ]
 
+# Faixa das notas de cada categoria; categorias cadastradas depois usam FAIXA_PADRAO
+FAIXAS_NOTAS = {
+    'Didática': (4.0, 10.0),       # Professores geralmente têm didática boa
+    'Dificuldade': (2.0, 9.0),     # Dificuldade é variada
+    'Relacionamento': (5.0, 10.0),
+    'Pontualidade': (7.0, 10.0),   # Pontualidade geralmente alta
+}
+FAIXA_PADRAO = (0.0, 10.0)
+
+
+def em_lotes(iteravel, tamanho):
+    iterador = iter(iteravel)
+    while lote := list(islice(iterador, tamanho)):
+        yield lote
+
+
+def distribuir(total, pesos):
+    """Divide `total` proporcionalmente aos `pesos` (maiores restos), somando exatamente `total`."""
+    soma = sum(pesos)
+    cotas = [total * peso / soma for peso in pesos]
+    partes = [math.floor(cota) for cota in cotas]
+    restantes = sorted(range(len(pesos)), key=lambda i: cotas[i] - partes[i], reverse=True)
+    for i in restantes[:total - sum(partes)]:
+        partes[i] += 1
+    return partes
+
+
 class Command(BaseCommand):
-    help = 'Cria uma grande quantidade de dados fake para popular o banco de dados.'
+    help = (
+        'Cria dados fake para popular o banco de dados, do tamanho pedido (até milhões de avaliações): '
+        'disciplinas, professores, turmas, alunos, matrículas e avaliações, com bulk_create em lotes. '
+        'A mesma --seed gera sempre os mesmos dados. No fim, reconstrói os agregados (rebuild_aggregates).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--professors', type=int, default=NUM_PROFESSORES,
+                            help=f'Quantidade de professores (padrão: {NUM_PROFESSORES}).')
+        parser.add_argument('--disciplines', type=int, default=NUM_DISCIPLINAS,
+                            help=f'Quantidade de disciplinas (padrão: {NUM_DISCIPLINAS}).')
+        parser.add_argument('--ratings', type=int, default=None,
+                            help=f'Total de avaliações (padrão: {NUM_AVALIACOES_POR_TURMA} por turma).')
+        parser.add_argument('--students', type=int, default=None,
+                            help='Quantidade de alunos (padrão: o necessário para a turma mais avaliada).')
+        parser.add_argument('--rating-rate', type=float, default=0.6,
+                            help='Fração dos matriculados de cada turma que avalia (padrão: 0.6).')
+        parser.add_argument('--comment-rate', type=float, default=0.5,
+                            help='Fração das avaliações com comentário (padrão: 0.5).')
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Concentração das avaliações em poucos professores populares (lei de Zipf; '
+                                 '0 = uniforme, padrão: 1.0).')
+        parser.add_argument('--seed', type=int, default=SEMENTE,
+                            help=f'Semente dos geradores aleatórios (padrão: {SEMENTE}).')
+        parser.add_argument('--batch-size', type=int, default=TAMANHO_LOTE,
+                            help=f'Linhas por bulk_create (padrão: {TAMANHO_LOTE}).')
 
     def handle(self, *args, **options):
-        # Inicia o Faker
-        fake = Faker('pt_BR')
-        
+        num_professores = options['professors']
+        num_disciplinas = options['disciplines']
+        taxa_avaliacao = options['rating_rate']
+        if num_professores < 1 or num_disciplinas < 1 or options['batch_size'] < 1:
+            raise CommandError('--professors, --disciplines e --batch-size precisam ser maiores que zero.')
+        if not 0 < taxa_avaliacao <= 1 or not 0 <= options['comment_rate'] <= 1:
+            raise CommandError('--rating-rate precisa estar em (0, 1] e --comment-rate em [0, 1].')
+        if options['skew'] < 0 or (options['ratings'] or 0) < 0 or (options['students'] or 1) < 1:
+            raise CommandError('--skew e --ratings não podem ser negativos e --students precisa ser maior que zero.')
+
+        # Um gerador só, com semente fixa: mesmos parâmetros = mesmos dados
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker('pt_BR')
+        self.fake.seed_instance(options['seed'])
+        self.lote = options['batch_size']
+        self.skew = options['skew']
+        # O hash PBKDF2 é caro: todos os usuários fake recebem o mesmo
+        self.senha = make_password(SENHA)
+
         # Garante que a operação inteira seja atômica
         with transaction.atomic():
             self.stdout.write(self.style.WARNING('Limpando dados antigos...'))
-            
+
             # Limpa dados antigos (exceto superusuários)
             Materia.objects.all().delete()
             CustomUser.objects.filter(is_superuser=False).delete()
             # O resto (Professor, Avaliacao, etc) é deletado em cascata
-            
+
             self.stdout.write(self.style.SUCCESS('Dados antigos limpos.'))
             self.stdout.write('Iniciando criação de novos dados...')
 
             # --- 1. Criar Categorias (Garantir que existam) ---
-            cat_didatica, _ = Categoria.objects.get_or_create(nome_categoria='Didática')
-            cat_dificuldade, _ = Categoria.objects.get_or_create(nome_categoria='Dificuldade')
-            cat_relacionamento, _ = Categoria.objects.get_or_create(nome_categoria='Relacionamento')
-            cat_pontualidade, _ = Categoria.objects.get_or_create(nome_categoria='Pontualidade')
-            categorias_list = [cat_didatica, cat_dificuldade, cat_relacionamento, cat_pontualidade]
+            for nome in FAIXAS_NOTAS:
+                Categoria.objects.get_or_create(nome_categoria=nome)
+            categorias = [
+                (categoria.pk, FAIXAS_NOTAS.get(categoria.nome_categoria, FAIXA_PADRAO))
+                for categoria in Categoria.objects.order_by('pk')
+            ]
 
             # --- 2. Criar Disciplinas (Matérias) ---
-            disciplinas_criadas = []
-            disciplinas_para_criar = random.sample(LISTA_DISCIPLINAS, NUM_DISCIPLINAS)
-            
-            for i, nome_disc in enumerate(disciplinas_para_criar):
-                codigo = f"{nome_disc[:3].upper()}{i+1:03d}"
-                materia = Materia.objects.create(
-                    nome=nome_disc,
-                    codigo=codigo,
-                    data_inicio=fake.date_between(start_date='-2y', end_date='-1y')
-                )
-                disciplinas_criadas.append(materia)
-            
-            self.stdout.write(f"-> {len(disciplinas_criadas)} Disciplinas criadas.")
+            disciplinas = self._criar_disciplinas(num_disciplinas)
+            self.stdout.write(f"-> {len(disciplinas)} Disciplinas criadas.")
 
             # --- 3. Criar Professores ---
-            professores_criados = []
-            for _ in range(NUM_PROFESSORES):
-                first_name = fake.first_name()
-                last_name = fake.last_name()
-                email = f"{first_name.lower()}.{last_name.lower()}_{fake.random_int(1,99)}@eduavalia.com"
-                
-                try:
-                    user = CustomUser.objects.create_user(
-                        username=email,
-                        email=email,
-                        password='123',
-                        user_type='professor',
-                        first_name=first_name,
-                        last_name=last_name,
-                        cpf=fake.cpf().replace('.', '').replace('-', ''),
-                        data_nascimento=fake.date_of_birth(minimum_age=25, maximum_age=65)
-                    )
-                    prof = Professor.objects.create(user=user)
-                    professores_criados.append(prof)
-                except Exception as e:
-                    # Se o CPF/Email já existir, apenas ignora e continua
-                    self.stdout.write(self.style.ERROR(f'Erro ao criar professor {email}: {e}'))
-
-            self.stdout.write(f"-> {len(professores_criados)} Professores criados.")
+            professores = self._criar_professores(num_professores)
+            self.stdout.write(f"-> {len(professores)} Professores criados.")
 
             # --- 4. Ligar Professores a Disciplinas (DisciplinaPessoa) ---
-            turmas_criadas = []
-            for prof in professores_criados:
-                # Cada professor vai dar 1 ou 2 disciplinas
-                num_disciplinas = random.randint(1, 2)
-                disciplinas_sorteadas = random.sample(disciplinas_criadas, num_disciplinas)
-                
-                for disc in disciplinas_sorteadas:
-                    # === REMOVIDO 'ano' E 'semestre' DAQUI ===
-                    turma = DisciplinaPessoa.objects.create(
-                        disciplina=disc,
-                        pessoa=prof.user,
-                        status='ativo'
-                    )
-                    turmas_criadas.append(turma)
-
-            self.stdout.write(f"-> {len(turmas_criadas)} Turmas (DisciplinaPessoa) criadas.")
-
-            # --- 5. Criar Avaliações e Comentários ---
-            total_avaliacoes = 0
-            total_comentarios = 0
-            
-            if not turmas_criadas:
-                self.stdout.write(self.style.ERROR("Nenhuma turma foi criada, não é possível gerar avaliações."))
-                return
-
-            for turma in turmas_criadas:
-                for _ in range(NUM_AVALIACOES_POR_TURMA):
-                    
-                    # 1. Cria a Avaliação "pai"
-                    avaliacao = Avaliacao.objects.create(
-                        disciplina_pessoa=turma,
-                        data_avaliacao=fake.date_time_between(start_date='-1y', end_date='now', tzinfo=None)
-                    )
-                    
-                    # 2. Adiciona um comentário em ~50% dos casos
-                    if random.choice([True, False]):
-                        avaliacao.comentario = fake.paragraph(nb_sentences=random.randint(2, 4))
-                        avaliacao.save()
-                        total_comentarios += 1
+            turmas = self._criar_turmas(professores, disciplinas)
+            self.stdout.write(f"-> {len(turmas)} Turmas (DisciplinaPessoa) criadas.")
 
-                    # 3. Cria as 4 notas (AvaliacaoCategoria)
-                    
-                    # Função para gerar nota com passo de 0.5
-                    def get_random_nota(min_val, max_val):
-                        # Garante que a nota esteja no formato X.X ou X.5
-                        nota = round(random.uniform(min_val, max_val) * 2) / 2
-                        # Garante que a nota não passe de 10.0
-                        return min(nota, 10.0)
-
-                    AvaliacaoCategoria.objects.create(
-                        avaliacao=avaliacao,
-                        categoria=cat_didatica,
-                        nota=get_random_nota(4.0, 10.0) # Professores geralmente têm didática boa
-                    )
-                    AvaliacaoCategoria.objects.create(
-                        avaliacao=avaliacao,
-                        categoria=cat_dificuldade,
-                        nota=get_random_nota(2.0, 9.0) # Dificuldade é variada
-                    )
-                    AvaliacaoCategoria.objects.create(
-                        avaliacao=avaliacao,
-                        categoria=cat_relacionamento,
-                        nota=get_random_nota(5.0, 10.0)
-                    )
-                    AvaliacaoCategoria.objects.create(
-                        avaliacao=avaliacao,
-                        categoria=cat_pontualidade,
-                        nota=get_random_nota(7.0, 10.0) # Pontualidade geralmente alta
+            # --- 5. Quantas avaliações e matrículas cada turma recebe ---
+            total = options['ratings']
+            if total is None:
+                total = NUM_AVALIACOES_POR_TURMA * len(turmas)
+            avaliacoes_por_turma = distribuir(total, [peso for _, peso in turmas])
+            maior_turma = max(avaliacoes_por_turma)
+            num_alunos = options['students']
+            if num_alunos is None:
+                num_alunos = max(math.ceil(maior_turma / taxa_avaliacao), 1)
+            if maior_turma > num_alunos:
+                # Um aluno avalia cada turma uma vez só (unique_together), então a turma fica limitada
+                self.stdout.write(self.style.WARNING(
+                    f'Há turmas com mais avaliações ({maior_turma}) que alunos ({num_alunos}): '
+                    f'elas ficam com {num_alunos}.'
+                ))
+                avaliacoes_por_turma = [min(qtde, num_alunos) for qtde in avaliacoes_por_turma]
+
+            # --- 6. Criar Alunos ---
+            alunos = self._criar_alunos(num_alunos, primeiro_cpf=num_professores)
+            self.stdout.write(f"-> {len(alunos)} Alunos criados.")
+
+            # --- 7. Criar Matrículas, Avaliações e Comentários ---
+            total_matriculas = total_avaliacoes = total_comentarios = 0
+            pendentes = []  # (Avaliacao, [AvaliacaoCategoria]) ainda não gravadas
+            for (turma, _), qtde in zip(turmas, avaliacoes_por_turma):
+                matriculados = min(num_alunos, max(qtde, round(qtde / taxa_avaliacao)))
+                # sample() já vem embaralhado: os primeiros `qtde` matriculados são os que avaliam
+                sorteados = self.rng.sample(alunos, matriculados)
+                for lote in em_lotes(sorteados, self.lote):
+                    MatriculaAluno.objects.bulk_create(
+                        MatriculaAluno(aluno_id=aluno_id, disciplina_professor_id=turma.pk) for aluno_id in lote
                     )
-                    total_avaliacoes += 1
+                total_matriculas += matriculados
+
+                for aluno_id in sorteados[:qtde]:
+                    comentario = None
+                    if self.rng.random() < options['comment_rate']:
+                        comentario = self.fake.paragraph(nb_sentences=self.rng.randint(2, 4))
+                        total_comentarios += 1
+                    notas = [
+                        AvaliacaoCategoria(categoria_id=categoria_id, nota=self._nota(*faixa))
+                        for categoria_id, faixa in categorias
+                    ]
+                    pendentes.append((
+                        Avaliacao(disciplina_pessoa_id=turma.pk, aluno_id=aluno_id, comentario=comentario), notas
+                    ))
+                    if len(pendentes) >= self.lote:
+                        self._gravar_avaliacoes(pendentes)
+                        pendentes = []
+                total_avaliacoes += qtde
+            self._gravar_avaliacoes(pendentes)
 
+            self.stdout.write(f"-> {total_matriculas} Matrículas criadas.")
             self.stdout.write(f"-> {total_avaliacoes} Avaliações criadas.")
             self.stdout.write(f"-> {total_comentarios} Comentários criados.")
-            
-            self.stdout.write(self.style.SUCCESS(
-                f"\n=== POVOAMENTO DE DADOS CONCLUÍDO ==="
-            ))
\ No newline at end of file
+
+        # --- 8. Médias e histogramas (bulk_create não passa pelas views que os mantêm) ---
+        call_command('rebuild_aggregates', stdout=self.stdout, stderr=self.stderr)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\n=== POVOAMENTO DE DADOS CONCLUÍDO ==="
+        ))
+
+    def _nota(self, min_val, max_val):
+        # Nota com passo de 0.5 (X.0 ou X.5), nunca acima de 10.0
+        return min(round(self.rng.uniform(min_val, max_val) * 2) / 2, 10.0)
+
+    def _usuario(self, tipo, numero, prefixo_email):
+        first_name = self.fake.first_name()
+        last_name = self.fake.last_name()
+        email = f"{prefixo_email}{numero}@eduavalia.com"
+        return CustomUser(
+            username=email,
+            email=email,
+            password=self.senha,
+            user_type=tipo,
+            first_name=first_name,
+            last_name=last_name,
+            # Sequencial: único mesmo com milhões de usuários (fake.cpf() repetiria)
+            cpf=f"{numero:011d}",
+            data_nascimento=self.fake.date_of_birth(minimum_age=25 if tipo == 'professor' else 17,
+                                                    maximum_age=65 if tipo == 'professor' else 30),
+        )
+
+    def _criar_disciplinas(self, quantidade):
+        nomes = self.rng.sample(LISTA_DISCIPLINAS, len(LISTA_DISCIPLINAS))
+        disciplinas = []
+        for i in range(quantidade):
+            # Depois da lista, os nomes se repetem com um número ("Cálculo I 2")
+            nome_disc = nomes[i % len(nomes)]
+            if i >= len(nomes):
+                nome_disc = f"{nome_disc} {i // len(nomes) + 1}"
+            disciplinas.append(Materia(
+                nome=nome_disc,
+                codigo=f"{nome_disc[:3].upper()}{i + 1:03d}",
+                # bulk_create não chama Materia.save()
+                nome_normalized=unidecode(nome_disc).lower(),
+                data_inicio=self.fake.date_between(start_date='-2y', end_date='-1y'),
+            ))
+        criadas = []
+        for lote in em_lotes(disciplinas, self.lote):
+            criadas.extend(Materia.objects.bulk_create(lote))
+        return criadas
+
+    def _criar_professores(self, quantidade):
+        professores = []
+        for lote in em_lotes(range(quantidade), self.lote):
+            usuarios = CustomUser.objects.bulk_create(self._usuario('professor', i, 'professor') for i in lote)
+            professores.extend(Professor.objects.bulk_create(Professor(user=usuario) for usuario in usuarios))
+        transaction.on_commit(autocompletar.invalidar)
+        return professores
+
+    def _criar_turmas(self, professores, disciplinas):
+        """Lista de (DisciplinaPessoa, peso). O peso decide quantas avaliações a turma recebe."""
+        # Popularidade pela lei de Zipf: o professor na posição k tem peso 1 / k^skew.
+        # Com skew 1.0, o primeiro recebe o dobro do segundo, o triplo do terceiro, ...
+        ordem = self.rng.sample(range(len(professores)), len(professores))
+        turmas, pesos = [], []
+        for posicao, indice in enumerate(ordem, start=1):
+            prof = professores[indice]
+            # Cada professor vai dar 1 ou 2 disciplinas
+            num_disciplinas = min(self.rng.randint(1, 2), len(disciplinas))
+            for disc in self.rng.sample(disciplinas, num_disciplinas):
+                turmas.append(DisciplinaPessoa(disciplina=disc, pessoa=prof.user, status='ativo'))
+                pesos.append(1 / posicao ** self.skew / num_disciplinas)
+        criadas = []
+        for lote in em_lotes(turmas, self.lote):
+            criadas.extend(DisciplinaPessoa.objects.bulk_create(lote))
+        return list(zip(criadas, pesos))
+
+    def _criar_alunos(self, quantidade, primeiro_cpf):
+        alunos = []
+        for lote in em_lotes(range(primeiro_cpf, primeiro_cpf + quantidade), self.lote):
+            usuarios = CustomUser.objects.bulk_create(self._usuario('aluno', i, 'aluno') for i in lote)
+            alunos.extend(aluno.pk for aluno in Aluno.objects.bulk_create(Aluno(user=u) for u in usuarios))
+        return alunos
+
+    def _gravar_avaliacoes(self, pendentes):
+        # Obs.: data_avaliacao é auto_now_add, então todas ficam com a data da geração
+        avaliacoes = Avaliacao.objects.bulk_create([avaliacao for avaliacao, _ in pendentes])
+        notas = []
+        for avaliacao, notas_da_avaliacao in zip(avaliacoes, (n for _, n in pendentes)):
+            for nota in notas_da_avaliacao:
+                nota.avaliacao = avaliacao
+                notas.append(nota)
+        for lote in em_lotes(notas, self.lote):
+            AvaliacaoCategoria.objects.bulk_create(lote)
@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from avaliacoes.caixa_saida import TAMANHO_LOTE, abrir_conexao, enviar_pendentes
+
+INTERVALO_PADRAO = 5  # segundos entre verificações com a fila vazia
+
+
+class Command(BaseCommand):
+    help = (
+        'Envia os e-mails da caixa de saída (EmailPendente) em lotes, por uma única conexão SMTP. '
+        'Com --loop fica rodando como worker; sem ele, esvazia a fila e termina.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=TAMANHO_LOTE,
+            help=f'E-mails por lote (padrão: {TAMANHO_LOTE}).'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Não termina: espera novos e-mails e envia assim que chegarem.'
+        )
+        parser.add_argument(
+            '--interval', type=float, default=INTERVALO_PADRAO,
+            help=f'Segundos entre verificações quando a fila está vazia (padrão: {INTERVALO_PADRAO}).'
+        )
+
+    def handle(self, *args, **options):
+        total_enviados = total_falhas = 0
+        conexao = None
+        try:
+            while True:
+                try:
+                    # A conexão fica aberta enquanto houver e-mails; com a fila vazia é
+                    # fechada (o servidor SMTP derruba conexões ociosas de qualquer jeito)
+                    if conexao is None:
+                        conexao = abrir_conexao()
+                    enviados, falhas = enviar_pendentes(conexao, options['batch_size'])
+                except Exception as erro:
+                    # Servidor SMTP fora do ar: tenta de novo no próximo ciclo
+                    self.stderr.write(f'Erro na conexão SMTP: {erro}')
+                    enviados = falhas = 0
+                    conexao = self._fechar(conexao)
+                    if not options['loop']:
+                        break
+
+                total_enviados += enviados
+                total_falhas += falhas
+                if enviados or falhas:
+                    self.stdout.write(f'Lote: {enviados} enviado(s), {falhas} falha(s).')
+                    continue
+
+                # Fila vazia (ou só e-mails aguardando a próxima tentativa)
+                if not options['loop']:
+                    break
+                conexao = self._fechar(conexao)
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._fechar(conexao)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{total_enviados} e-mail(s) enviado(s), {total_falhas} falha(s).'
+        ))
+
+    @staticmethod
+    def _fechar(conexao):
+        if conexao is not None:
+            try:
+                conexao.close()
+            except Exception:
+                pass
+        return None
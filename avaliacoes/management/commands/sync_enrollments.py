@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from avaliacoes.matriculas import TAMANHO_BLOCO, TAMANHO_LOTE, sincronizar_matriculas
+
+ERROS_EXIBIDOS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Sincroniza as matrículas com o export da secretaria (CSV com a lista COMPLETA, '
+        'colunas: aluno_cpf,professor_cpf,disciplina). Só insere o que falta e remove o que saiu '
+        '(com as avaliações do aluno para aquela turma), em lotes; sem mudanças, nada é gravado.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do CSV (UTF-8, com cabeçalho).')
+        parser.add_argument(
+            '--batch-size', type=int, default=TAMANHO_LOTE,
+            help=f'Inserções/remoções por lote/transação (padrão: {TAMANHO_LOTE}).'
+        )
+        parser.add_argument(
+            '--chunk-rows', type=int, default=TAMANHO_BLOCO,
+            help=f'Linhas do arquivo ordenadas de cada vez na memória (padrão: {TAMANHO_BLOCO}).'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Só mostra o que mudaria, sem gravar.')
+        parser.add_argument(
+            '--allow-empty', action='store_true',
+            help='Aceita um arquivo sem matrículas (remove todas). Sem isso, um arquivo vazio é recusado.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['arquivo'], encoding='utf-8-sig', newline='') as arquivo:
+                relatorio = sincronizar_matriculas(
+                    arquivo,
+                    tamanho_lote=options['batch_size'],
+                    tamanho_bloco=options['chunk_rows'],
+                    simular=options['dry_run'],
+                    permitir_vazio=options['allow_empty'],
+                )
+        except (OSError, ValueError) as erro:
+            raise CommandError(str(erro))
+
+        for linha, motivo in relatorio.erros[:ERROS_EXIBIDOS]:
+            self.stdout.write(f'Linha {linha}: {motivo}')
+        if len(relatorio.erros) > ERROS_EXIBIDOS:
+            self.stdout.write(f'... e mais {len(relatorio.erros) - ERROS_EXIBIDOS} erro(s).')
+
+        prefixo = '[simulação] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefixo}{relatorio.inseridas} matrícula(s) inserida(s), {relatorio.removidas} removida(s) '
+            f'({relatorio.avaliacoes_removidas} avaliação(ões) limpa(s)), {relatorio.inalteradas} inalterada(s), '
+            f'{len(relatorio.erros)} linha(s) com erro.'
+        ))
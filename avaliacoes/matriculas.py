@@ -0,0 +1,265 @@
+# avaliacoes/matriculas.py
+"""
+Remoção de matrículas e sincronização com o arquivo da secretaria.
+
+remover_matriculas() é a regra única de exclusão, usada pela tela (views.excluir_matricula_aluno)
+e pela sincronização: a avaliação que o aluno fez para aquela turma sai junto (e das médias,
+ver agregados.descontar_avaliacoes), para que ele possa avaliar de novo se voltar a ser matriculado.
+
+sincronizar_matriculas() espelha o export noturno da secretaria (lista COMPLETA de
+matrículas) com memória limitada:
+
+1. O CSV é lido em streaming e ordenado por (cpf do aluno, cpf do professor, código da
+   disciplina) com ordenação externa: blocos de `tamanho_bloco` linhas ordenados em
+   memória e gravados em arquivos temporários, depois intercalados com heapq.merge.
+2. As matrículas do banco são lidas na MESMA ordem (ORDER BY no SQL, com iterator()).
+3. Um merge das duas sequências ordenadas acha só as diferenças: chave só no arquivo =
+   inserir; só no banco = remover; nas duas = nada a fazer.
+4. As diferenças são aplicadas em lotes, cada lote numa transação de escrita.
+
+Sem mudanças no arquivo, nada é gravado no banco.
+"""
+
+import csv
+import heapq
+import re
+import tempfile
+from dataclasses import dataclass, field
+from itertools import groupby
+
+from django.db.models import Exists, F, OuterRef, Value
+from django.db.models.functions import Replace
+
+from .agregados import apagar_avaliacoes, descontar_avaliacoes
+from .escrita import executar_escrita
+from .models import Aluno, Avaliacao, DisciplinaPessoa, MatriculaAluno
+
+COLUNAS = ('aluno_cpf', 'professor_cpf', 'disciplina')
+TAMANHO_LOTE = 1000
+TAMANHO_BLOCO = 100_000  # linhas do arquivo ordenadas de cada vez na memória
+
+
+def remover_matriculas(matriculas):
+    """
+    Apaga as matrículas do queryset `matriculas` e as avaliações dos mesmos alunos para as
+    mesmas turmas (descontando-as das médias). Chamar dentro da transação de escrita.
+    Devolve quantas avaliações foram removidas.
+    """
+    matriculas = matriculas.order_by()
+    avaliacoes = Avaliacao.objects.filter(Exists(matriculas.filter(
+        aluno_id=OuterRef('aluno_id'), disciplina_professor_id=OuterRef('disciplina_pessoa_id')
+    )))
+    avaliacoes_removidas = 0
+    if avaliacoes.exists():
+        # Retira as notas das médias agregadas antes de apagar
+        descontar_avaliacoes(avaliacoes)
+        avaliacoes_removidas = apagar_avaliacoes(avaliacoes)
+    matriculas.delete()
+    return avaliacoes_removidas
+
+
+SEPARADORES_CPF = '.-/ '
+
+
+def _cpf(valor):
+    # O CPF é gravado como foi digitado ("123.456.789-01" ou "12345678901"): compara sem pontuação
+    return re.sub(f'[{re.escape(SEPARADORES_CPF)}]', '', (valor or '').strip())
+
+
+def _cpf_sql(campo):
+    """A mesma normalização de _cpf() no SQL, para ordenar e filtrar pelo banco."""
+    expressao = F(campo)
+    for separador in SEPARADORES_CPF:
+        expressao = Replace(expressao, Value(separador), Value(''))
+    return expressao
+
+
+@dataclass
+class RelatorioSincronizacao:
+    inseridas: int = 0
+    removidas: int = 0
+    avaliacoes_removidas: int = 0
+    inalteradas: int = 0
+    erros: list = field(default_factory=list)  # [(linha, motivo)]
+
+
+def _arquivo_temporario(linhas):
+    temporario = tempfile.TemporaryFile('w+', newline='', encoding='utf-8')
+    csv.writer(temporario).writerows(linhas)
+    temporario.seek(0)
+    return temporario
+
+
+def _ler_temporario(temporario):
+    # As três primeiras colunas são a chave; a quarta é um número (linha do CSV ou pk)
+    return ((a, b, c, int(d)) for a, b, c, d in csv.reader(temporario))
+
+
+def _blocos_ordenados(arquivo, tamanho_bloco, relatorio):
+    """
+    Lê o CSV e devolve (blocos, linhas válidas): iteradores ordenados, um por bloco,
+    de (aluno, professor, disciplina, linha).
+    """
+    leitor = csv.DictReader(arquivo)
+    colunas = [(c or '').strip().lower() for c in leitor.fieldnames or []]
+    faltando = [c for c in COLUNAS if c not in colunas]
+    if faltando:
+        raise ValueError(f"Colunas obrigatórias ausentes no CSV: {', '.join(faltando)}.")
+    leitor.fieldnames = colunas
+
+    blocos, atual, validas = [], [], 0
+    for numero, linha in enumerate(leitor, start=2):  # a linha 1 é o cabeçalho
+        chave = (_cpf(linha.get('aluno_cpf')), _cpf(linha.get('professor_cpf')), (linha.get('disciplina') or '').strip())
+        if not all(chave):
+            relatorio.erros.append((numero, 'Preencha aluno_cpf, professor_cpf e disciplina.'))
+            continue
+        atual.append((*chave, numero))
+        validas += 1
+        if len(atual) >= tamanho_bloco:
+            atual.sort()
+            blocos.append(_ler_temporario(_arquivo_temporario(atual)))
+            atual = []
+
+    # O último bloco (ou o único, se coube tudo na memória) não precisa de arquivo
+    atual.sort()
+    blocos.append(iter(atual))
+    return blocos, validas
+
+
+def _matriculas_ordenadas(tamanho_lote):
+    """
+    Matrículas do banco como (aluno, professor, disciplina, pk), na ordem da chave, copiadas
+    para um arquivo temporário. O cursor do SQLite não pode ficar aberto enquanto a mesma
+    conexão grava na tabela, então a leitura termina antes da primeira escrita.
+    """
+    consulta = MatriculaAluno.objects.annotate(
+        aluno_cpf=_cpf_sql('aluno__user__cpf'),
+        professor_cpf=_cpf_sql('disciplina_professor__pessoa__cpf'),
+    ).order_by(
+        'aluno_cpf', 'professor_cpf', 'disciplina_professor__disciplina__codigo'
+    ).values_list(
+        'aluno_cpf', 'professor_cpf', 'disciplina_professor__disciplina__codigo', 'pk'
+    )
+    return _ler_temporario(_arquivo_temporario(consulta.iterator(chunk_size=tamanho_lote)))
+
+
+def _diferencas(arquivo_ordenado, banco_ordenado, relatorio):
+    """
+    Merge de duas sequências ordenadas pela chave (aluno, professor, disciplina).
+    Gera ('inserir', (aluno, professor, disciplina, linha)) e ('remover', matricula_id).
+    """
+    # Linhas repetidas no arquivo contam uma vez só
+    arquivo = (next(grupo) for _, grupo in groupby(arquivo_ordenado, key=lambda linha: linha[:3]))
+    fim = object()
+    item_arquivo = next(arquivo, fim)
+    item_banco = next(banco_ordenado, fim)
+
+    while item_arquivo is not fim or item_banco is not fim:
+        if item_banco is fim or (item_arquivo is not fim and item_arquivo[:3] < item_banco[:3]):
+            yield 'inserir', item_arquivo
+            item_arquivo = next(arquivo, fim)
+        elif item_arquivo is fim or item_banco[:3] < item_arquivo[:3]:
+            yield 'remover', item_banco[3]
+            item_banco = next(banco_ordenado, fim)
+        else:
+            relatorio.inalteradas += 1
+            item_arquivo = next(arquivo, fim)
+            item_banco = next(banco_ordenado, fim)
+
+
+def _inserir_lote(chaves):
+    """
+    Resolve alunos e turmas do lote (2 consultas) e insere as matrículas que ainda não
+    existem (mais 1 consulta). Devolve (inseridas, já existentes, erros).
+    """
+    alunos = dict(
+        Aluno.objects.annotate(cpf=_cpf_sql('user__cpf'))
+        .filter(cpf__in={aluno for aluno, _, _, _ in chaves})
+        .values_list('cpf', 'pk')
+    )
+    turmas = {
+        (professor, disciplina): pk
+        for pk, professor, disciplina in DisciplinaPessoa.objects.annotate(
+            cpf=_cpf_sql('pessoa__cpf')
+        ).filter(
+            cpf__in={professor for _, professor, _, _ in chaves},
+            disciplina__codigo__in={disciplina for _, _, disciplina, _ in chaves},
+        ).values_list('pk', 'cpf', 'disciplina__codigo')
+    }
+
+    pares, erros = {}, []
+    for aluno, professor, disciplina, numero in chaves:
+        if aluno not in alunos:
+            erros.append((numero, f'Aluno com CPF {aluno} não encontrado.'))
+        elif (professor, disciplina) not in turmas:
+            erros.append((numero, f'Turma {disciplina} do professor {professor} não encontrada.'))
+        else:
+            pares[(alunos[aluno], turmas[(professor, disciplina)])] = numero
+
+    # O banco foi lido antes das escritas: alguém pode ter matriculado o aluno desde então.
+    # Já com o lock de escrita, o que existe é pulado, e a contagem é só do que foi inserido
+    existentes = set(MatriculaAluno.objects.filter(
+        aluno_id__in={aluno_id for aluno_id, _ in pares},
+        disciplina_professor_id__in={turma_id for _, turma_id in pares},
+    ).values_list('aluno_id', 'disciplina_professor_id'))
+    novas = [
+        MatriculaAluno(aluno_id=aluno_id, disciplina_professor_id=turma_id)
+        for aluno_id, turma_id in pares if (aluno_id, turma_id) not in existentes
+    ]
+    MatriculaAluno.objects.bulk_create(novas, ignore_conflicts=True)
+    return len(novas), len(pares) - len(novas), erros
+
+
+def _remover_lote(matricula_ids):
+    return remover_matriculas(MatriculaAluno.objects.filter(pk__in=matricula_ids))
+
+
+def sincronizar_matriculas(arquivo, tamanho_lote=TAMANHO_LOTE, tamanho_bloco=TAMANHO_BLOCO,
+                           simular=False, permitir_vazio=False):
+    """
+    Deixa as matrículas iguais ao CSV (`arquivo` aberto em modo texto, com as colunas
+    aluno_cpf, professor_cpf, disciplina = código da matéria). Com `simular`, só conta (sem
+    consultar alunos e turmas: inserções de CPF/turma inexistente entram na conta).
+    Devolve um RelatorioSincronizacao. ValueError se faltar alguma coluna ou se o arquivo
+    não tiver nenhuma matrícula (export cortado apagaria tudo), a menos de `permitir_vazio`.
+    """
+    relatorio = RelatorioSincronizacao()
+    blocos, validas = _blocos_ordenados(arquivo, tamanho_bloco, relatorio)
+    if not validas and not permitir_vazio and MatriculaAluno.objects.exists():
+        raise ValueError('O arquivo não tem nenhuma matrícula válida; nada foi alterado.')
+    banco = _matriculas_ordenadas(tamanho_lote)
+
+    inserir, remover = [], []
+
+    def aplicar_insercoes():
+        if simular:
+            relatorio.inseridas += len(inserir)
+        else:
+            inseridas, existentes, erros = executar_escrita(_inserir_lote, inserir)
+            relatorio.inseridas += inseridas
+            relatorio.inalteradas += existentes
+            relatorio.erros.extend(erros)
+        inserir.clear()
+
+    def aplicar_remocoes():
+        if not simular:
+            relatorio.avaliacoes_removidas += executar_escrita(_remover_lote, remover)
+        relatorio.removidas += len(remover)
+        remover.clear()
+
+    for acao, dados in _diferencas(heapq.merge(*blocos), banco, relatorio):
+        if acao == 'inserir':
+            inserir.append(dados)
+            if len(inserir) >= tamanho_lote:
+                aplicar_insercoes()
+        else:
+            remover.append(dados)
+            if len(remover) >= tamanho_lote:
+                aplicar_remocoes()
+    if inserir:
+        aplicar_insercoes()
+    if remover:
+        aplicar_remocoes()
+
+    relatorio.erros.sort()
+    return relatorio
@@ -0,0 +1,272 @@
+# avaliacoes/metricas.py
+"""
+Métricas por view, em memória (por processo), para achar as páginas lentas em produção.
+
+MetricasMiddleware mede cada requisição e soma os números no `registro`, agrupados pelo
+nome da URL resolvida (request.resolver_match.view_name):
+
+1. quantidade de requisições, respostas 5xx e histograma de latência (faixas fixas,
+   as mesmas do Prometheus, FAIXAS_LATENCIA);
+2. consultas SQL (total e maior quantidade numa requisição) e tempo de SQL, medidos com
+   connection.execute_wrapper;
+3. tempo de renderização de templates: Template.render é envolvido uma única vez e só o
+   template mais externo de cada requisição conta (os {% include %} não somam duas vezes).
+   O SQL disparado durante a renderização (querysets preguiçosos) entra nos dois tempos.
+
+Memória limitada: cada view ocupa um tamanho fixo e há no máximo METRICAS_MAX_VIEWS nomes;
+o excedente é somado em OUTRAS. URLs que não resolvem (404) ficam em SEM_ROTA.
+
+Os números valem desde o início do processo (ou do último zerar()). Com vários workers,
+cada um tem os seus: a página e o endpoint mostram os do worker que respondeu.
+
+Leitura: views.metricas_painel (staff, piores views primeiro) e views.metricas_prometheus
+(formato texto do Prometheus, ver prometheus()).
+"""
+
+import math
+import threading
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field, replace
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.template.base import Template
+
+# Limites superiores (segundos) das faixas do histograma; a última faixa é +Inf
+FAIXAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MAX_VIEWS = getattr(settings, 'METRICAS_MAX_VIEWS', 200)
+SEM_ROTA = '(sem rota)'
+OUTRAS = '(outras)'
+
+# Ordenações da página de métricas: chave do resumo() usada, da pior para a melhor
+ORDENACOES = {
+    'p95': 'p95_ms',
+    'media': 'media_ms',
+    'total': 'total_s',
+    'consultas': 'media_consultas',
+    'sql': 'media_sql_ms',
+    'template': 'media_template_ms',
+    'requisicoes': 'requisicoes',
+}
+
+
+@dataclass
+class MetricaView:
+    """Acumulado de uma view. Tamanho fixo, não importa quantas requisições."""
+    requisicoes: int = 0
+    erros: int = 0  # respostas 5xx
+    faixas: list = field(default_factory=lambda: [0] * (len(FAIXAS_LATENCIA) + 1))
+    segundos: float = 0.0
+    maior_segundos: float = 0.0
+    consultas: int = 0
+    maior_consultas: int = 0
+    segundos_sql: float = 0.0
+    segundos_template: float = 0.0
+
+    def somar(self, medicao, segundos, status):
+        self.requisicoes += 1
+        if status >= 500:
+            self.erros += 1
+        faixa = next((i for i, limite in enumerate(FAIXAS_LATENCIA) if segundos <= limite), len(FAIXAS_LATENCIA))
+        self.faixas[faixa] += 1
+        self.segundos += segundos
+        self.maior_segundos = max(self.maior_segundos, segundos)
+        self.consultas += medicao.consultas
+        self.maior_consultas = max(self.maior_consultas, medicao.consultas)
+        self.segundos_sql += medicao.segundos_sql
+        self.segundos_template += medicao.segundos_template
+
+    def percentil(self, p):
+        """
+        Estimativa (segundos) pelo histograma: o limite da faixa onde cai o percentil `p`,
+        sem passar da maior latência vista.
+        """
+        if not self.requisicoes:
+            return 0.0
+        alvo = math.ceil(self.requisicoes * p / 100)
+        acumulado = 0
+        for limite, qtde in zip(FAIXAS_LATENCIA, self.faixas):
+            acumulado += qtde
+            if acumulado >= alvo:
+                return min(limite, self.maior_segundos)
+        return self.maior_segundos
+
+
+@dataclass
+class _Medicao:
+    """Números de UMA requisição. Também é o execute_wrapper que conta o SQL."""
+    consultas: int = 0
+    segundos_sql: float = 0.0
+    segundos_template: float = 0.0
+    renderizando: bool = False
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos_sql += time.perf_counter() - inicio
+            self.consultas += 1
+
+
+class Registro:
+    """As MetricaView do processo, por nome de view, protegidas por uma trava."""
+
+    def __init__(self, max_views=MAX_VIEWS):
+        self.max_views = max_views
+        self._trava = threading.Lock()
+        self._views = {}
+        self.inicio = time.time()
+
+    def registrar(self, view, medicao, segundos, status):
+        with self._trava:
+            metrica = self._views.get(view)
+            if metrica is None:
+                if len(self._views) >= self.max_views:
+                    view = OUTRAS
+                metrica = self._views.setdefault(view, MetricaView())
+            metrica.somar(medicao, segundos, status)
+
+    def copia(self):
+        """{view: MetricaView} congelado, para ler sem segurar a trava."""
+        with self._trava:
+            return {view: replace(metrica, faixas=list(metrica.faixas)) for view, metrica in self._views.items()}
+
+    def zerar(self):
+        with self._trava:
+            self._views.clear()
+            self.inicio = time.time()
+
+
+registro = Registro()
+
+# Medição da requisição em andamento (None fora do middleware)
+_medicao_atual = ContextVar('avaliacoes_metricas_medicao', default=None)
+_render_original = None
+
+
+def _instrumentar_templates():
+    """Envolve Template.render (uma vez por processo) para somar o tempo na medição atual."""
+    global _render_original
+    if _render_original is not None:
+        return
+    _render_original = Template.render
+
+    @wraps(_render_original)
+    def render(self, context):
+        medicao = _medicao_atual.get()
+        if medicao is None or medicao.renderizando:
+            # Fora de uma requisição medida, ou template incluído em outro (já está contando)
+            return _render_original(self, context)
+        medicao.renderizando = True
+        inicio = time.perf_counter()
+        try:
+            return _render_original(self, context)
+        finally:
+            medicao.segundos_template += time.perf_counter() - inicio
+            medicao.renderizando = False
+
+    Template.render = render
+
+
+def _nome_view(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else SEM_ROTA
+
+
+class MetricasMiddleware:
+    """Mede cada requisição e soma no `registro` (ver o topo do arquivo)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        _instrumentar_templates()
+
+    def __call__(self, request):
+        medicao = _Medicao()
+        token = _medicao_atual.set(medicao)
+        status = 500  # se a exceção escapar de todo o Django, conta como erro
+        inicio = time.perf_counter()
+        try:
+            with connection.execute_wrapper(medicao):
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            segundos = time.perf_counter() - inicio
+            _medicao_atual.reset(token)
+            registro.registrar(_nome_view(request), medicao, segundos, status)
+
+
+def resumo(ordem='p95', registro_metricas=None):
+    """
+    Uma linha (dict; tempos em ms, exceto total_s) por view, da pior para a melhor segundo `ordem`
+    (uma das chaves de ORDENACOES).
+    """
+    chave = ORDENACOES[ordem]
+    linhas = []
+    for view, metrica in (registro_metricas or registro).copia().items():
+        n = metrica.requisicoes
+        linhas.append({
+            'view': view,
+            'requisicoes': n,
+            'erros': metrica.erros,
+            'media_ms': metrica.segundos / n * 1000,
+            'p50_ms': metrica.percentil(50) * 1000,
+            'p95_ms': metrica.percentil(95) * 1000,
+            'maior_ms': metrica.maior_segundos * 1000,
+            'total_s': metrica.segundos,
+            'media_consultas': metrica.consultas / n,
+            'maior_consultas': metrica.maior_consultas,
+            'media_sql_ms': metrica.segundos_sql / n * 1000,
+            'media_template_ms': metrica.segundos_template / n * 1000,
+        })
+    linhas.sort(key=lambda linha: (-linha[chave], linha['view']))
+    return linhas
+
+
+def _rotulo(valor):
+    # Escapes do formato texto do Prometheus para valores de label
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def prometheus(registro_metricas=None):
+    """As métricas no formato texto do Prometheus (version 0.0.4), com o label `view`."""
+    metricas = sorted((registro_metricas or registro).copia().items())
+    linhas = []
+
+    def serie(nome, tipo, ajuda, valores):
+        linhas.append(f'# HELP {nome} {ajuda}')
+        linhas.append(f'# TYPE {nome} {tipo}')
+        for view, valor in valores:
+            linhas.append(f'{nome}{{view="{_rotulo(view)}"}} {valor}')
+
+    serie('avaliacoes_http_requests_total', 'counter', 'Requisições atendidas.',
+          [(view, m.requisicoes) for view, m in metricas])
+    serie('avaliacoes_http_errors_total', 'counter', 'Respostas com status 5xx.',
+          [(view, m.erros) for view, m in metricas])
+
+    nome = 'avaliacoes_http_request_duration_seconds'
+    linhas.append(f'# HELP {nome} Latência das requisições, medida no middleware.')
+    linhas.append(f'# TYPE {nome} histogram')
+    for view, m in metricas:
+        rotulo = _rotulo(view)
+        acumulado = 0
+        for limite, qtde in zip(FAIXAS_LATENCIA, m.faixas):
+            acumulado += qtde
+            linhas.append(f'{nome}_bucket{{view="{rotulo}",le="{limite}"}} {acumulado}')
+        linhas.append(f'{nome}_bucket{{view="{rotulo}",le="+Inf"}} {m.requisicoes}')
+        linhas.append(f'{nome}_sum{{view="{rotulo}"}} {m.segundos}')
+        linhas.append(f'{nome}_count{{view="{rotulo}"}} {m.requisicoes}')
+
+    serie('avaliacoes_sql_queries_total', 'counter', 'Consultas SQL executadas.',
+          [(view, m.consultas) for view, m in metricas])
+    serie('avaliacoes_sql_queries_max', 'gauge', 'Maior número de consultas SQL numa requisição.',
+          [(view, m.maior_consultas) for view, m in metricas])
+    serie('avaliacoes_sql_duration_seconds_total', 'counter', 'Tempo gasto nas consultas SQL.',
+          [(view, m.segundos_sql) for view, m in metricas])
+    serie('avaliacoes_template_duration_seconds_total', 'counter', 'Tempo gasto renderizando templates.',
+          [(view, m.segundos_template) for view, m in metricas])
+    return '\n'.join(linhas) + '\n'
@@ -0,0 +1,208 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:40
+
+from collections import defaultdict
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+UNIVERSIDADE_PK = 1
+
+
+def _media(soma, qtde):
+    return (soma / qtde).quantize(Decimal('0.01')) if qtde > 0 else Decimal('0')
+
+
+def apagar_medias(apps, schema_editor):
+    # Antes desta migração as tabelas Media* não eram mantidas: as linhas antigas não valem nada
+    for nome in ('MediaDisciplinaCategoria', 'MediaDisciplina', 'MediaProfessor', 'MediaUniversidade'):
+        apps.get_model('avaliacoes', nome).objects.all().delete()
+
+
+def preencher_medias(apps, schema_editor):
+    """
+    Soma as notas já gravadas nas tabelas Media* (mesmas regras do rebuild_aggregates;
+    modelos históricos não enxergam avaliacoes/agregados.py). Sem isto, as escritas
+    seguintes aplicariam os deltas sobre tabelas vazias.
+    """
+    AvaliacaoCategoria = apps.get_model('avaliacoes', 'AvaliacaoCategoria')
+    MediaDisciplina = apps.get_model('avaliacoes', 'MediaDisciplina')
+    MediaDisciplinaCategoria = apps.get_model('avaliacoes', 'MediaDisciplinaCategoria')
+    MediaProfessor = apps.get_model('avaliacoes', 'MediaProfessor')
+    MediaUniversidade = apps.get_model('avaliacoes', 'MediaUniversidade')
+
+    notas = AvaliacaoCategoria.objects.filter(avaliacao__disciplina_pessoa__isnull=False)
+
+    MediaDisciplinaCategoria.objects.bulk_create(
+        [
+            MediaDisciplinaCategoria(
+                disciplina_pessoa_id=linha['avaliacao__disciplina_pessoa_id'], categoria_id=linha['categoria_id'],
+                soma_notas=linha['soma'], qtde_avaliacoes=linha['qtde'], media=_media(linha['soma'], linha['qtde']),
+            )
+            for linha in notas.values('avaliacao__disciplina_pessoa_id', 'categoria_id').annotate(
+                soma=Sum('nota'), qtde=Count('id')
+            ).order_by()
+        ],
+        batch_size=500,
+    )
+
+    # [soma, qtde_notas, qtde_avaliacoes, qtde_disciplinas]
+    professores = defaultdict(lambda: [Decimal('0'), 0, 0, 0])
+    turmas = []
+    for linha in notas.values('avaliacao__disciplina_pessoa_id', 'avaliacao__disciplina_pessoa__pessoa_id').annotate(
+        soma=Sum('nota'), qtde=Count('id'), avaliacoes=Count('avaliacao_id', distinct=True)
+    ).order_by():
+        turmas.append(MediaDisciplina(
+            disciplina_pessoa_id=linha['avaliacao__disciplina_pessoa_id'], soma_notas=linha['soma'],
+            qtde_notas=linha['qtde'], qtde_avaliacoes=linha['avaliacoes'], media=_media(linha['soma'], linha['qtde']),
+        ))
+        total = professores[linha['avaliacao__disciplina_pessoa__pessoa_id']]
+        total[0] += linha['soma']
+        total[1] += linha['qtde']
+        total[2] += linha['avaliacoes']
+        total[3] += 1
+    MediaDisciplina.objects.bulk_create(turmas, batch_size=500)
+
+    MediaProfessor.objects.bulk_create(
+        [
+            MediaProfessor(
+                pessoa_id=pessoa_id, soma_notas=soma, qtde_notas=qtde, qtde_avaliacoes=avaliacoes,
+                qtde_disciplinas=disciplinas, media=_media(soma, qtde),
+            )
+            for pessoa_id, (soma, qtde, avaliacoes, disciplinas) in professores.items()
+        ],
+        batch_size=500,
+    )
+
+    if professores:
+        soma = sum((total[0] for total in professores.values()), Decimal('0'))
+        qtde = sum(total[1] for total in professores.values())
+        MediaUniversidade.objects.create(
+            pk=UNIVERSIDADE_PK, soma_notas=soma, qtde_notas=qtde, media=_media(soma, qtde),
+            qtde_avaliacoes=sum(total[2] for total in professores.values()),
+            qtde_disciplinas=sum(total[3] for total in professores.values()),
+            qtde_professores=len(professores),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avaliacoes', '0007_avaliacao_aluno_alter_avaliacao_unique_together'),
+    ]
+
+    operations = [
+        migrations.RunPython(apagar_medias, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='mediadisciplina',
+            name='qtde_notas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediadisciplina',
+            name='soma_notas',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='mediadisciplinacategoria',
+            name='soma_notas',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='mediaprofessor',
+            name='qtde_notas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediaprofessor',
+            name='soma_notas',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='mediauniversidade',
+            name='qtde_notas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediauniversidade',
+            name='soma_notas',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=16),
+        ),
+        migrations.AlterField(
+            model_name='mediadisciplina',
+            name='disciplina_pessoa',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='media_agregada', to='avaliacoes.disciplinapessoa'),
+        ),
+        migrations.AlterField(
+            model_name='mediadisciplina',
+            name='media',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=4),
+        ),
+        migrations.AlterField(
+            model_name='mediadisciplina',
+            name='qtde_avaliacoes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mediadisciplinacategoria',
+            name='disciplina_pessoa',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='medias_categoria', to='avaliacoes.disciplinapessoa'),
+        ),
+        migrations.AlterField(
+            model_name='mediadisciplinacategoria',
+            name='media',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=4),
+        ),
+        migrations.AlterField(
+            model_name='mediadisciplinacategoria',
+            name='qtde_avaliacoes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mediaprofessor',
+            name='media',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=4),
+        ),
+        migrations.AlterField(
+            model_name='mediaprofessor',
+            name='pessoa',
+            field=models.OneToOneField(limit_choices_to={'user_type': 'professor'}, on_delete=django.db.models.deletion.CASCADE, related_name='media_professor', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='mediaprofessor',
+            name='qtde_avaliacoes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mediaprofessor',
+            name='qtde_disciplinas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mediauniversidade',
+            name='media',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=4),
+        ),
+        migrations.AlterField(
+            model_name='mediauniversidade',
+            name='qtde_avaliacoes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mediauniversidade',
+            name='qtde_disciplinas',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='mediauniversidade',
+            name='qtde_professores',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterUniqueTogether(
+            name='mediadisciplinacategoria',
+            unique_together={('disciplina_pessoa', 'categoria')},
+        ),
+        migrations.RunPython(preencher_medias, migrations.RunPython.noop),
+    ]
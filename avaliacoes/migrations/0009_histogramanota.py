@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def preencher_histogramas(apps, schema_editor):
+    # Quantas vezes cada nota já apareceu por (turma, categoria), como faz o rebuild_aggregates
+    AvaliacaoCategoria = apps.get_model('avaliacoes', 'AvaliacaoCategoria')
+    HistogramaNota = apps.get_model('avaliacoes', 'HistogramaNota')
+    HistogramaNota.objects.bulk_create(
+        [
+            HistogramaNota(
+                disciplina_pessoa_id=linha['avaliacao__disciplina_pessoa_id'], categoria_id=linha['categoria_id'],
+                nota=linha['nota'], qtde=linha['qtde'],
+            )
+            for linha in AvaliacaoCategoria.objects.filter(avaliacao__disciplina_pessoa__isnull=False).values(
+                'avaliacao__disciplina_pessoa_id', 'categoria_id', 'nota'
+            ).annotate(qtde=Count('id')).order_by()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avaliacoes', '0008_medias_incrementais'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistogramaNota',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nota', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('qtde', models.IntegerField(default=0)),
+                ('categoria', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='avaliacoes.categoria')),
+                ('disciplina_pessoa', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='histogramas', to='avaliacoes.disciplinapessoa')),
+            ],
+            options={
+                'unique_together': {('disciplina_pessoa', 'categoria', 'nota')},
+            },
+        ),
+        migrations.RunPython(preencher_histogramas, migrations.RunPython.noop),
+    ]
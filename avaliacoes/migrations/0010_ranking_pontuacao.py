@@ -0,0 +1,89 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Case, ExpressionWrapper, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast
+from django.db.models.lookups import LessThanOrEqual
+
+UNIVERSIDADE_PK = 1
+PESO_PRIOR = getattr(settings, 'RANKING_PESO_PRIOR', 10)
+
+
+def _pontuacao(soma, qtde_notas, qtde_avaliacoes, media_prior):
+    # A conta de avaliacoes/ranking.py na data desta migração (migrações não importam o app)
+    return Case(
+        When(LessThanOrEqual(qtde_notas, 0), then=Value(0.0)),
+        default=ExpressionWrapper(
+            (Value(PESO_PRIOR * float(media_prior)) + Cast(soma, FloatField()) / qtde_notas * qtde_avaliacoes)
+            / (Value(float(PESO_PRIOR)) + qtde_avaliacoes),
+            output_field=FloatField(),
+        ),
+        output_field=FloatField(),
+    )
+
+
+def preencher_ranking(apps, schema_editor):
+    """Matéria de cada MediaDisciplina e as pontuações com a média geral atual como prior."""
+    DisciplinaPessoa = apps.get_model('avaliacoes', 'DisciplinaPessoa')
+    MediaDisciplina = apps.get_model('avaliacoes', 'MediaDisciplina')
+    MediaDisciplinaCategoria = apps.get_model('avaliacoes', 'MediaDisciplinaCategoria')
+    MediaUniversidade = apps.get_model('avaliacoes', 'MediaUniversidade')
+
+    media_prior = MediaUniversidade.objects.filter(pk=UNIVERSIDADE_PK).values_list('media', flat=True).first()
+    if media_prior is None:
+        return
+    MediaUniversidade.objects.filter(pk=UNIVERSIDADE_PK).update(media_ranking=media_prior)
+    MediaDisciplina.objects.update(
+        disciplina_id=Subquery(
+            DisciplinaPessoa.objects.filter(pk=OuterRef('disciplina_pessoa_id')).values('disciplina_id')[:1]
+        ),
+        pontuacao=_pontuacao(F('soma_notas'), F('qtde_notas'), F('qtde_avaliacoes'), media_prior),
+    )
+    MediaDisciplinaCategoria.objects.update(
+        pontuacao=_pontuacao(F('soma_notas'), F('qtde_avaliacoes'), F('qtde_avaliacoes'), media_prior),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avaliacoes', '0009_histogramanota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediadisciplina',
+            name='disciplina',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='avaliacoes.materia'),
+        ),
+        migrations.AddField(
+            model_name='mediadisciplina',
+            name='pontuacao',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediadisciplinacategoria',
+            name='pontuacao',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='mediauniversidade',
+            name='media_ranking',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=4),
+        ),
+        migrations.AddIndex(
+            model_name='mediadisciplina',
+            index=models.Index(fields=['-pontuacao'], name='mediadisc_pontuacao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediadisciplina',
+            index=models.Index(fields=['disciplina', '-pontuacao'], name='mediadisc_materia_pont_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mediadisciplinacategoria',
+            index=models.Index(fields=['categoria', '-pontuacao'], name='mediadisccat_pontuacao_idx'),
+        ),
+        migrations.RunPython(preencher_ranking, migrations.RunPython.noop),
+    ]
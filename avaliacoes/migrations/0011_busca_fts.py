@@ -0,0 +1,105 @@
+from django.db import migrations
+
+# Índices FTS5 de avaliacoes/busca.py e os triggers que os mantêm sincronizados.
+# Só existem no SQLite; em outro banco a migração não faz nada e a busca usa icontains.
+
+CRIAR = [
+    # --- Professores: o nome fica no usuário, então copiamos "first_name last_name" ---
+    """CREATE VIRTUAL TABLE busca_professor USING fts5(
+        nome, tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER busca_professor_ai AFTER INSERT ON avaliacoes_professor BEGIN
+        INSERT INTO busca_professor(rowid, nome)
+        SELECT new.id, u.first_name || ' ' || u.last_name FROM avaliacoes_customuser u WHERE u.id = new.user_id;
+    END""",
+    """CREATE TRIGGER busca_professor_ad AFTER DELETE ON avaliacoes_professor BEGIN
+        DELETE FROM busca_professor WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER busca_professor_au AFTER UPDATE OF user_id ON avaliacoes_professor BEGIN
+        UPDATE busca_professor SET nome = (
+            SELECT u.first_name || ' ' || u.last_name FROM avaliacoes_customuser u WHERE u.id = new.user_id
+        ) WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER busca_professor_usuario_au AFTER UPDATE OF first_name, last_name ON avaliacoes_customuser BEGIN
+        UPDATE busca_professor SET nome = new.first_name || ' ' || new.last_name
+        WHERE rowid IN (SELECT id FROM avaliacoes_professor WHERE user_id = new.id);
+    END""",
+    """INSERT INTO busca_professor(rowid, nome)
+       SELECT p.id, u.first_name || ' ' || u.last_name
+       FROM avaliacoes_professor p JOIN avaliacoes_customuser u ON u.id = p.user_id""",
+
+    # --- Matérias ---
+    """CREATE VIRTUAL TABLE busca_materia USING fts5(
+        nome, tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER busca_materia_ai AFTER INSERT ON avaliacoes_materia BEGIN
+        INSERT INTO busca_materia(rowid, nome) VALUES (new.id, new.nome);
+    END""",
+    """CREATE TRIGGER busca_materia_ad AFTER DELETE ON avaliacoes_materia BEGIN
+        DELETE FROM busca_materia WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER busca_materia_au AFTER UPDATE OF nome ON avaliacoes_materia BEGIN
+        UPDATE busca_materia SET nome = new.nome WHERE rowid = new.id;
+    END""",
+    "INSERT INTO busca_materia(rowid, nome) SELECT id, nome FROM avaliacoes_materia",
+
+    # --- Comentários: conteúdo externo (o texto continua só em avaliacoes_avaliacao).
+    #     Só entram as avaliações com comentário; o 'delete' precisa do texto antigo exato.
+    """CREATE VIRTUAL TABLE busca_comentario USING fts5(
+        comentario, content='avaliacoes_avaliacao', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER busca_comentario_ai AFTER INSERT ON avaliacoes_avaliacao
+       WHEN new.comentario IS NOT NULL BEGIN
+        INSERT INTO busca_comentario(rowid, comentario) VALUES (new.id, new.comentario);
+    END""",
+    """CREATE TRIGGER busca_comentario_ad AFTER DELETE ON avaliacoes_avaliacao
+       WHEN old.comentario IS NOT NULL BEGIN
+        INSERT INTO busca_comentario(busca_comentario, rowid, comentario) VALUES ('delete', old.id, old.comentario);
+    END""",
+    # Um trigger só, para garantir a ordem: primeiro remove o texto antigo, depois indexa o novo
+    """CREATE TRIGGER busca_comentario_au AFTER UPDATE OF comentario ON avaliacoes_avaliacao BEGIN
+        INSERT INTO busca_comentario(busca_comentario, rowid, comentario)
+        SELECT 'delete', old.id, old.comentario WHERE old.comentario IS NOT NULL;
+        INSERT INTO busca_comentario(rowid, comentario)
+        SELECT new.id, new.comentario WHERE new.comentario IS NOT NULL;
+    END""",
+    """INSERT INTO busca_comentario(rowid, comentario)
+       SELECT id, comentario FROM avaliacoes_avaliacao WHERE comentario IS NOT NULL""",
+]
+
+REMOVER = [
+    'DROP TRIGGER IF EXISTS busca_comentario_au',
+    'DROP TRIGGER IF EXISTS busca_comentario_ad',
+    'DROP TRIGGER IF EXISTS busca_comentario_ai',
+    'DROP TABLE IF EXISTS busca_comentario',
+    'DROP TRIGGER IF EXISTS busca_materia_au',
+    'DROP TRIGGER IF EXISTS busca_materia_ad',
+    'DROP TRIGGER IF EXISTS busca_materia_ai',
+    'DROP TABLE IF EXISTS busca_materia',
+    'DROP TRIGGER IF EXISTS busca_professor_usuario_au',
+    'DROP TRIGGER IF EXISTS busca_professor_au',
+    'DROP TRIGGER IF EXISTS busca_professor_ad',
+    'DROP TRIGGER IF EXISTS busca_professor_ai',
+    'DROP TABLE IF EXISTS busca_professor',
+]
+
+
+def _executar(comandos):
+    def executar(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for sql in comandos:
+            schema_editor.execute(sql)
+    return executar
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avaliacoes', '0010_ranking_pontuacao'),
+    ]
+
+    operations = [
+        migrations.RunPython(_executar(CRIAR), _executar(REMOVER)),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:09
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avaliacoes', '0012_respostaidempotente'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailPendente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('assunto', models.CharField(max_length=255)),
+                ('corpo', models.TextField()),
+                ('corpo_html', models.TextField(blank=True, null=True)),
+                ('remetente', models.CharField(blank=True, max_length=255)),
+                ('destinatarios', models.JSONField()),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('enviado', 'Enviado'), ('falhou', 'Falhou')], default='pendente', max_length=10)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('proxima_tentativa', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ultimo_erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('enviado_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'E-mail Pendente',
+                'verbose_name_plural': 'Caixa de Saída',
+                'indexes': [models.Index(fields=['status', 'proxima_tentativa'], name='avaliacoes__status_3e04ce_idx')],
+            },
+        ),
+    ]
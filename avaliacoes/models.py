@@ -3,6 +3,12 @@ from django.contrib.auth.models import AbstractUser
 from unidecode import unidecode
 from django.utils import timezone
 
+
+def normalizar_busca(texto):
+    # Mesma normalização do Materia.nome_normalized ("João  Silva" -> "joao silva")
+    return ' '.join(unidecode(texto or '').lower().split())
+
+
 class CustomUser(AbstractUser):
     USER_TYPE_CHOICES = (
         ('aluno', 'Aluno'),
@@ -95,39 +101,86 @@ class AvaliacaoCategoria(models.Model):
         return f"{self.avaliacao} - {self.categoria.nome_categoria}: {self.nota}"
 
 class MediaDisciplina(models.Model):
-    disciplina_pessoa = models.ForeignKey(DisciplinaPessoa, on_delete=models.CASCADE)
-    media = models.DecimalField(max_digits=4, decimal_places=2)
-    qtde_avaliacoes = models.IntegerField()
+    # Uma linha por turma que JÁ TEM avaliações (mantida por avaliacoes/agregados.py).
+    # Guardamos soma e quantidade de notas para que cada atualização seja O(1)
+    # e a média continue exata; 'media' é só a versão arredondada para exibição.
+    disciplina_pessoa = models.OneToOneField(DisciplinaPessoa, on_delete=models.CASCADE, related_name='media_agregada')
+    # Cópia de disciplina_pessoa.disciplina para o ranking por matéria usar o índice sem JOIN
+    disciplina = models.ForeignKey(Materia, on_delete=models.CASCADE, null=True, blank=True)
+    media = models.DecimalField(max_digits=4, decimal_places=2, default=0)
+    soma_notas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    qtde_notas = models.IntegerField(default=0)
+    qtde_avaliacoes = models.IntegerField(default=0)
+    # Média bayesiana usada no ranking (ver avaliacoes/ranking.py)
+    pontuacao = models.FloatField(default=0)
     ultima_atualizacao = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-pontuacao'], name='mediadisc_pontuacao_idx'),
+            models.Index(fields=['disciplina', '-pontuacao'], name='mediadisc_materia_pont_idx'),
+        ]
+
     def __str__(self):
         return f"Média Disciplina {self.disciplina_pessoa}"
 
 class MediaDisciplinaCategoria(models.Model):
-    disciplina_pessoa = models.ForeignKey(DisciplinaPessoa, on_delete=models.CASCADE)
+    # Aqui cada avaliação gera exatamente uma nota, então 'qtde_avaliacoes' é a quantidade de notas.
+    disciplina_pessoa = models.ForeignKey(DisciplinaPessoa, on_delete=models.CASCADE, related_name='medias_categoria')
     categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE)
-    media = models.DecimalField(max_digits=4, decimal_places=2)
-    qtde_avaliacoes = models.IntegerField()
+    media = models.DecimalField(max_digits=4, decimal_places=2, default=0)
+    soma_notas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    qtde_avaliacoes = models.IntegerField(default=0)
+    pontuacao = models.FloatField(default=0)
     ultima_atualizacao = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        unique_together = ('disciplina_pessoa', 'categoria')
+        indexes = [
+            models.Index(fields=['categoria', '-pontuacao'], name='mediadisccat_pontuacao_idx'),
+        ]
+
     def __str__(self):
         return f"{self.disciplina_pessoa} - {self.categoria.nome_categoria}"
 
+class HistogramaNota(models.Model):
+    # Quantas vezes cada nota apareceu por (turma, categoria). As notas são discretas
+    # (passo de 0,5), então cada par tem no máximo ~21 linhas e dá para calcular
+    # mediana, quartis, média e desvio padrão exatos sem ler a AvaliacaoCategoria.
+    disciplina_pessoa = models.ForeignKey(DisciplinaPessoa, on_delete=models.CASCADE, related_name='histogramas')
+    categoria = models.ForeignKey(Categoria, on_delete=models.CASCADE)
+    nota = models.DecimalField(max_digits=4, decimal_places=2)
+    qtde = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('disciplina_pessoa', 'categoria', 'nota')
+
+    def __str__(self):
+        return f"{self.disciplina_pessoa} - {self.categoria.nome_categoria}: {self.nota} ({self.qtde}x)"
+
 class MediaProfessor(models.Model):
-    pessoa = models.ForeignKey(CustomUser, on_delete=models.CASCADE, limit_choices_to={'user_type': 'professor'})
-    media = models.DecimalField(max_digits=4, decimal_places=2)
-    qtde_disciplinas = models.IntegerField()
-    qtde_avaliacoes = models.IntegerField()
+    # 'qtde_disciplinas' conta apenas as turmas do professor que já foram avaliadas.
+    pessoa = models.OneToOneField(CustomUser, on_delete=models.CASCADE, limit_choices_to={'user_type': 'professor'}, related_name='media_professor')
+    media = models.DecimalField(max_digits=4, decimal_places=2, default=0)
+    soma_notas = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    qtde_notas = models.IntegerField(default=0)
+    qtde_disciplinas = models.IntegerField(default=0)
+    qtde_avaliacoes = models.IntegerField(default=0)
     ultima_atualizacao = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Média Professor {self.pessoa}"
 
 class MediaUniversidade(models.Model):
-    media = models.DecimalField(max_digits=4, decimal_places=2)
-    qtde_professores = models.IntegerField()
-    qtde_disciplinas = models.IntegerField()
-    qtde_avaliacoes = models.IntegerField()
+    # Linha única (pk=1). Os contadores consideram apenas professores/turmas com avaliações.
+    media = models.DecimalField(max_digits=4, decimal_places=2, default=0)
+    soma_notas = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    qtde_notas = models.IntegerField(default=0)
+    qtde_professores = models.IntegerField(default=0)
+    qtde_disciplinas = models.IntegerField(default=0)
+    qtde_avaliacoes = models.IntegerField(default=0)
+    # Média "a priori" usada em TODAS as pontuações do ranking no momento (ver avaliacoes/ranking.py)
+    media_ranking = models.DecimalField(max_digits=4, decimal_places=2, default=0)
     ultima_atualizacao = models.DateTimeField(auto_now=True)
 
     def __str__(self):
@@ -182,4 +235,55 @@ class MatriculaAluno(models.Model):
 
     def __str__(self):
         # Acesso ao CustomUser através do Aluno: aluno.user
-        return f"{self.aluno.user.get_full_name()} - {self.disciplina_professor}" 
\ No newline at end of file
+        return f"{self.aluno.user.get_full_name()} - {self.disciplina_professor}" 
+class RespostaIdempotente(models.Model):
+    # Resposta já enviada para um cabeçalho Idempotency-Key (ver avaliacoes/idempotencia.py).
+    # Um reenvio com a mesma chave recebe esta resposta sem executar a view de novo.
+    # As linhas vencidas (IDEMPOTENCIA_TTL) são apagadas aos poucos pelas próprias escritas.
+    usuario = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    endpoint = models.CharField(max_length=100)
+    chave = models.CharField(max_length=255)
+    hash_corpo = models.CharField(max_length=64)  # sha256 do corpo: mesma chave com outro corpo é erro
+    status = models.PositiveSmallIntegerField()
+    content_type = models.CharField(max_length=100)
+    corpo = models.TextField()
+    criada_em = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        unique_together = ('usuario', 'endpoint', 'chave')
+
+    def __str__(self):
+        return f"{self.endpoint} [{self.chave}] -> {self.status}"
+
+class EmailPendente(models.Model):
+    # Caixa de saída (ver avaliacoes/caixa_saida.py). As views só gravam aqui; o comando
+    # send_outbox envia em lotes por uma conexão SMTP e anota o resultado.
+    PENDENTE = 'pendente'
+    ENVIADO = 'enviado'
+    FALHOU = 'falhou'
+    STATUS_CHOICES = (
+        (PENDENTE, 'Pendente'),
+        (ENVIADO, 'Enviado'),
+        (FALHOU, 'Falhou'),
+    )
+
+    assunto = models.CharField(max_length=255)
+    corpo = models.TextField()
+    corpo_html = models.TextField(null=True, blank=True)
+    remetente = models.CharField(max_length=255, blank=True)  # vazio = DEFAULT_FROM_EMAIL
+    destinatarios = models.JSONField()  # lista de endereços
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDENTE)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField(default=timezone.now)
+    ultimo_erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    enviado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "E-mail Pendente"
+        verbose_name_plural = "Caixa de Saída"
+        # O worker procura: status='pendente' AND proxima_tentativa <= agora
+        indexes = [models.Index(fields=['status', 'proxima_tentativa'])]
+
+    def __str__(self):
+        return f"{self.assunto} -> {', '.join(self.destinatarios)} ({self.status})"
@@ -0,0 +1,211 @@
+# avaliacoes/perfilamento.py
+"""
+Perfil (profile) de uma requisição sob demanda, para investigar uma página lenta em
+produção (ex.: detalhes_professor de um professor específico) sem reproduzir os dados.
+
+PerfilMiddleware perfila a requisição quando:
+- um usuário staff pede, com ?_perfil=1 na URL ou o cabeçalho "X-Perfil: 1" (a resposta
+  volta normal, com o cabeçalho X-Perfil apontando para o download do relatório);
+- ou por amostragem: uma fração PERFIL_AMOSTRAGEM (0 a 1; 0 = desligado) de TODAS as
+  requisições, para colher perfis do tráfego real.
+
+Cada perfil vira um relatório em texto (PERFIL_DIR/<nome>.txt) com:
+1. cProfile ordenado por tempo acumulado;
+2. os maiores pontos de alocação do tracemalloc (memória alocada durante a requisição e
+   ainda viva no fim dela) e o pico de memória;
+3. o SQL executado, com o tempo de cada consulta. Só o SQL com os placeholders: os valores
+   dos parâmetros ficam fora, porque incluem a chave da sessão e os dados do usuário de
+   quem fez a requisição (quem baixasse o perfil poderia usar a sessão dele).
+Os dados brutos do cProfile ficam em <nome>.prof (abre com pstats ou snakeviz). Só os
+PERFIL_MAX_ARQUIVOS perfis mais recentes são mantidos. Download: views.perfis (staff).
+
+Custo: cProfile e tracemalloc deixam a requisição perfilada várias vezes mais lenta e
+ambos valem para o processo inteiro; por isso só uma requisição é perfilada por vez (se
+já houver outra, a nova segue sem perfil). As demais pagam só um sorteio e um teste.
+"""
+
+import cProfile
+import io
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib import messages
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+
+PARAMETRO = '_perfil'
+CABECALHO = 'HTTP_X_PERFIL'  # "X-Perfil" no META do Django
+
+LINHAS_CPROFILE = 60
+LINHAS_TRACEMALLOC = 25
+
+NOME_VALIDO = re.compile(r'^[\w-]+\.(txt|prof)$')
+
+# Um perfil por vez no processo (ver o topo do arquivo)
+_trava = threading.Lock()
+
+
+def diretorio():
+    return Path(getattr(settings, 'PERFIL_DIR', Path(settings.BASE_DIR) / 'perfis'))
+
+
+class _ColetorSQL:
+    """execute_wrapper que guarda (sql, segundos) de cada consulta, sem os parâmetros."""
+
+    def __init__(self):
+        self.consultas = []
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.consultas.append((sql, time.perf_counter() - inicio))
+
+
+def _motivo(request):
+    """'pedido' (staff pediu), 'amostragem' ou None (não perfilar)."""
+    if request.GET.get(PARAMETRO) or request.META.get(CABECALHO):
+        # Só olha o usuário (e carrega a sessão) quando o perfil foi pedido
+        if request.user.is_staff:
+            return 'pedido'
+    taxa = getattr(settings, 'PERFIL_AMOSTRAGEM', 0)
+    if taxa and random.random() < taxa:
+        return 'amostragem'
+    return None
+
+
+class PerfilMiddleware:
+    """Perfila as requisições pedidas/sorteadas (ver o topo do arquivo)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        motivo = _motivo(request)
+        if motivo is None or not _trava.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            return self._perfilar(request, motivo)
+        finally:
+            _trava.release()
+
+    def _perfilar(self, request, motivo):
+        coletor = _ColetorSQL()
+        perfil = cProfile.Profile()
+        # Se outra ferramenta já usa o tracemalloc, não o desligamos no fim
+        ja_rastreava = tracemalloc.is_tracing()
+        if not ja_rastreava:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            antes = tracemalloc.take_snapshot()
+            inicio = time.perf_counter()
+            with connection.execute_wrapper(coletor):
+                perfil.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    perfil.disable()
+            segundos = time.perf_counter() - inicio
+            depois = tracemalloc.take_snapshot()
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            if not ja_rastreava:
+                tracemalloc.stop()
+
+        nome = gravar(request, motivo, response.status_code, segundos, perfil, _alocacoes(antes, depois), pico,
+                      coletor.consultas)
+        response['X-Perfil'] = reverse('baixar_perfil', args=[f'{nome}.txt'])
+        if motivo == 'pedido' and hasattr(request, '_messages'):
+            messages.info(request, f'Perfil da requisição gravado: {nome}.')
+        return response
+
+
+def _alocacoes(antes, depois):
+    """Maiores diferenças de memória por linha de código, sem contar o próprio tracemalloc."""
+    filtros = (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+    diferencas = depois.filter_traces(filtros).compare_to(antes.filter_traces(filtros), 'lineno')
+    return [d for d in diferencas if d.size_diff > 0][:LINHAS_TRACEMALLOC]
+
+
+def _relatorio(request, motivo, status, segundos, perfil, alocacoes, pico, consultas):
+    match = getattr(request, 'resolver_match', None)
+    usuario = getattr(request, 'user', None)
+    usuario = usuario if usuario and usuario.is_authenticated else 'anônimo'
+    linhas = [
+        f'Perfil de {request.method} {request.get_full_path()} (view {match.view_name if match else "-"})',
+        f'Data: {timezone.localtime():%d/%m/%Y %H:%M:%S}  Usuário: {usuario}  Motivo: {motivo}',
+        f'Status: {status}  Duração (com o cProfile ligado): {segundos * 1000:.1f} ms  '
+        f'SQL: {len(consultas)} consulta(s), {sum(s for _, s in consultas) * 1000:.1f} ms',
+        '',
+        f'== cProfile: tempo acumulado ({LINHAS_CPROFILE} primeiras) ==',
+    ]
+    saida = io.StringIO()
+    pstats.Stats(perfil, stream=saida).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(LINHAS_CPROFILE)
+    linhas.append(saida.getvalue().strip())
+
+    linhas += ['', f'== tracemalloc: maiores alocações ainda vivas no fim (pico {pico / 1024:.1f} KiB) ==']
+    linhas += [str(diferenca) for diferenca in alocacoes] or ['(nenhuma)']
+
+    linhas += ['', f'== SQL ({len(consultas)} consulta(s), na ordem de execução, sem os parâmetros) ==']
+    for i, (sql, tempo) in enumerate(consultas, start=1):
+        linhas.append(f'{i:3d}. [{tempo * 1000:.2f} ms] {sql}')
+    return '\n'.join(linhas) + '\n'
+
+
+def gravar(request, motivo, status, segundos, perfil, alocacoes, pico, consultas):
+    """Grava <nome>.txt e <nome>.prof, apaga os mais antigos e devolve o nome."""
+    pasta = diretorio()
+    pasta.mkdir(parents=True, exist_ok=True)
+    match = getattr(request, 'resolver_match', None)
+    rotulo = re.sub(r'[^\w-]', '_', match.view_name if match else 'sem_rota')[:60]
+    # O prefixo de data mantém a ordem alfabética = ordem cronológica
+    nome = f'{timezone.now():%Y%m%d-%H%M%S-%f}-{rotulo}-{uuid.uuid4().hex[:8]}'
+
+    texto = _relatorio(request, motivo, status, segundos, perfil, alocacoes, pico, consultas)
+    (pasta / f'{nome}.txt').write_text(texto, encoding='utf-8')
+    perfil.dump_stats(pasta / f'{nome}.prof')
+
+    maximo = getattr(settings, 'PERFIL_MAX_ARQUIVOS', 200)
+    for antigo in sorted(pasta.glob('*.txt'), reverse=True)[maximo:]:
+        antigo.unlink(missing_ok=True)
+        antigo.with_suffix('.prof').unlink(missing_ok=True)
+    return nome
+
+
+def listar():
+    """Perfis gravados, do mais recente para o mais antigo: [{nome, titulo, data, tamanho, tem_prof}]."""
+    pasta = diretorio()
+    if not pasta.is_dir():
+        return []
+    perfis = []
+    for arquivo in sorted(pasta.glob('*.txt'), reverse=True):
+        with open(arquivo, encoding='utf-8') as texto:
+            titulo = texto.readline().strip()
+        estado = arquivo.stat()
+        perfis.append({
+            'nome': arquivo.stem,
+            'titulo': titulo,
+            'data': datetime.fromtimestamp(estado.st_mtime, tz=timezone.get_current_timezone()),
+            'tamanho': estado.st_size,
+            'tem_prof': arquivo.with_suffix('.prof').exists(),
+        })
+    return perfis
+
+
+def arquivo(nome):
+    """Caminho do arquivo de perfil `nome` (com extensão), ou None se inválido/inexistente."""
+    if not NOME_VALIDO.match(nome):
+        return None
+    caminho = diretorio() / nome
+    return caminho if caminho.is_file() else None
@@ -0,0 +1,103 @@
+# avaliacoes/ranking.py
+"""
+Ranking das turmas (DisciplinaPessoa) por média bayesiana.
+
+Uma turma com uma única nota 10 não deve ficar acima de outra com 500 avaliações de
+média 9,8. Por isso o ranking não usa a média pura, e sim:
+
+    pontuacao = (PESO_PRIOR * media_prior + media * n) / (PESO_PRIOR + n)
+
+onde n é a quantidade de avaliações e media_prior é a média geral da universidade.
+Com poucas avaliações a pontuação fica perto da média geral; com muitas, perto da
+média real da turma.
+
+A pontuação fica gravada (com índice) em MediaDisciplina e MediaDisciplinaCategoria e é
+atualizada junto com as médias em avaliacoes/agregados.py, então o top-K é só um
+ORDER BY pontuacao DESC LIMIT K. Todas as pontuações usam a MESMA media_prior
+(MediaUniversidade.media_ranking). As escritas não a mudam: o comando recalcular_ranking,
+agendado (ex.: cron a cada 10 minutos), troca a media_prior pela média geral atual quando
+elas se afastam mais que TOLERANCIA_PRIOR e recalcula todas as pontuações de uma vez (um
+UPDATE por tabela), fora das requisições.
+
+A conta existe em três formas, para cada lugar que a usa: pontuacao() em Python,
+expr_pontuacao() como expressão do ORM e sql_pontuacao() em SQL puro (os upserts de
+agregados.py). RankingTests confere que as três dão o mesmo resultado.
+"""
+
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Value, When
+from django.db.models.functions import Cast
+from django.db.models.lookups import LessThanOrEqual
+
+from .models import MediaDisciplina, MediaDisciplinaCategoria
+
+# Peso da média geral, em "avaliações fictícias" somadas a cada turma
+PESO_PRIOR = getattr(settings, 'RANKING_PESO_PRIOR', 10)
+
+# Quanto a média geral pode andar antes de recalcular todas as pontuações
+TOLERANCIA_PRIOR = Decimal(str(getattr(settings, 'RANKING_TOLERANCIA_PRIOR', '0.05')))
+
+
+def pontuacao(soma, qtde_notas, qtde_avaliacoes, media_prior):
+    """Pontuação bayesiana calculada em Python (usada ao criar uma linha nova)."""
+    if qtde_notas <= 0:
+        return 0.0
+    media = float(soma) / qtde_notas
+    return (PESO_PRIOR * float(media_prior) + media * qtde_avaliacoes) / (PESO_PRIOR + qtde_avaliacoes)
+
+
+def expr_pontuacao(soma, qtde_notas, qtde_avaliacoes, media_prior):
+    """Mesma conta de pontuacao() em SQL; os argumentos são expressões (ex.: F('soma_notas') + delta)."""
+    return Case(
+        When(LessThanOrEqual(qtde_notas, 0), then=Value(0.0)),
+        default=ExpressionWrapper(
+            (Value(PESO_PRIOR * float(media_prior)) + Cast(soma, FloatField()) / qtde_notas * qtde_avaliacoes)
+            / (Value(float(PESO_PRIOR)) + qtde_avaliacoes),
+            output_field=FloatField(),
+        ),
+        output_field=FloatField(),
+    )
+
+
+def sql_pontuacao(soma, qtde_notas, qtde_avaliacoes, media_prior):
+    """Mesma conta de pontuacao() em SQL puro; os argumentos são trechos de SQL (colunas, subconsultas)."""
+    return (
+        f'CASE WHEN {qtde_notas} <= 0 THEN 0.0 '
+        f'ELSE ({float(PESO_PRIOR)} * {media_prior} '
+        f'+ CAST({soma} AS DOUBLE PRECISION) / {qtde_notas} * {qtde_avaliacoes}) '
+        f'/ ({float(PESO_PRIOR)} + {qtde_avaliacoes}) END'
+    )
+
+
+def recalcular_pontuacoes(media_prior):
+    """Recalcula a pontuação de todas as turmas com uma nova media_prior (O(turmas), sem ler notas)."""
+    MediaDisciplina.objects.update(pontuacao=expr_pontuacao(
+        F('soma_notas'), F('qtde_notas'), F('qtde_avaliacoes'), media_prior
+    ))
+    MediaDisciplinaCategoria.objects.update(pontuacao=expr_pontuacao(
+        F('soma_notas'), F('qtde_avaliacoes'), F('qtde_avaliacoes'), media_prior
+    ))
+
+
+def melhores_turmas(limite, materia_id=None):
+    """
+    Top-K geral (ou de uma Materia) lido direto do índice de pontuação.
+    Retorna MediaDisciplina com turma, professor e matéria já carregados.
+    """
+    ranking = MediaDisciplina.objects.select_related(
+        'disciplina_pessoa__pessoa__professor', 'disciplina_pessoa__disciplina'
+    )
+    if materia_id:
+        ranking = ranking.filter(disciplina_id=materia_id)
+    return list(ranking.order_by('-pontuacao', '-qtde_avaliacoes', 'pk')[:limite])
+
+
+def melhores_turmas_por_categoria(categoria_id, limite):
+    """Top-K de uma Categoria (ex.: melhores em Didática), também servido pelo índice."""
+    return list(
+        MediaDisciplinaCategoria.objects.filter(categoria_id=categoria_id).select_related(
+            'disciplina_pessoa__pessoa__professor', 'disciplina_pessoa__disciplina'
+        ).order_by('-pontuacao', '-qtde_avaliacoes', 'pk')[:limite]
+    )
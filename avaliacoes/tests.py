@@ -1,3 +1,1558 @@
-from django.test import TestCase
+import json
+import statistics
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from smtplib import SMTPException
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends import locmem
+from django import forms
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Avg, Count, Exists, F, OuterRef, Value
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import JsonResponse
+from django.template import engines
+from django.urls import get_resolver, path, reverse
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from . import autocompletar, benchmark, categorias, consultas_repetidas, matriculas, metricas, perfilamento, ranking
+from .agregados import (
+    assinatura_notas, calcular_turmas, estatisticas_histograma, gravar_professores_e_universidade,
+    histogramas_por_turma, regravar_turmas, resumo_universidade, somar_histogramas
+)
+from .forms import ProfessorSelect
+from .importacao import importar_usuarios
+from .models import (
+    Aluno, Avaliacao, AvaliacaoCategoria, Categoria, CustomUser, DisciplinaPessoa, EmailPendente, HistogramaNota, Materia,
+    MatriculaAluno, MediaDisciplina, MediaDisciplinaCategoria, MediaProfessor, MediaUniversidade, Professor
+)
+from .matriculas import remover_matriculas, sincronizar_matriculas
+
+
+CATEGORIAS = ('Didática', 'Dificuldade', 'Relacionamento', 'Pontualidade')
+
+
+def _criar_cenario(qtde_turmas=2, qtde_alunos=3):
+    """
+    As 4 categorias, um professor com `qtde_turmas` turmas e `qtde_alunos` alunos matriculados
+    em todas. Devolve (turmas, usuários dos alunos).
+    """
+    for nome in CATEGORIAS:
+        Categoria.objects.create(nome_categoria=nome)
+    # No TestCase o on_commit não roda: o registro de categorias é invalidado à mão
+    categorias.invalidar()
+    professor = CustomUser.objects.create_user(
+        username='prof', cpf='prof', first_name='Ana', last_name='Lima', user_type='professor'
+    )
+    Professor.objects.create(user=professor)
+    turmas = [
+        DisciplinaPessoa.objects.create(
+            pessoa=professor,
+            disciplina=Materia.objects.create(nome=f'Matéria {i}', codigo=f'M{i}', data_inicio=timezone.now().date()),
+        )
+        for i in range(qtde_turmas)
+    ]
+    usuarios = []
+    for i in range(qtde_alunos):
+        usuario = CustomUser.objects.create_user(username=f'aluno{i}', cpf=f'aluno{i}', user_type='aluno')
+        aluno = Aluno.objects.create(user=usuario)
+        MatriculaAluno.objects.bulk_create(MatriculaAluno(aluno=aluno, disciplina_professor=turma) for turma in turmas)
+        usuarios.append(usuario)
+    return turmas, usuarios
+
+
+def _notas(nota):
+    """Corpo da API de avaliação com a mesma `nota` em todas as categorias."""
+    return {categoria.slug: nota for categoria in categorias.registro()}
+
+
+class AgregadosTests(TestCase):
+    """
+    As médias incrementais (avaliacoes/agregados.py) acompanham criação e remoção de
+    avaliações, e o rebuild_aggregates --verify (que recalcula das notas) confirma.
+    """
+
+    def setUp(self):
+        self.turmas, self.alunos = _criar_cenario()
+        self.admin = CustomUser.objects.create_user(
+            username='admin', cpf='admin', user_type='admin', is_staff=True
+        )
+
+    def _avaliar(self, usuario, turma, nota):
+        self.client.force_login(usuario)
+        resposta = self.client.post(
+            reverse('salvar_avaliacao_api'),
+            json.dumps({'disciplina_pessoa_id': turma.pk, **_notas(nota)}),
+            content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+
+    def _remover_matricula(self, usuario, turma):
+        self.client.force_login(self.admin)
+        matricula = MatriculaAluno.objects.get(aluno__user=usuario, disciplina_professor=turma)
+        resposta = self.client.delete(reverse('excluir_matricula_aluno', args=[matricula.pk]))
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+
+    def _verificar(self):
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+    def test_medias_acompanham_criacao_e_remocao(self):
+        turma, outra = self.turmas
+        self._avaliar(self.alunos[0], turma, 8)
+        self._avaliar(self.alunos[1], turma, 6)
+        self._avaliar(self.alunos[2], outra, 9)
+        self._verificar()
+
+        media = MediaDisciplina.objects.get(disciplina_pessoa=turma)
+        self.assertEqual((media.qtde_avaliacoes, media.qtde_notas, media.media), (2, 8, Decimal('7.00')))
+        universidade = MediaUniversidade.objects.get()
+        self.assertEqual(
+            (universidade.qtde_avaliacoes, universidade.qtde_disciplinas, universidade.qtde_professores),
+            (3, 2, 1),
+        )
+        self.assertEqual(universidade.media, Decimal('7.67'))
+
+        # Remover a matrícula apaga a avaliação e a desconta das médias
+        self._remover_matricula(self.alunos[1], turma)
+        self._verificar()
+        self.assertEqual(MediaDisciplina.objects.get(disciplina_pessoa=turma).media, Decimal('8.00'))
+
+        # A última avaliação da turma some: a turma deixa de contar para o professor
+        self._remover_matricula(self.alunos[0], turma)
+        self._verificar()
+        self.assertFalse(MediaDisciplina.objects.filter(disciplina_pessoa=turma).exists())
+        self.assertEqual(MediaProfessor.objects.get().qtde_disciplinas, 1)
+        self.assertEqual(MediaUniversidade.objects.get().media, Decimal('9.00'))
+
+    def test_verify_acusa_divergencia_e_rebuild_corrige(self):
+        self._avaliar(self.alunos[0], self.turmas[0], 8)
+        MediaDisciplina.objects.update(soma_notas=F('soma_notas') + 1)
+
+        saida = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_aggregates', '--verify', stdout=saida)
+        self.assertIn(f'MediaDisciplina turma={self.turmas[0].pk}', saida.getvalue())
+
+        call_command('rebuild_aggregates', stdout=StringIO())
+        self._verificar()
+
+    def test_rebuild_recalcula_lote_que_mudou_depois_do_calculo(self):
+        turma = self.turmas[0]
+        ids = [t.pk for t in self.turmas]
+        categoria_ids = list(Categoria.objects.values_list('pk', flat=True))
+        self._avaliar(self.alunos[0], turma, 8)
+
+        # Como um worker do --workers: calcula fora da transação de escrita...
+        assinatura, turmas = assinatura_notas(ids), calcular_turmas(ids, categoria_ids)
+        # ... e uma avaliação é salva antes de o lote ser gravado
+        self._avaliar(self.alunos[1], turma, 6)
+        self.assertTrue(regravar_turmas(ids, categoria_ids, assinatura, turmas))
+        self.assertEqual(MediaDisciplina.objects.get(disciplina_pessoa=turma).qtde_avaliacoes, 2)
+        # Como no fim do comando: professores, universidade e pontuações a partir das turmas
+        gravar_professores_e_universidade()
+        self._verificar()
+
+        # Sem escrita no meio, o cálculo do worker é aproveitado
+        assinatura, turmas = assinatura_notas(ids), calcular_turmas(ids, categoria_ids)
+        self.assertFalse(regravar_turmas(ids, categoria_ids, assinatura, turmas))
+        gravar_professores_e_universidade()
+        self._verificar()
+
+
+class SalvarAvaliacaoTests(TestCase):
+    """Corpo de salvar_avaliacao_api: categorias ausentes são opcionais; notas inválidas são nomeadas."""
+
+    def setUp(self):
+        [self.turma], [self.aluno] = _criar_cenario(qtde_turmas=1, qtde_alunos=1)
+        self.client.force_login(self.aluno)
+
+    def _enviar(self, corpo):
+        return self.client.post(
+            reverse('salvar_avaliacao_api'),
+            json.dumps({'disciplina_pessoa_id': self.turma.pk, **corpo}),
+            content_type='application/json',
+        )
+
+    def test_cliente_antigo_sem_a_categoria_nova(self):
+        corpo = _notas(8)
+        Categoria.objects.create(nome_categoria='Conteúdo')
+        categorias.invalidar()
+
+        resposta = self._enviar(corpo)
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        self.assertEqual(AvaliacaoCategoria.objects.count(), len(CATEGORIAS))
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+    def test_nota_invalida_nomeia_a_categoria(self):
+        for valor in ('oito', 'nan', True, [8]):
+            with self.subTest(valor=valor):
+                resposta = self._enviar({**_notas(8), 'didatica': valor})
+                self.assertEqual(resposta.status_code, 400)
+                self.assertEqual(resposta.json()['error'], 'Nota inválida para "Didática".')
+
+        resposta = self._enviar({})
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('pelo menos uma categoria', resposta.json()['error'])
+        self.assertFalse(AvaliacaoCategoria.objects.exists())
+
+
+class AvaliacoesLoteTests(TestCase):
+    """salvar_avaliacoes_lote_api: cada item tem o seu status e os válidos são gravados."""
+
+    def setUp(self):
+        self.turmas, [self.usuario] = _criar_cenario(qtde_turmas=4, qtde_alunos=1)
+        self.fora = DisciplinaPessoa.objects.create(
+            pessoa=self.turmas[0].pessoa,
+            disciplina=Materia.objects.create(nome='Outra', codigo='OUT', data_inicio=timezone.now().date()),
+        )
+        self.client.force_login(self.usuario)
+
+    def _enviar(self, itens):
+        resposta = self.client.post(
+            reverse('salvar_avaliacoes_lote_api'), json.dumps({'avaliacoes': itens}), content_type='application/json'
+        )
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        return [(r['status'], r.get('erro')) for r in resposta.json()['resultados']]
+
+    def test_status_por_item(self):
+        t0, t1, t2, t3 = self.turmas
+        self._enviar([{'disciplina_pessoa_id': t0.pk, **_notas(7)}])
+
+        resultados = self._enviar([
+            {'disciplina_pessoa_id': t0.pk, **_notas(8)},
+            {'disciplina_pessoa_id': t1.pk, **_notas(8), 'comentario': ' Boa. '},
+            {'disciplina_pessoa_id': self.fora.pk, **_notas(8)},
+            {'disciplina_pessoa_id': t2.pk, **_notas(8), 'comentario': 123},
+            {'disciplina_pessoa_id': t3.pk, **_notas(8), 'didatica': 'dez'},
+            {'disciplina_pessoa_id': True, **_notas(8)},
+            'não é um objeto',
+            {'disciplina_pessoa_id': t1.pk, **_notas(5)},
+        ])
+        self.assertEqual([status for status, _ in resultados], [
+            'duplicada', 'criada', 'nao_matriculado', 'invalida', 'invalida', 'invalida', 'invalida', 'duplicada',
+        ])
+        self.assertEqual(resultados[3][1], 'O comentário deve ser um texto.')
+        self.assertEqual(resultados[4][1], 'Nota inválida para "Didática".')
+        self.assertEqual(
+            sorted(self.usuario.aluno.avaliacoes_feitas.values_list('disciplina_pessoa_id', 'comentario')),
+            [(t0.pk, None), (t1.pk, 'Boa.')],
+        )
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+    def test_conflito_no_insert_marca_so_o_item(self):
+        t0, t1 = self.turmas[:2]
+        filtrar = Avaliacao.objects.filter
+
+        def outra_requisicao_depois_da_checagem(*args, **kwargs):
+            # Outra requisição do mesmo aluno grava t0 entre a checagem de duplicadas e o INSERT
+            Avaliacao.objects.create(disciplina_pessoa=t0, aluno=self.usuario.aluno)
+            return filtrar(*args, **kwargs).exclude(disciplina_pessoa=t0)
+
+        with mock.patch.object(Avaliacao.objects, 'filter', side_effect=outra_requisicao_depois_da_checagem):
+            resultados = self._enviar([
+                {'disciplina_pessoa_id': t0.pk, **_notas(8)},
+                {'disciplina_pessoa_id': t1.pk, **_notas(6)},
+            ])
+        self.assertEqual([status for status, _ in resultados], ['duplicada', 'criada'])
+        self.assertEqual(MediaDisciplina.objects.get().disciplina_pessoa_id, t1.pk)
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+
+class IdempotenciaTests(TestCase):
+    """Reenvio com o mesmo Idempotency-Key devolve a resposta guardada sem gravar de novo."""
+
+    def setUp(self):
+        [self.turma], [self.aluno] = _criar_cenario(qtde_turmas=1, qtde_alunos=1)
+        self.client.force_login(self.aluno)
+
+    def _enviar(self, nota, chave='envio-1'):
+        return self.client.post(
+            reverse('salvar_avaliacao_api'),
+            json.dumps({'disciplina_pessoa_id': self.turma.pk, **_notas(nota)}),
+            content_type='application/json',
+            headers={'Idempotency-Key': chave},
+        )
+
+    def test_reenvio_devolve_a_mesma_resposta(self):
+        original = self._enviar(8)
+        self.assertEqual(original.status_code, 200, original.content)
+
+        reenvio = self._enviar(8)
+        self.assertEqual((reenvio.status_code, reenvio.content), (original.status_code, original.content))
+        self.assertEqual(reenvio['Idempotent-Replayed'], 'true')
+        self.assertEqual(Avaliacao.objects.count(), 1)
+
+        # Com outra chave, o mesmo corpo passa pela validação e é recusado (já avaliou)
+        self.assertEqual(self._enviar(8, chave='envio-2').status_code, 403)
+
+    def test_mesma_chave_com_outro_corpo(self):
+        self._enviar(8)
+        self.assertEqual(self._enviar(6).status_code, 422)
+
+    def test_reenvio_do_comentario_nao_duplica(self):
+        def enviar():
+            return self.client.post(
+                reverse('salvar_comentario_api'),
+                json.dumps({'disciplina_pessoa_id': self.turma.pk, 'texto': 'Ótimas aulas.'}),
+                content_type='application/json',
+                headers={'Idempotency-Key': 'comentario-1'},
+            )
+
+        original = enviar()
+        self.assertEqual(original.status_code, 200, original.content)
+        reenvio = enviar()
+        self.assertEqual((reenvio.status_code, reenvio.content), (original.status_code, original.content))
+        self.assertEqual(reenvio['Idempotent-Replayed'], 'true')
+        self.assertEqual(Avaliacao.objects.filter(comentario='Ótimas aulas.').count(), 1)
+
+
+class HistogramaTests(TestCase):
+    """HistogramaNota acompanha as escritas e dá as mesmas estatísticas das notas expandidas."""
+
+    def test_estatisticas_iguais_as_das_notas(self):
+        histograma = {Decimal('2.5'): 1, Decimal('7'): 3, Decimal('8.5'): 2, Decimal('10'): 1, Decimal('4'): 0}
+        notas = [float(nota) for nota, qtde in histograma.items() for _ in range(qtde)]
+
+        resultado = estatisticas_histograma(histograma)
+        q1, mediana, q3 = statistics.quantiles(notas, n=4, method='inclusive')
+        self.assertEqual(resultado['qtde'], len(notas))
+        self.assertEqual((resultado['min'], resultado['max']), (min(notas), max(notas)))
+        self.assertAlmostEqual(resultado['q1'], q1)
+        self.assertAlmostEqual(resultado['mediana'], mediana)
+        self.assertAlmostEqual(resultado['q3'], q3)
+        self.assertAlmostEqual(resultado['media'], statistics.fmean(notas))
+        self.assertAlmostEqual(resultado['desvio_padrao'], statistics.pstdev(notas))
+
+        self.assertIsNone(estatisticas_histograma({}))
+        self.assertEqual(somar_histogramas([{1: 2, 3: 1}, {1: 1, 4: 5}]), {1: 3, 3: 1, 4: 5})
+
+    def test_faixas_acompanham_criacao_e_remocao(self):
+        [turma], usuarios = _criar_cenario(qtde_turmas=1, qtde_alunos=3)
+        didatica = categorias.registro().id_de('didatica')
+        for usuario, nota in zip(usuarios, (8, 8, 6.5)):
+            self.client.force_login(usuario)
+            self.client.post(
+                reverse('salvar_avaliacao_api'),
+                json.dumps({'disciplina_pessoa_id': turma.pk, **_notas(nota)}),
+                content_type='application/json',
+            )
+
+        def faixas():
+            return histogramas_por_turma([turma.pk])[turma.pk][didatica]
+
+        self.assertEqual(faixas(), {Decimal('8.00'): 2, Decimal('6.50'): 1})
+
+        # A faixa que zera é apagada
+        remover_matriculas(MatriculaAluno.objects.filter(aluno__user=usuarios[2]))
+        self.assertEqual(faixas(), {Decimal('8.00'): 2})
+        self.assertFalse(HistogramaNota.objects.filter(qtde__lte=0).exists())
+
+
+class DetalhesProfessorTests(TestCase):
+    """Box plot da página do professor: estatísticas por turma/categoria, sem as notas."""
+
+    def setUp(self):
+        self.turmas, self.usuarios = _criar_cenario(qtde_turmas=3, qtde_alunos=3)
+        turma, outra, _ = self.turmas
+        for usuario, alvo, nota in ((self.usuarios[0], turma, 8), (self.usuarios[1], turma, 6), (self.usuarios[2], outra, 9)):
+            self.client.force_login(usuario)
+            self.client.post(
+                reverse('salvar_avaliacao_api'),
+                json.dumps({'disciplina_pessoa_id': alvo.pk, **_notas(nota)}),
+                content_type='application/json',
+            )
+        self.client.force_login(self.usuarios[0])
+        self.professor = Professor.objects.get()
+
+    def test_grafico_traz_estatisticas_por_turma_e_geral(self):
+        resposta = self.client.get(reverse('detalhes_professor', args=[self.professor.pk]))
+        dados = json.loads(resposta.context['dados_grafico_json'])
+        turma, outra, sem_avaliacao = self.turmas
+
+        didatica = dados[str(turma.pk)]['didatica']
+        self.assertEqual(
+            {chave: didatica[chave] for chave in ('qtde', 'min', 'mediana', 'max', 'media')},
+            {'qtde': 2, 'min': 6.0, 'mediana': 7.0, 'max': 8.0, 'media': 7.0},
+        )
+        self.assertEqual(dados[str(outra.pk)]['pontualidade']['qtde'], 1)
+        self.assertIsNone(dados[str(sem_avaliacao.pk)]['didatica'])
+        self.assertEqual(dados['all']['relacionamento']['qtde'], 3)
+        self.assertAlmostEqual(dados['all']['relacionamento']['media'], 23 / 3)
+
+        # Só números de tamanho fixo: nenhuma lista de notas cresce com as avaliações
+        for por_categoria in dados.values():
+            for estatisticas in por_categoria.values():
+                self.assertTrue(estatisticas is None or all(
+                    isinstance(valor, (int, float)) for valor in estatisticas.values()
+                ))
+        self.assertEqual(json.loads(resposta.context['disciplinas_avaliadas_json']), [turma.pk])
+
+
+class RankingTests(TestCase):
+    """Pontuação bayesiana gravada (avaliacoes/ranking.py) e o top-K lido pelo índice."""
+
+    def setUp(self):
+        # A: uma nota 10; B: oito notas 9; C: oito notas 4 (puxa a média geral para baixo)
+        (self.a, self.b, self.c), usuarios = _criar_cenario(qtde_turmas=3, qtde_alunos=8)
+        envios = [(usuarios[0], self.a, 10)]
+        envios += [(usuario, self.b, 9) for usuario in usuarios]
+        envios += [(usuario, self.c, 4) for usuario in usuarios]
+        for usuario, turma, nota in envios:
+            self.client.force_login(usuario)
+            self.client.post(
+                reverse('salvar_avaliacao_api'),
+                json.dumps({'disciplina_pessoa_id': turma.pk, **_notas(nota)}),
+                content_type='application/json',
+            )
+        # As escritas usam a média do ranking da primeira avaliação (a nota 10 de A);
+        # o comando agendado a troca pela média geral atual
+        call_command('recalcular_ranking', stdout=StringIO())
+
+    def test_pontuacao_gravada_segue_a_formula(self):
+        media_prior = MediaUniversidade.objects.get().media_ranking
+        for media in MediaDisciplina.objects.all():
+            self.assertAlmostEqual(
+                media.pontuacao,
+                ranking.pontuacao(media.soma_notas, media.qtde_notas, media.qtde_avaliacoes, media_prior),
+            )
+        for media in MediaDisciplinaCategoria.objects.all():
+            self.assertAlmostEqual(
+                media.pontuacao,
+                ranking.pontuacao(media.soma_notas, media.qtde_avaliacoes, media.qtde_avaliacoes, media_prior),
+            )
+
+    def test_as_tres_formas_da_formula_concordam(self):
+        media_prior = Decimal('6.25')
+        casos = [(0, 0, 0), (10, 1, 1), (36, 4, 1), (288, 32, 8), (4000, 400, 100)]
+        for soma, qtde_notas, qtde_avaliacoes in casos:
+            esperado = ranking.pontuacao(soma, qtde_notas, qtde_avaliacoes, media_prior)
+            pelo_orm = MediaUniversidade.objects.annotate(
+                valor=ranking.expr_pontuacao(Value(soma), Value(qtde_notas), Value(qtde_avaliacoes), media_prior)
+            ).values_list('valor', flat=True).get()
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT {ranking.sql_pontuacao(soma, qtde_notas, qtde_avaliacoes, media_prior)}')
+                pelo_sql = cursor.fetchone()[0]
+            self.assertAlmostEqual(pelo_orm, esperado, msg=(soma, qtde_notas, qtde_avaliacoes))
+            self.assertAlmostEqual(pelo_sql, esperado, msg=(soma, qtde_notas, qtde_avaliacoes))
+
+    def test_comando_so_recalcula_fora_da_tolerancia(self):
+        saida = StringIO()
+        call_command('recalcular_ranking', stdout=saida)
+        self.assertIn('nada a recalcular', saida.getvalue())
+
+        # Uma avaliação que move a média geral além da tolerância não recalcula nada sozinha
+        media_prior = MediaUniversidade.objects.get().media_ranking
+        self.client.force_login(CustomUser.objects.get(username='aluno1'))
+        resposta = self.client.post(
+            reverse('salvar_avaliacao_api'),
+            json.dumps({'disciplina_pessoa_id': self.a.pk, **_notas(10)}),
+            content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        universidade = MediaUniversidade.objects.get()
+        self.assertEqual(universidade.media_ranking, media_prior)
+        self.assertGreater(universidade.media - media_prior, ranking.TOLERANCIA_PRIOR)
+
+        call_command('recalcular_ranking', stdout=StringIO())
+        self.assertEqual(MediaUniversidade.objects.get().media_ranking, universidade.media)
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+    def test_muitas_avaliacoes_boas_passam_uma_nota_maxima(self):
+        ordem = [media.disciplina_pessoa_id for media in ranking.melhores_turmas(3)]
+        self.assertEqual(ordem, [self.b.pk, self.a.pk, self.c.pk])
+
+        didatica = categorias.registro().id_de('didatica')
+        ordem = [media.disciplina_pessoa_id for media in ranking.melhores_turmas_por_categoria(didatica, 2)]
+        self.assertEqual(ordem, [self.b.pk, self.a.pk])
+
+        self.assertEqual(
+            [media.disciplina_pessoa_id for media in ranking.melhores_turmas(3, materia_id=self.c.disciplina_id)],
+            [self.c.pk],
+        )
+
+
+class HomeTests(TestCase):
+    """
+    A home lê só a MediaUniversidade: os números precisam bater com o Avg/Count sobre as
+    notas que a view fazia antes, também num banco que já tinha avaliações antes da 0008.
+    """
+
+    def _conferir_com_avg_count(self):
+        notas = AvaliacaoCategoria.objects.filter(avaliacao__disciplina_pessoa__isnull=False)
+        media = notas.aggregate(media=Avg('nota'))['media'].quantize(Decimal('0.01'))
+        self.assertEqual(resumo_universidade()['media'], media)
+
+        resposta = self.client.get(reverse('home'))
+        self.assertEqual(resposta.context['media_geral_faculdade'], round(float(media), 1))
+        # Avaliações "só comentário" não têm notas e nunca entraram na média
+        self.assertEqual(resposta.context['total_avaliacoes'], notas.values('avaliacao_id').distinct().count())
+        self.assertEqual(
+            resposta.context['total_professores'],
+            notas.values('avaliacao__disciplina_pessoa__pessoa_id').distinct().count(),
+        )
+        self.assertEqual(
+            resposta.context['total_disciplinas'], notas.values('avaliacao__disciplina_pessoa_id').distinct().count()
+        )
+
+    def test_numeros_batem_com_avg_count_depois_da_migracao(self):
+        call_command('seed_data', stdout=StringIO(), professors=3, disciplines=4, ratings=40)
+        # Como um banco anterior à 0008: notas gravadas e tabelas de médias vazias
+        for modelo in (MediaDisciplinaCategoria, MediaDisciplina, MediaProfessor, MediaUniversidade):
+            modelo.objects.all().delete()
+        import_module('avaliacoes.migrations.0008_medias_incrementais').preencher_medias(apps, None)
+        categorias.invalidar()
+
+        usuario = CustomUser.objects.create_user(username='novo', cpf='novo', user_type='aluno')
+        self.client.force_login(usuario)
+        self._conferir_com_avg_count()
+
+        # A primeira avaliação depois da migração soma sobre os totais preenchidos
+        turma = DisciplinaPessoa.objects.filter(avaliacoes__isnull=False).first()
+        MatriculaAluno.objects.create(aluno=Aluno.objects.create(user=usuario), disciplina_professor=turma)
+        resposta = self.client.post(
+            reverse('salvar_avaliacao_api'),
+            json.dumps({'disciplina_pessoa_id': turma.pk, **_notas(8)}),
+            content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        self._conferir_com_avg_count()
+
+
+class CategoriasTests(TestCase):
+    def test_registro_recarrega_depois_do_ttl(self):
+        Categoria.objects.create(nome_categoria='Didática')
+        categorias.invalidar()
+        self.assertEqual([c.slug for c in categorias.registro()], ['didatica'])
+
+        # Como outro processo, que não recebe a invalidação de um cache local
+        Categoria.objects.create(nome_categoria='Carga Horária')
+        self.assertEqual(len(categorias.registro()), 1)
+        with mock.patch.object(categorias, 'TTL', 0):
+            self.assertEqual([c.slug for c in categorias.registro()], ['didatica', 'carga_horaria'])
+
+
+class ListaProfessoresTests(TestCase):
+    """Diretório de professores paginado por chave, com número fixo de consultas por página."""
+
+    def setUp(self):
+        # Nomes repetidos: o desempate da ordem (nome, id) tem de valer entre páginas
+        for i, nome in enumerate(('Ana', 'Bruno', 'Ana', 'Carla', 'Bruno', 'Davi', 'Ana')):
+            usuario = CustomUser.objects.create_user(
+                username=f'prof{i}', cpf=f'prof{i}', first_name=nome, user_type='professor'
+            )
+            Professor.objects.create(user=usuario)
+            for j in range(i % 3):
+                DisciplinaPessoa.objects.create(
+                    pessoa=usuario,
+                    disciplina=Materia.objects.create(
+                        nome=f'Matéria {i}.{j}', codigo=f'M{i}.{j}', data_inicio=timezone.now().date()
+                    ),
+                )
+        self.esperado = list(
+            Professor.objects.order_by('user__first_name', 'id').values_list('user__username', flat=True)
+        )
+        admin = CustomUser.objects.create_user(username='admin', cpf='admin', user_type='admin')
+        self.client.force_login(admin)
+        tamanho = mock.patch('avaliacoes.views.TAMANHO_PAGINA_PROFESSORES', 3)
+        tamanho.start()
+        self.addCleanup(tamanho.stop)
+
+    def _pagina(self, cursor=None):
+        resposta = self.client.get(reverse('lista_professores'), {'cursor': cursor} if cursor else {})
+        nomes = [professor.user.username for professor in resposta.context['professores']]
+        return nomes, resposta.context['cursor_anterior'], resposta.context['cursor_proximo']
+
+    def test_paginas_cobrem_todos_sem_repetir_e_voltam(self):
+        paginas, cursores, cursor = [], [], None
+        while True:
+            nomes, anterior, cursor = self._pagina(cursor)
+            paginas.append(nomes)
+            cursores.append(anterior)
+            if cursor is None:
+                break
+        self.assertEqual([nome for pagina in paginas for nome in pagina], self.esperado)
+        self.assertEqual([len(pagina) for pagina in paginas], [3, 3, 1])
+        self.assertIsNone(cursores[0])
+
+        # Voltando da última página chega-se à penúltima, com cursor para seguir em frente
+        nomes, anterior, proximo = self._pagina(cursores[-1])
+        self.assertEqual(nomes, paginas[-2])
+        self.assertIsNotNone(anterior)
+        self.assertEqual(self._pagina(proximo)[0], paginas[-1])
+
+        # Cursor adulterado volta para a primeira página
+        self.assertEqual(self._pagina('lixo')[0], paginas[0])
+
+    def test_consultas_nao_crescem_com_os_professores(self):
+        _, _, cursor = self._pagina()
+        with CaptureQueriesContext(connection) as primeira:
+            self.client.get(reverse('lista_professores'))
+        with CaptureQueriesContext(connection) as segunda:
+            self.client.get(reverse('lista_professores'), {'cursor': cursor})
+        self.assertEqual(len(primeira), len(segunda))
+
+
+class BuscaTests(TestCase):
+    """Busca por nome de professor e de matéria pelo índice FTS (avaliacoes/busca.py)."""
+
+    def setUp(self):
+        self.turmas, _ = _criar_cenario(qtde_turmas=1, qtde_alunos=0)
+        Materia.objects.filter(pk=self.turmas[0].disciplina_id).update(
+            nome='Programação Web', nome_normalized='programacao web'
+        )
+        admin = CustomUser.objects.create_user(username='admin', cpf='admin', user_type='admin')
+        self.client.force_login(admin)
+
+    def _professores(self, termo):
+        resposta = self.client.get(reverse('lista_professores'), {'q_professor': termo})
+        return [professor.user.username for professor in resposta.context['professores']]
+
+    def test_professor_por_prefixo_sem_acento(self):
+        CustomUser.objects.filter(username='prof').update(first_name='João', last_name='Lima')
+        self.assertEqual(self._professores('joao li'), ['prof'])
+        self.assertEqual(self._professores('Lim'), ['prof'])
+        self.assertEqual(self._professores('ima'), [])
+
+    def test_comparacao_cai_para_trecho_do_nome(self):
+        for termo in ('prog', 'gramacao'):
+            resposta = self.client.get(reverse('comparacao_disciplina'), {'q_disciplina': termo})
+            self.assertEqual(resposta.context['materia_encontrada'].pk, self.turmas[0].disciplina_id)
+
+
+class AutocompletarTests(TestCase):
+    """Índice em memória das sugestões (avaliacoes/autocompletar.py)."""
+
+    def setUp(self):
+        for username, nome, sobrenome, qtde_avaliacoes in (
+            ('joao', 'João', 'Silva', 2),
+            ('joana', 'Joana', 'Souza', 10),
+            ('carlos', 'Carlos', 'João', 0),
+        ):
+            usuario = CustomUser.objects.create_user(
+                username=username, cpf=username, first_name=nome, last_name=sobrenome, user_type='professor'
+            )
+            Professor.objects.create(user=usuario)
+            MediaProfessor.objects.create(pessoa=usuario, qtde_avaliacoes=qtde_avaliacoes)
+        autocompletar.invalidar()
+        aluno = CustomUser.objects.create_user(username='aluno', cpf='aluno', user_type='aluno')
+        self.client.force_login(aluno)
+
+    def _sugestoes(self, termo):
+        resposta = self.client.get(reverse('sugestoes_professores_api'), {'term': termo})
+        return resposta.json()['sugestoes']
+
+    def test_mais_avaliados_primeiro_por_prefixo_de_qualquer_palavra(self):
+        self.assertEqual(self._sugestoes('jo'), ['Joana Souza', 'João Silva', 'Carlos João'])
+        self.assertEqual(self._sugestoes('JOAO'), ['João Silva', 'Carlos João'])
+        self.assertEqual(self._sugestoes('sil'), ['João Silva'])
+        self.assertEqual(self._sugestoes('ilva'), [])
+        self.assertEqual(autocompletar.sugerir_professores('jo', limite=1), ['Joana Souza'])
+
+    def test_busca_com_indice_montado_nao_consulta_o_banco(self):
+        autocompletar.sugerir_professores('jo')
+        with self.assertNumQueries(0):
+            autocompletar.sugerir_professores('car')
+            autocompletar.sugerir_disciplinas('mat')
+
+    def test_nome_novo_aparece_depois_da_invalidacao(self):
+        self.assertEqual(self._sugestoes('jon'), [])
+        # Os receivers invalidam no commit da transação
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario = CustomUser.objects.create_user(
+                username='jonas', cpf='jonas', first_name='Jonas', last_name='Lima', user_type='professor'
+            )
+            Professor.objects.create(user=usuario)
+        self.assertEqual(self._sugestoes('jon'), ['Jonas Lima'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            usuario.last_name = 'Prado'
+            usuario.save(update_fields=['last_name'])
+        self.assertEqual(self._sugestoes('pra'), ['Jonas Prado'])
+
+
+class EscritaConcorrenteTests(TransactionTestCase):
+    """
+    Teste de carga do caminho de escrita (avaliacoes/escrita.py): várias threads enviam
+    avaliações ao mesmo tempo, num ritmo alvo, contra o banco SQLite em arquivo.
+    Nenhuma requisição pode falhar por "database is locked" nem ficar presa esperando o
+    lock: o ritmo alcançado tem de chegar perto do alvo (os envios são espaçados, então
+    só a espera por lock o derruba).
+    """
+
+    THREADS = 8
+    AVALIACOES_POR_SEGUNDO = 20
+    DURACAO = 3  # segundos
+    RITMO_MINIMO = 0.8  # fração do alvo
+
+    def setUp(self):
+        if connection.is_in_memory_db():
+            self.skipTest(
+                'Precisa do banco de teste em arquivo para ter o lock real: '
+                'rode com --settings=avaliacao_professores.settings_concorrencia.'
+            )
+        for nome in ('Didática', 'Dificuldade', 'Relacionamento', 'Pontualidade'):
+            Categoria.objects.create(nome_categoria=nome)
+        professor = CustomUser.objects.create_user(
+            username='prof', cpf='prof', first_name='Ana', last_name='Lima', user_type='professor'
+        )
+        Professor.objects.create(user=professor)
+
+        total = self.AVALIACOES_POR_SEGUNDO * self.DURACAO
+        self.turmas = [
+            DisciplinaPessoa.objects.create(
+                pessoa=professor,
+                disciplina=Materia.objects.create(nome=f'Matéria {i}', codigo=f'M{i}', data_inicio=timezone.now().date()),
+            )
+            for i in range(total // self.THREADS + 1)
+        ]
+        # Um aluno por thread, matriculado em todas as turmas: cada envio é uma avaliação nova
+        self.alunos = []
+        for i in range(self.THREADS):
+            usuario = CustomUser.objects.create_user(username=f'aluno{i}', cpf=f'aluno{i}', user_type='aluno')
+            aluno = Aluno.objects.create(user=usuario)
+            MatriculaAluno.objects.bulk_create(
+                MatriculaAluno(aluno=aluno, disciplina_professor=turma) for turma in self.turmas
+            )
+            self.alunos.append(usuario)
+
+    def _enviar(self, usuario, turmas, intervalo, respostas):
+        client = Client()
+        client.force_login(usuario)
+        proximo = time.monotonic()
+        try:
+            for turma in turmas:
+                # Ritmo constante: cada thread envia a cada `intervalo` segundos
+                time.sleep(max(0, proximo - time.monotonic()))
+                proximo += intervalo
+                resposta = client.post(
+                    '/api/salvar-avaliacao/',
+                    json.dumps({
+                        'disciplina_pessoa_id': turma.pk,
+                        'didatica': 8, 'dificuldade': 6.5, 'relacionamento': 9, 'pontualidade': 7,
+                    }),
+                    content_type='application/json',
+                )
+                respostas.append((resposta.status_code, resposta.content))
+        finally:
+            connections.close_all()
+
+    def test_envios_concorrentes_sem_lock(self):
+        por_thread = self.AVALIACOES_POR_SEGUNDO * self.DURACAO // self.THREADS
+        intervalo = self.THREADS / self.AVALIACOES_POR_SEGUNDO
+        respostas = []
+        threads = [
+            threading.Thread(target=self._enviar, args=(usuario, self.turmas[:por_thread], intervalo, respostas))
+            for usuario in self.alunos
+        ]
+
+        inicio = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.monotonic() - inicio
+
+        falhas = [(status, conteudo) for status, conteudo in respostas if status != 200]
+        self.assertEqual(len(respostas), por_thread * self.THREADS)
+        self.assertEqual(falhas, [], f'{len(falhas)} envio(s) falharam')
+        self.assertGreaterEqual(
+            len(respostas) / duracao, self.RITMO_MINIMO * self.AVALIACOES_POR_SEGUNDO,
+            f'{len(respostas)} avaliações em {duracao:.2f}s (alvo {self.AVALIACOES_POR_SEGUNDO}/s)',
+        )
+
+        # As médias incrementais continuam exatas mesmo com escritas concorrentes
+        connection.close()
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+
+class BackendInstavel(locmem.EmailBackend):
+    """locmem que conta as conexões abertas e recusa os destinatários de `recusar`."""
+    aberturas = 0
+    recusar = set()
+
+    def open(self):
+        BackendInstavel.aberturas += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.recusar & set(message.to):
+                raise SMTPException('550 destinatário recusado')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='avaliacoes.tests.BackendInstavel')
+class CaixaSaidaTests(TestCase):
+    """O cadastro só enfileira; o comando send_outbox envia por uma conexão e reagenda falhas."""
+
+    def setUp(self):
+        BackendInstavel.aberturas = 0
+        BackendInstavel.recusar = set()
+        admin = CustomUser.objects.create_user(
+            username='admin', cpf='admin', user_type='admin', is_staff=True
+        )
+        self.client.force_login(admin)
+
+    def _cadastrar(self, email, cpf):
+        return self.client.post(reverse('adicionar_usuario'), {
+            'tipo_usuario': 'aluno', 'nome': 'Maria Souza', 'email': email,
+            'cpf': cpf, 'nascimento': '01/02/2003',
+        })
+
+    def test_cadastro_enfileira_e_worker_envia_numa_conexao(self):
+        for i in range(3):
+            self._cadastrar(f'aluno{i}@exemplo.com', f'cpf{i}')
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailPendente.objects.filter(status=EmailPendente.PENDENTE).count(), 3)
+
+        call_command('send_outbox', stdout=StringIO())
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(BackendInstavel.aberturas, 1)
+        self.assertEqual(EmailPendente.objects.filter(status=EmailPendente.ENVIADO).count(), 3)
+        self.assertIn('/reset/', mail.outbox[0].body)
+
+    def test_falha_volta_para_fila_com_espera(self):
+        self._cadastrar('ok@exemplo.com', 'cpf-ok')
+        self._cadastrar('recusado@exemplo.com', 'cpf-recusado')
+        BackendInstavel.recusar = {'recusado@exemplo.com'}
+
+        with self.assertLogs('avaliacoes.caixa_saida', level='WARNING') as registros:
+            call_command('send_outbox', stdout=StringIO())
+
+        falha = EmailPendente.objects.get(destinatarios=['recusado@exemplo.com'])
+        self.assertEqual(len(registros.records), 1)
+        self.assertIn(f'Falha ao enviar e-mail {falha.pk} (tentativa 1)', registros.output[0])
+        self.assertEqual((falha.status, falha.tentativas), (EmailPendente.PENDENTE, 1))
+        self.assertGreater(falha.proxima_tentativa, timezone.now())
+        self.assertIn('550', falha.ultimo_erro)
+        self.assertEqual([m.to for m in mail.outbox], [['ok@exemplo.com']])
+
+        # Vence a espera e falha de novo
+        EmailPendente.objects.filter(pk=falha.pk).update(proxima_tentativa=timezone.now())
+        with self.assertLogs('avaliacoes.caixa_saida', level='WARNING'):
+            call_command('send_outbox', stdout=StringIO())
+        falha.refresh_from_db()
+        self.assertEqual(falha.tentativas, 2)
+
+
+class ImportacaoTests(TestCase):
+    """importar_usuarios (avaliacoes/importacao.py): cria os válidos e relata cada linha recusada."""
+
+    CABECALHO = 'tipo,nome,email,cpf,nascimento,disciplina\n'
+
+    def setUp(self):
+        Materia.objects.create(nome='Matemática', codigo='MAT101', data_inicio=timezone.now().date())
+        CustomUser.objects.create_user(
+            username='Ja.Existe@Exemplo.com', email='Ja.Existe@Exemplo.com', cpf='99999999999', user_type='aluno'
+        )
+
+    def _importar(self, linhas, **kwargs):
+        return importar_usuarios(StringIO(self.CABECALHO + ''.join(f'{linha}\n' for linha in linhas)), **kwargs)
+
+    def test_cria_validos_e_relata_os_demais(self):
+        with mock.patch('avaliacoes.importacao.ProcessPoolExecutor') as pool:
+            relatorio = self._importar([
+                'aluno,Maria Souza,Maria@Exemplo.com,11111111111,01/02/2005,',
+                'professor,João Lima,joao@exemplo.com,22222222222,15/08/1980,MAT101',
+                'aluno,Sem Email,nao-e-email,33333333333,01/02/2005,',
+                'aluno,Data Ruim,data@exemplo.com,44444444444,2005-02-01,',
+                'monitor,Tipo Ruim,tipo@exemplo.com,55555555555,01/02/2005,',
+                'aluno,Maria Repetida,maria@exemplo.com,66666666666,01/02/2005,',
+                'aluno,Caixa Diferente,ja.existe@exemplo.com,77777777777,01/02/2005,',
+                'aluno,CPF Repetido,cpf@exemplo.com,99999999999,01/02/2005,',
+                'professor,Sem Materia,prof@exemplo.com,88888888888,15/08/1980,XYZ',
+            ], dominio='exemplo.com', tamanho_lote=3)
+        # Com workers=1 (o padrão, usado pelo admin) os hashes são feitos no próprio processo
+        pool.assert_not_called()
+
+        self.assertEqual(relatorio.criados_por_tipo, [('aluno', 1), ('professor', 1)])
+        self.assertEqual([(erro.linha, erro.motivo) for erro in relatorio.erros], [
+            (4, 'E-mail inválido.'),
+            (5, 'Data inválida (DD/MM/AAAA).'),
+            (6, "Tipo inválido 'monitor' (use aluno ou professor)."),
+            (7, 'E-mail repetido no arquivo.'),
+            (8, 'E-mail já cadastrado.'),
+            (9, 'CPF já cadastrado.'),
+            (10, "Disciplina 'XYZ' não encontrada."),
+        ])
+        maria = CustomUser.objects.get(cpf='11111111111')
+        self.assertEqual((maria.username, maria.first_name, maria.last_name), ('maria@exemplo.com', 'Maria', 'Souza'))
+        self.assertTrue(Aluno.objects.filter(user=maria).exists())
+        self.assertTrue(DisciplinaPessoa.objects.filter(pessoa__cpf='22222222222', disciplina__codigo='MAT101').exists())
+        self.assertEqual(EmailPendente.objects.count(), 2)
+
+    def test_sem_hashes_nao_abre_o_pool(self):
+        with mock.patch('avaliacoes.importacao.ProcessPoolExecutor') as pool:
+            relatorio = self._importar(['aluno,Outro,outro@exemplo.com,99999999999,01/02/2005,'], workers=4)
+        pool.assert_not_called()
+        self.assertEqual(relatorio.total_criados, 0)
+
+    def test_conflito_no_banco_desfaz_so_o_lote(self):
+        # Simula outro processo gravando o mesmo CPF entre as conferências e o INSERT
+        with mock.patch('avaliacoes.importacao._ja_cadastrados', return_value=(set(), set())):
+            relatorio = self._importar([
+                'aluno,Primeiro Lote,um@exemplo.com,11111111111,01/02/2005,',
+                'aluno,Primeiro Lote,dois@exemplo.com,22222222222,01/02/2005,',
+                'aluno,Segundo Lote,tres@exemplo.com,33333333333,01/02/2005,',
+                'aluno,Segundo Lote,conflito@exemplo.com,99999999999,01/02/2005,',
+            ], tamanho_lote=2)
+
+        # O primeiro lote fica gravado; o segundo é desfeito inteiro e relatado linha a linha
+        self.assertEqual(relatorio.total_criados, 2)
+        self.assertEqual([erro.linha for erro in relatorio.erros], [4, 5])
+        for erro in relatorio.erros:
+            self.assertTrue(erro.motivo.startswith('Lote não gravado (conflito no banco'), erro.motivo)
+        self.assertEqual(
+            sorted(CustomUser.objects.filter(user_type='aluno').values_list('cpf', flat=True)),
+            ['11111111111', '22222222222', '99999999999'],
+        )
+
+
+class MatricularLoteTests(TestCase):
+    """matricular_alunos_lote_api: contagens de criadas, já matriculados e não encontrados."""
+
+    def setUp(self):
+        [self.turma], usuarios = _criar_cenario(qtde_turmas=1, qtde_alunos=1)
+        self.matriculado = usuarios[0]
+        self.livres = []
+        for i in range(3):
+            usuario = CustomUser.objects.create_user(
+                username=f'livre{i}', email=f'livre{i}@exemplo.com', cpf=f'livre{i}', user_type='aluno'
+            )
+            Aluno.objects.create(user=usuario)
+            self.livres.append(usuario)
+        self.client.force_login(CustomUser.objects.create_user(
+            username='admin', cpf='admin', user_type='admin', is_staff=True
+        ))
+
+    def _matricular(self, identificadores):
+        resposta = self.client.post(
+            reverse('matricular_alunos_lote_api'),
+            json.dumps({'disciplina_pessoa_id': self.turma.pk, 'identificadores': '\n'.join(identificadores)}),
+            content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+        dados = resposta.json()
+        return dados['criadas'], dados['ja_matriculados'], dados['nao_encontrados']
+
+    def test_contagens(self):
+        livre0, livre1, _ = self.livres
+        self.assertEqual(
+            self._matricular([self.matriculado.cpf, livre0.cpf, 'LIVRE1@exemplo.com', 'ninguem@exemplo.com']),
+            (2, 1, ['ninguem@exemplo.com']),
+        )
+        self.assertEqual(MatriculaAluno.objects.filter(disciplina_professor=self.turma).count(), 3)
+        self.assertEqual(self._matricular([livre0.cpf, livre1.email]), (0, 2, []))
+
+    def test_criadas_conta_so_o_que_foi_gravado(self):
+        bulk_create = MatriculaAluno.objects.bulk_create
+
+        def ignora_a_primeira(objetos, *args, **kwargs):
+            # Como o ignore_conflicts faria com uma linha em conflito
+            return bulk_create(objetos[1:], *args, **kwargs)
+
+        with mock.patch.object(MatriculaAluno.objects, 'bulk_create', side_effect=ignora_a_primeira):
+            self.assertEqual(self._matricular([usuario.cpf for usuario in self.livres]), (2, 0, []))
+
+
+class SincronizarMatriculasTests(TestCase):
+    """sincronizar_matriculas: o merge com o arquivo só insere o que falta e só remove o que saiu."""
+
+    CABECALHO = 'aluno_cpf,professor_cpf,disciplina\n'
+
+    def setUp(self):
+        # 2 turmas (M0, M1) com os 3 alunos matriculados em ambas
+        self.turmas, self.alunos = _criar_cenario(qtde_turmas=2, qtde_alunos=3)
+        novo = CustomUser.objects.create_user(username='novo', cpf='123.456.789-01', user_type='aluno')
+        Aluno.objects.create(user=novo)
+        self.client.force_login(self.alunos[0])
+        resposta = self.client.post(
+            reverse('salvar_avaliacao_api'),
+            json.dumps({'disciplina_pessoa_id': self.turmas[0].pk, **_notas(8)}),
+            content_type='application/json',
+        )
+        self.assertEqual(resposta.status_code, 200, resposta.content)
+
+    def _sincronizar(self, linhas, **kwargs):
+        arquivo = StringIO(self.CABECALHO + ''.join(f'{linha}\n' for linha in linhas))
+        return sincronizar_matriculas(arquivo, tamanho_lote=2, tamanho_bloco=2, **kwargs)
+
+    def _matriculas(self):
+        return set(MatriculaAluno.objects.values_list('aluno__user__cpf', 'disciplina_professor__disciplina__codigo'))
+
+    def test_insere_remove_e_mantem(self):
+        linhas = [
+            # aluno0 saiu de M0; o aluno novo entrou em M0 (CPF sem pontuação no arquivo)
+            'aluno2,prof,M1', 'aluno0,prof,M1', 'aluno1,prof,M0', '12345678901,prof,M0',
+            'aluno1,prof,M1', 'aluno2,prof,M0', 'aluno2,prof,M0',
+            'aluno1,,M0', 'fantasma,prof,M0',
+        ]
+        simulado = self._sincronizar(linhas, simular=True)
+        self.assertEqual((simulado.inseridas, simulado.removidas), (2, 1))
+        self.assertEqual(MatriculaAluno.objects.count(), 6)
+
+        relatorio = self._sincronizar(linhas)
+        self.assertEqual(
+            (relatorio.inseridas, relatorio.removidas, relatorio.avaliacoes_removidas, relatorio.inalteradas),
+            (1, 1, 1, 5),
+        )
+        self.assertEqual(relatorio.erros, [
+            (9, 'Preencha aluno_cpf, professor_cpf e disciplina.'),
+            (10, 'Aluno com CPF fantasma não encontrado.'),
+        ])
+        self.assertEqual(self._matriculas(), {
+            ('aluno0', 'M1'), ('aluno1', 'M0'), ('aluno1', 'M1'), ('aluno2', 'M0'), ('aluno2', 'M1'),
+            ('123.456.789-01', 'M0'),
+        })
+        self.assertFalse(Avaliacao.objects.exists())
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+        # O mesmo arquivo de novo: nada a gravar
+        with CaptureQueriesContext(connection) as consultas:
+            relatorio = self._sincronizar(linhas)
+        self.assertEqual((relatorio.inseridas, relatorio.removidas, relatorio.inalteradas), (0, 0, 6))
+        self.assertFalse([c['sql'] for c in consultas if c['sql'].startswith(('INSERT', 'DELETE', 'UPDATE'))])
+
+    def test_matricula_feita_durante_a_sincronizacao_nao_conta(self):
+        novo = Aluno.objects.get(user__cpf='123.456.789-01')
+        ler_banco = matriculas._matriculas_ordenadas
+
+        def matricula_depois_da_leitura(*args, **kwargs):
+            # O admin matricula o aluno novo depois que o banco foi lido, antes do lote
+            banco = ler_banco(*args, **kwargs)
+            MatriculaAluno.objects.create(aluno=novo, disciplina_professor=self.turmas[0])
+            return banco
+
+        linhas = [f'{usuario.cpf},prof,{turma.disciplina.codigo}' for usuario in self.alunos for turma in self.turmas]
+        with mock.patch.object(matriculas, '_matriculas_ordenadas', side_effect=matricula_depois_da_leitura):
+            relatorio = self._sincronizar(linhas + ['12345678901,prof,M0', '12345678901,prof,M1'])
+        self.assertEqual((relatorio.inseridas, relatorio.removidas, relatorio.inalteradas), (1, 0, 7))
+        self.assertEqual(MatriculaAluno.objects.filter(aluno=novo).count(), 2)
+
+    def test_recusa_arquivo_vazio(self):
+        with self.assertRaisesMessage(ValueError, 'nenhuma matrícula válida'):
+            self._sincronizar(['aluno0,,M0'])
+        self.assertEqual(MatriculaAluno.objects.count(), 6)
+
+        relatorio = self._sincronizar([], permitir_vazio=True)
+        self.assertEqual((relatorio.removidas, relatorio.avaliacoes_removidas), (6, 1))
+        self.assertFalse(MatriculaAluno.objects.exists())
+
+
+class SeedDataTests(TestCase):
+    """seed_data gera o tamanho pedido, sempre os mesmos dados para a mesma semente e agregados em dia."""
+
+    def _semear(self, **opcoes):
+        opcoes = {'professors': 4, 'disciplines': 3, 'ratings': 30, 'students': 20, 'batch_size': 7, **opcoes}
+        call_command('seed_data', stdout=StringIO(), **opcoes)
+
+    @staticmethod
+    def _retrato():
+        return [
+            (
+                avaliacao.disciplina_pessoa.pessoa.username,
+                avaliacao.disciplina_pessoa.disciplina.nome,
+                avaliacao.aluno.user.username,
+                avaliacao.comentario,
+                sorted(nota.nota for nota in avaliacao.categorias_avaliacao.all()),
+            )
+            for avaliacao in Avaliacao.objects.select_related(
+                'disciplina_pessoa__pessoa', 'disciplina_pessoa__disciplina', 'aluno__user'
+            ).prefetch_related('categorias_avaliacao').order_by('pk')
+        ]
+
+    def test_quantidades_e_consistencia(self):
+        self._semear()
+        self.assertEqual(Professor.objects.count(), 4)
+        self.assertEqual(Materia.objects.count(), 3)
+        self.assertEqual(Aluno.objects.count(), 20)
+        self.assertEqual(Avaliacao.objects.count(), 30)
+        self.assertEqual(AvaliacaoCategoria.objects.count(), 30 * len(CATEGORIAS))
+        # Toda avaliação é de um aluno matriculado na turma
+        self.assertFalse(Avaliacao.objects.exclude(
+            Exists(MatriculaAluno.objects.filter(
+                aluno_id=OuterRef('aluno_id'), disciplina_professor_id=OuterRef('disciplina_pessoa_id')
+            ))
+        ).exists())
+        self.assertEqual(MediaUniversidade.objects.get().qtde_avaliacoes, 30)
+        call_command('rebuild_aggregates', '--verify', stdout=StringIO())
+
+    def test_mesma_semente_mesmos_dados(self):
+        self._semear(seed=7)
+        primeiro = self._retrato()
+        self._semear(seed=7)
+        self.assertEqual(self._retrato(), primeiro)
+        self._semear(seed=8)
+        self.assertNotEqual(self._retrato(), primeiro)
+
+    def test_skew_concentra_as_avaliacoes(self):
+        def maior_fatia(skew):
+            self._semear(professors=10, ratings=200, students=200, skew=skew)
+            por_professor = Avaliacao.objects.values('disciplina_pessoa__pessoa').annotate(total=Count('pk'))
+            return max(linha['total'] for linha in por_professor) / 200
+
+        self.assertLess(maior_fatia(0), 0.2)
+        self.assertGreater(maior_fatia(2), 0.5)
+
+
+class BenchmarkTests(TestCase):
+    """O benchmark roda de ponta a ponta no dataset pequeno e acusa regressões."""
+
+    def test_small_sem_erros(self):
+        resultado = benchmark.executar(datasets=['small'], repeticoes=3)
+
+        medidas = resultado['datasets']['small']
+        self.assertEqual(set(medidas), {cenario.nome for cenario in benchmark.CENARIOS})
+        for nome, medida in medidas.items():
+            self.assertEqual(medida['erros'], 0, nome)
+            self.assertGreater(medida['consultas'], 0, nome)
+        # Serializável, para ser guardado como referência
+        json.dumps(resultado)
+
+    def test_comparar(self):
+        def resultado(p95, consultas):
+            return {'datasets': {'small': {'ranking_geral': {'p95_ms': p95, 'consultas': consultas}}}}
+
+        self.assertEqual(benchmark.comparar(resultado(11.0, 3), resultado(10.0, 3)), [])
+        # Mais lento, mas abaixo de TOLERANCIA_MS: ruído
+        self.assertEqual(benchmark.comparar(resultado(3.0, 3), resultado(1.0, 3)), [])
+        self.assertEqual(len(benchmark.comparar(resultado(20.0, 4), resultado(10.0, 3))), 2)
+
+
+@override_settings(METRICAS_TOKEN='orcamento')
+class OrcamentoConsultasTests(TestCase):
+    """
+    Cada view do urls.py tem um máximo de consultas SQL que não cresce com os dados:
+    mede com o banco do seed_data em tamanho N e 10·N e exige que 10·N não custe mais.
+    Numa falha, a mensagem traz o SQL executado.
+    """
+    TAMANHO_N = {'professors': 3, 'disciplines': 4, 'ratings': 40}
+    # Cabeçalhos extras por view: /metrics/ é medida como o coletor, sem sessão
+    CABECALHOS = {'metricas_prometheus': {'HTTP_AUTHORIZATION': 'Bearer orcamento'}}
+
+    # Máximo de consultas por requisição (com sessão e usuário logado)
+    ORCAMENTO = {
+        'index': 2,
+        'home': 3,
+        'login': 2,
+        'logout': 4,
+        'lista_professores': 4,
+        'detalhes_professor': 8,
+        'editar_professor': 6,
+        'selecionar_professor_para_editar': 3,
+        'salvar_avaliacao_api': 10,
+        'salvar_avaliacoes_lote_api': 13,
+        'salvar_comentario_api': 6,
+        'sugestoes_professores_api': 3,
+        'sugestoes_disciplinas_api': 3,
+        'busca_api': 8,
+        'enviar_avaliacao': 3,
+        'obrigado': 2,
+        'dashboard_grafico': 3,
+        'lista_comentarios': 3,
+        'admin_cadastro': 2,
+        'adicionar_disciplina': 2,
+        'adicionar_usuario': 3,
+        'ranking_geral': 3,
+        'comparacao_disciplina': 6,
+        'sobre_nos': 2,
+        'contato': 2,
+        'password_reset_confirm': 3,
+        'password_reset_complete': 2,
+        'selecionar_aluno_para_editar': 3,
+        'editar_aluno': 8,
+        'matricular_alunos': 3,
+        'get_disciplinas_professor': 3,
+        'adicionar_disciplina_professor': 8,
+        'excluir_disciplina_professor': 21,
+        'get_disciplinas_table': 6,
+        'excluir_matricula_aluno': 18,
+        'matricular_alunos_lote_api': 11,
+        'metricas': 2,
+        'metricas_prometheus': 0,
+        'perfis': 2,
+        'baixar_perfil': 2,
+    }
+
+    def setUp(self):
+        self.perfis = tempfile.TemporaryDirectory()
+        self.addCleanup(self.perfis.cleanup)
+        configuracao = override_settings(PERFIL_DIR=self.perfis.name)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+
+    def _popular(self, fator):
+        tamanho = {opcao: valor * fator for opcao, valor in self.TAMANHO_N.items()}
+        call_command('seed_data', stdout=StringIO(), **tamanho)
+        categorias.invalidar()
+        autocompletar.invalidar()
+        admin = CustomUser.objects.create_user(
+            username='admin', cpf='admin', user_type='admin', is_staff=True
+        )
+
+        professor = Professor.objects.select_related('user').annotate(
+            total=Count('user__disciplinas_pessoa__avaliacoes')
+        ).order_by('-total', 'pk').first()
+        turma = DisciplinaPessoa.objects.filter(pessoa=professor.user).select_related('disciplina').first()
+        # Aluno novo, matriculado em duas turmas que já têm avaliações (para os envios:
+        # assim as médias e histogramas já existem nos dois tamanhos e o caminho é o mesmo)
+        usuario_aluno = CustomUser.objects.create_user(username='aluno', cpf='aluno', user_type='aluno')
+        aluno = Aluno.objects.create(user=usuario_aluno).pk
+        pendentes = MatriculaAluno.objects.bulk_create(
+            MatriculaAluno(aluno_id=aluno, disciplina_professor=dp)
+            for dp in DisciplinaPessoa.objects.filter(avaliacoes__isnull=False).distinct().order_by('pk')[:2]
+        )
+        outra_turma = DisciplinaPessoa.objects.exclude(matriculas_alunos__aluno_id=aluno).first()
+        # Alunos fora de qualquer turma, para a matrícula em lote
+        livres = [
+            CustomUser.objects.create_user(username=f'livre{i}', cpf=f'livre{i}', user_type='aluno')
+            for i in range(3)
+        ]
+        Aluno.objects.bulk_create(Aluno(user=usuario) for usuario in livres)
+        token = PasswordResetTokenGenerator().make_token(usuario_aluno)
+        uid = urlsafe_base64_encode(force_bytes(usuario_aluno.pk))
+        Path(self.perfis.name, 'perfil-teste.txt').write_text('Perfil de teste\n', encoding='utf-8')
+        # O seed_data nunca gera 0.5: a faixa do histograma é sempre nova, nos dois tamanhos
+        categorias_corpo = {categoria.slug: 0.5 for categoria in categorias.registro()}
+
+        # (nome da url, método, url, corpo JSON ou None, usuário). Escritas no fim.
+        return [
+            ('index', 'get', reverse('index'), None, usuario_aluno),
+            ('home', 'get', reverse('home'), None, usuario_aluno),
+            ('login', 'get', reverse('login'), None, None),
+            ('lista_professores', 'get', reverse('lista_professores'), None, usuario_aluno),
+            ('detalhes_professor', 'get', reverse('detalhes_professor', args=[professor.pk]), None, usuario_aluno),
+            ('editar_professor', 'get', reverse('editar_professor', args=[professor.pk]), None, admin),
+            ('selecionar_professor_para_editar', 'get', reverse('selecionar_professor_para_editar'), None, admin),
+            ('sugestoes_professores_api', 'get', reverse('sugestoes_professores_api') + '?term=a', None, usuario_aluno),
+            ('sugestoes_disciplinas_api', 'get', reverse('sugestoes_disciplinas_api') + '?term=e', None, usuario_aluno),
+            ('busca_api', 'get', reverse('busca_api') + '?q=a', None, usuario_aluno),
+            ('enviar_avaliacao', 'get', reverse('enviar_avaliacao'), None, usuario_aluno),
+            ('obrigado', 'get', reverse('obrigado'), None, usuario_aluno),
+            ('dashboard_grafico', 'get', reverse('dashboard_grafico'), None, usuario_aluno),
+            ('lista_comentarios', 'get', reverse('lista_comentarios'), None, usuario_aluno),
+            ('admin_cadastro', 'get', reverse('admin_cadastro'), None, admin),
+            ('adicionar_disciplina', 'get', reverse('adicionar_disciplina'), None, admin),
+            ('adicionar_usuario', 'get', reverse('adicionar_usuario'), None, admin),
+            ('ranking_geral', 'get', reverse('ranking_geral'), None, usuario_aluno),
+            ('comparacao_disciplina', 'get',
+             reverse('comparacao_disciplina') + f'?q_disciplina={turma.disciplina.nome}', None, admin),
+            ('sobre_nos', 'get', reverse('sobre_nos'), None, usuario_aluno),
+            ('contato', 'get', reverse('contato'), None, usuario_aluno),
+            ('password_reset_confirm', 'get', reverse('password_reset_confirm', args=[uid, token]), None, None),
+            ('password_reset_complete', 'get', reverse('password_reset_complete'), None, None),
+            ('selecionar_aluno_para_editar', 'get', reverse('selecionar_aluno_para_editar'), None, admin),
+            ('editar_aluno', 'get', reverse('editar_aluno', args=[aluno]), None, admin),
+            ('matricular_alunos', 'get', reverse('matricular_alunos'), None, admin),
+            ('get_disciplinas_professor', 'get',
+             reverse('get_disciplinas_professor') + f'?professor_id={professor.user_id}&aluno_id={aluno}', None, admin),
+            ('get_disciplinas_table', 'get', reverse('get_disciplinas_table') + f'?aluno_id={aluno}', None, admin),
+            ('metricas', 'get', reverse('metricas'), None, admin),
+            ('metricas_prometheus', 'get', reverse('metricas_prometheus'), None, None),
+            ('perfis', 'get', reverse('perfis'), None, admin),
+            ('baixar_perfil', 'get', reverse('baixar_perfil', args=['perfil-teste.txt']), None, admin),
+            ('salvar_avaliacao_api', 'post', reverse('salvar_avaliacao_api'),
+             {'disciplina_pessoa_id': pendentes[0].disciplina_professor_id, **categorias_corpo}, usuario_aluno),
+            ('salvar_avaliacoes_lote_api', 'post', reverse('salvar_avaliacoes_lote_api'), {'avaliacoes': [
+                {'disciplina_pessoa_id': m.disciplina_professor_id, **categorias_corpo} for m in pendentes[1:]
+            ]}, usuario_aluno),
+            ('salvar_comentario_api', 'post', reverse('salvar_comentario_api'),
+             {'disciplina_pessoa_id': turma.pk, 'texto': 'Ótimas aulas.'}, usuario_aluno),
+            ('adicionar_disciplina_professor', 'post', reverse('adicionar_disciplina_professor'), {
+                'aluno_id': aluno, 'professor_id': outra_turma.pessoa_id, 'disciplina_id': outra_turma.disciplina_id,
+            }, admin),
+            ('matricular_alunos_lote_api', 'post', reverse('matricular_alunos_lote_api'), {
+                'disciplina_pessoa_id': turma.pk, 'identificadores': '\n'.join(usuario.cpf for usuario in livres),
+            }, admin),
+            ('excluir_matricula_aluno', 'delete',
+             reverse('excluir_matricula_aluno', args=[pendentes[0].pk]), None, admin),
+            ('excluir_disciplina_professor', 'delete',
+             reverse('excluir_disciplina_professor', args=[turma.pk]), None, admin),
+            ('logout', 'post', reverse('logout'), None, usuario_aluno),
+        ]
+
+    def _medir(self, fator):
+        medidas = {}
+        for nome, metodo, url, corpo, usuario in self._popular(fator):
+            self.client.logout()
+            if usuario is not None:
+                self.client.force_login(usuario)
+            argumentos = {'data': json.dumps(corpo), 'content_type': 'application/json'} if corpo else {}
+            argumentos.update(self.CABECALHOS.get(nome, {}))
+            with CaptureQueriesContext(connection) as capturadas:
+                resposta = getattr(self.client, metodo)(url, **argumentos)
+            if resposta.status_code >= 400:
+                self.fail(f'{nome}: {resposta.status_code} {resposta.content[:300]}')
+            if resposta.streaming:
+                # Consumir fecha o arquivo (close() direto dispararia o request_finished,
+                # que fecha a conexão do banco de teste)
+                b''.join(resposta.streaming_content)
+            medidas[nome] = [q['sql'] for q in capturadas.captured_queries]
+        return medidas
+
+    @staticmethod
+    def _listar(consultas):
+        return '\n'.join(f'  {i}. {consulta}' for i, consulta in enumerate(consultas, start=1))
+
+    def test_todas_as_urls_tem_orcamento(self):
+        nomes = {padrao.name for padrao in get_resolver().url_patterns if getattr(padrao, 'name', None)}
+        self.assertEqual(nomes - set(self.ORCAMENTO), set(), 'Views sem orçamento de consultas')
+
+    def test_consultas_nao_crescem_com_os_dados(self):
+        pequeno = self._medir(1)
+        grande = self._medir(10)
+        self.assertEqual(set(pequeno), set(self.ORCAMENTO))
+
+        for nome, limite in self.ORCAMENTO.items():
+            with self.subTest(view=nome):
+                # Menos consultas com 10·N é aceitável; mais consultas é um N+1
+                self.assertLessEqual(
+                    len(grande[nome]), len(pequeno[nome]),
+                    f'{nome}: {len(pequeno[nome])} consultas com N e {len(grande[nome])} com 10·N.\n'
+                    f'Com N:\n{self._listar(pequeno[nome])}\nCom 10·N:\n{self._listar(grande[nome])}'
+                )
+                self.assertLessEqual(
+                    len(pequeno[nome]), limite,
+                    f'{nome}: {len(pequeno[nome])} consultas (máximo {limite}):\n{self._listar(pequeno[nome])}'
+                )
+
+    def test_professor_select_sem_consulta_por_opcao(self):
+        class EscolhaProfessorForm(forms.Form):
+            professor = forms.ModelChoiceField(
+                queryset=Professor.objects.select_related('user'), widget=ProfessorSelect
+            )
+
+        def consultas_ao_renderizar():
+            with CaptureQueriesContext(connection) as capturadas:
+                html = str(EscolhaProfessorForm()['professor'])
+            self.assertIn('data-foto-url', html)
+            return len(capturadas)
+
+        call_command('seed_data', stdout=StringIO(), professors=3, ratings=0)
+        pequeno = consultas_ao_renderizar()
+        call_command('seed_data', stdout=StringIO(), professors=30, ratings=0)
+        self.assertEqual(consultas_ao_renderizar(), pequeno)
+
+
+class MetricasTests(TestCase):
+    """Middleware de métricas por view (avaliacoes/metricas.py), página de staff e /metrics/."""
+
+    def setUp(self):
+        metricas.registro.zerar()
+        self.admin = CustomUser.objects.create_user(
+            username='admin', cpf='admin', user_type='admin', is_staff=True
+        )
+
+    def test_middleware_mede_por_view(self):
+        self.client.force_login(self.admin)
+        for _ in range(3):
+            self.client.get(reverse('selecionar_aluno_para_editar'))
+        self.client.get('/nao-existe/')
+
+        linhas = {linha['view']: linha for linha in metricas.resumo()}
+        linha = linhas['selecionar_aluno_para_editar']
+        self.assertEqual(linha['requisicoes'], 3)
+        self.assertEqual(linha['erros'], 0)
+        # Sessão e usuário, no mínimo
+        self.assertGreaterEqual(linha['maior_consultas'], 2)
+        self.assertGreater(linha['media_sql_ms'], 0)
+        self.assertGreater(linha['media_template_ms'], 0)
+        self.assertLessEqual(linha['media_template_ms'], linha['media_ms'])
+        self.assertLessEqual(linha['p50_ms'], linha['p95_ms'])
+        self.assertLessEqual(linha['p95_ms'], linha['maior_ms'])
+        self.assertEqual(linhas[metricas.SEM_ROTA]['requisicoes'], 1)
+
+    def test_quantidade_de_views_limitada(self):
+        registro = metricas.Registro(max_views=2)
+        for view in ('a', 'b', 'c', 'd', 'a'):
+            registro.registrar(view, metricas._Medicao(consultas=1), 0.02, 200)
+        requisicoes = {view: metrica.requisicoes for view, metrica in registro.copia().items()}
+        self.assertEqual(requisicoes, {'a': 2, 'b': 1, metricas.OUTRAS: 2})
+
+    def test_painel_so_para_staff(self):
+        self.client.get(reverse('home'))
+        resposta = self.client.get(reverse('metricas'))
+        self.assertEqual(resposta.status_code, 302)
+
+        self.client.force_login(self.admin)
+        resposta = self.client.get(reverse('metricas') + '?ordem=consultas')
+        self.assertContains(resposta, 'home')
+
+        self.client.post(reverse('metricas'), {'zerar': '1'})
+        # Só a própria requisição do POST (medida depois de zerar) sobra
+        self.assertEqual(set(metricas.registro.copia()), {'metricas'})
+
+    def test_prometheus(self):
+        self.client.get(reverse('home'))
+        self.client.force_login(self.admin)
+        resposta = self.client.get(reverse('metricas_prometheus'))
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta['Content-Type'].startswith('text/plain; version=0.0.4'))
+        texto = resposta.content.decode()
+        self.assertIn('# TYPE avaliacoes_http_request_duration_seconds histogram', texto)
+        self.assertIn('avaliacoes_http_request_duration_seconds_bucket{view="home",le="+Inf"} 1', texto)
+        self.assertIn('avaliacoes_http_requests_total{view="home"} 1', texto)
+
+    @override_settings(METRICAS_TOKEN='segredo')
+    def test_prometheus_exige_token_ou_staff(self):
+        url = reverse('metricas_prometheus')
+        # O IP local não libera nada: atrás do proxy, toda requisição vem dele
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer errado').status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer segredo').status_code, 200)
+
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(METRICAS_TOKEN=None)
+    def test_prometheus_sem_token_configurado_so_staff(self):
+        resposta = self.client.get(reverse('metricas_prometheus'), HTTP_AUTHORIZATION='Bearer None')
+        self.assertEqual(resposta.status_code, 403)
+
+
+class PerfilamentoTests(TestCase):
+    """Perfil de requisição sob demanda e por amostragem (avaliacoes/perfilamento.py)."""
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        configuracao = override_settings(PERFIL_DIR=pasta.name, PERFIL_AMOSTRAGEM=0)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.admin = CustomUser.objects.create_user(
+            username='admin', cpf='admin', user_type='admin', is_staff=True
+        )
+
+    def test_staff_pede_perfil_e_baixa(self):
+        self.client.force_login(self.admin)
+        resposta = self.client.get(reverse('selecionar_aluno_para_editar'), {perfilamento.PARAMETRO: '1'})
+        self.assertEqual(resposta.status_code, 200)
+
+        download = self.client.get(resposta['X-Perfil'])
+        self.assertEqual(download.status_code, 200)
+        self.assertIn('attachment', download['Content-Disposition'])
+        relatorio = b''.join(download.streaming_content).decode()
+        self.assertIn('(view selecionar_aluno_para_editar)', relatorio)
+        self.assertIn('cumulative', relatorio)
+        self.assertIn('== tracemalloc', relatorio)
+        self.assertIn('SELECT', relatorio)
+
+        [perfil] = perfilamento.listar()
+        self.assertTrue(perfil['tem_prof'])
+        self.assertContains(self.client.get(reverse('perfis')), perfil['nome'])
+
+        # Pelo cabeçalho também
+        resposta = self.client.get(reverse('selecionar_aluno_para_editar'), HTTP_X_PERFIL='1')
+        self.assertIn('X-Perfil', resposta)
+
+    def test_so_staff_pede_perfil(self):
+        aluno = CustomUser.objects.create_user(username='aluno', cpf='aluno', user_type='aluno')
+        self.client.force_login(aluno)
+        resposta = self.client.get(reverse('sobre_nos'), {perfilamento.PARAMETRO: '1'})
+        self.assertNotIn('X-Perfil', resposta)
+        self.assertEqual(perfilamento.listar(), [])
+        self.assertEqual(self.client.get(reverse('perfis')).status_code, 302)
+
+    def test_amostragem_e_limite_de_arquivos(self):
+        with self.settings(PERFIL_AMOSTRAGEM=1.0, PERFIL_MAX_ARQUIVOS=2):
+            for _ in range(3):
+                self.assertIn('X-Perfil', self.client.get(reverse('login')))
+        perfis = perfilamento.listar()
+        self.assertEqual(len(perfis), 2)
+        self.assertEqual(len(list(perfilamento.diretorio().glob('*.prof'))), 2)
+
+    def test_perfil_nao_grava_a_chave_da_sessao(self):
+        aluno = CustomUser.objects.create_user(username='aluno', cpf='aluno', user_type='aluno')
+        self.client.force_login(aluno)
+        with self.settings(PERFIL_AMOSTRAGEM=1.0):
+            self.assertIn('X-Perfil', self.client.get(reverse('sobre_nos')))
+        [perfil] = perfilamento.listar()
+        relatorio = perfilamento.arquivo(f"{perfil['nome']}.txt").read_text(encoding='utf-8')
+        self.assertIn('django_session', relatorio)
+        self.assertNotIn(self.client.session.session_key, relatorio)
+
+    def test_download_so_de_perfil_existente(self):
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('baixar_perfil', args=['nao-existe.txt'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('baixar_perfil', args=['settings.py'])).status_code, 404)
+
+
+def _view_n_mais_um(request):
+    # N+1 de propósito: o usuário de cada professor numa consulta separada
+    return JsonResponse({'nomes': [professor.user.username for professor in Professor.objects.order_by('pk')]})
+
+
+# URLs só do ConsultasRepetidasTests (ROOT_URLCONF='avaliacoes.tests')
+urlpatterns = [path('n-mais-um/', _view_n_mais_um)]
+
+
+class ConsultasRepetidasTests(TestCase):
+    """
+    Detector de N+1 (avaliacoes/consultas_repetidas.py). Nos testes o middleware já roda
+    com CONSULTAS_REPETIDAS_ACAO='erro' (avaliacoes/executor_testes.py): qualquer view com
+    N+1 quebra o teste que a chama.
+    """
+
+    def setUp(self):
+        for i in range(consultas_repetidas.LIMITE + 2):
+            usuario = CustomUser.objects.create_user(username=f'prof{i}', cpf=f'prof{i}', user_type='professor')
+            Professor.objects.create(user=usuario)
+
+    def test_impressao_digital_ignora_valores(self):
+        self.assertEqual(
+            consultas_repetidas.impressao_digital(
+                "SELECT * FROM t WHERE id = 12 AND nome = 'Ana' AND x IN (%s, %s) LIMIT 21"
+            ),
+            consultas_repetidas.impressao_digital(
+                "SELECT *  FROM t\nWHERE id = 7 AND nome = 'O''Brien' AND x IN (%s, %s, %s) LIMIT 21"
+            ),
+        )
+
+    def test_aponta_a_linha_do_template(self):
+        template = engines['django'].from_string(
+            '{% for professor in professores %}\n{{ professor.user.username }}\n{% endfor %}'
+        )
+        with consultas_repetidas.Detector() as detector:
+            template.render({'professores': Professor.objects.all()})
+        [repeticao] = detector.repeticoes()
+        self.assertEqual(repeticao.vezes, consultas_repetidas.LIMITE + 2)
+        self.assertIn('linha 2: {{ professor.user.username }}', repeticao.template)
+
+        # Com select_related, nada a acusar
+        with consultas_repetidas.Detector() as detector:
+            template.render({'professores': Professor.objects.select_related('user')})
+        self.assertEqual(detector.repeticoes(), [])
+
+    @override_settings(ROOT_URLCONF='avaliacoes.tests', CONSULTAS_REPETIDAS_ACAO='erro')
+    def test_middleware_levanta_com_a_pilha(self):
+        with self.assertRaises(consultas_repetidas.ConsultaRepetida) as contexto:
+            self.client.get('/n-mais-um/')
+        self.assertIn('GET /n-mais-um/', str(contexto.exception))
+        self.assertIn('avaliacoes/tests.py', str(contexto.exception))
+        self.assertIn('em _view_n_mais_um', str(contexto.exception))
+
+    @override_settings(ROOT_URLCONF='avaliacoes.tests', CONSULTAS_REPETIDAS_ACAO='avisar')
+    def test_middleware_avisa_no_log(self):
+        with self.assertLogs('avaliacoes.consultas_repetidas', 'WARNING') as logs:
+            resposta = self.client.get('/n-mais-um/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('provável N+1', logs.output[0])
+
+    def test_executor_liga_o_modo_erro(self):
+        self.assertEqual(settings.CONSULTAS_REPETIDAS_ACAO, 'erro')
 
-# Create your tests here.
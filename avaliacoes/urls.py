@@ -20,10 +20,12 @@ urlpatterns = [
     # --- FIM ---
 
     path('api/salvar-avaliacao/', views.salvar_avaliacao_api, name='salvar_avaliacao_api'),
+    path('api/salvar-avaliacoes/', views.salvar_avaliacoes_lote_api, name='salvar_avaliacoes_lote_api'),
     path('api/salvar-comentario/', views.salvar_comentario_api, name='salvar_comentario_api'),
 
     path('api/sugestoes-professores/', views.sugestoes_professores_api, name='sugestoes_professores_api'),
     path('api/sugestoes-disciplinas/', views.sugestoes_disciplinas_api, name='sugestoes_disciplinas_api'),
+    path('api/busca/', views.busca_api, name='busca_api'),
 
     path('avaliar/', views.enviar_avaliacao, name='enviar_avaliacao'),
     path('obrigado/', views.obrigado, name='obrigado'),
@@ -57,12 +59,19 @@ urlpatterns = [
 
     path('alunos/selecionar/', views.selecionar_aluno_para_editar, name='selecionar_aluno_para_editar'),
     path('alunos/<int:aluno_id>/editar/', views.editar_aluno, name='editar_aluno'),
+    path('alunos/matricular/', views.matricular_alunos, name='matricular_alunos'),
 
     path('ajax/get_disciplinas_professor/', views.get_disciplinas_professor, name='get_disciplinas_professor'),
     path('ajax/adicionar_disciplina_professor/', views.adicionar_disciplina_professor, name='adicionar_disciplina_professor'),
     path('ajax/excluir_disciplina_professor/<int:id>/', views.excluir_disciplina_professor, name='excluir_disciplina_professor'),
     path('ajax/get_disciplinas_table/', views.get_disciplinas_table, name='get_disciplinas_table'),
     path('ajax/excluir_matricula/<int:matricula_id>/', views.excluir_matricula_aluno, name='excluir_matricula_aluno'),
+    path('ajax/matricular_alunos/', views.matricular_alunos_lote_api, name='matricular_alunos_lote_api'),
+
+    path('painel/metricas/', views.metricas_painel, name='metricas'),
+    path('metrics/', views.metricas_prometheus, name='metricas_prometheus'),
+    path('painel/perfis/', views.perfis, name='perfis'),
+    path('painel/perfis/<str:nome>/', views.baixar_perfil, name='baixar_perfil'),
     
 ]
 
@@ -1,7 +1,7 @@
 # avaliacoes/views.py
 
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from .forms import (
     AvaliacaoForm, MateriaForm, ProfessorForm, UserForm,
     # Imports adicionados:
@@ -9,30 +9,34 @@ from .forms import (
 )
 from .models import (
     Avaliacao, Professor, CustomUser, Materia, DisciplinaPessoa, 
-    Aluno, Categoria, AvaliacaoCategoria,MatriculaAluno
+    Aluno, Categoria, AvaliacaoCategoria,MatriculaAluno, MediaDisciplinaCategoria
 )
-from django.db.models import Avg, Count, Q
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Q
+from django.db.models.functions import Lower
+import hmac
 import json
+import math
+import re
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.admin.views.decorators import staff_member_required
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 from django.contrib import messages
 from datetime import datetime
-from django.db.models import Value, CharField
-from django.db.models.functions import Concat
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.views.decorators.http import require_POST
 from django.utils import timezone
-from django.db import IntegrityError # Import adicionado
+from django.db import IntegrityError, OperationalError # Import adicionado
 from .models import MensagemContato # Importe o modelo novo
 from django.contrib import messages
 from django.shortcuts import render, redirect
-from django.contrib.auth.forms import PasswordResetForm
 from django.core.mail import send_mail
 from django.utils.crypto import get_random_string
-from django.db import transaction
+from django.core import signing
+from django.db import connection, transaction
+from django.conf import settings
+from functools import wraps
 
 from django.template.loader import render_to_string
 from django.views.decorators.http import require_http_methods
@@ -41,16 +45,42 @@ from django.views.decorators.csrf import csrf_exempt
 
 from unidecode import unidecode
 
+from .agregados import (
+    apagar_avaliacoes, registrar_avaliacao, registrar_avaliacoes, descontar_avaliacoes, descontar_turmas,
+    resumo_universidade,
+    histogramas_por_turma, estatisticas_histograma, somar_histogramas
+)
+from .ranking import melhores_turmas, melhores_turmas_por_categoria
+from .busca import buscar_comentarios, buscar_materias, buscar_professores, filtro_busca
+from .autocompletar import sugerir_disciplinas, sugerir_professores
+from .categorias import registro as registro_categorias
+from .escrita import escrita_atomica
+from .idempotencia import idempotente
+from .caixa_saida import TEMPLATE_ASSUNTO_SENHA, TEMPLATE_CORPO_SENHA, RedefinicaoSenhaEnfileirada
+from .matriculas import remover_matriculas
+from . import metricas, perfilamento
+
+# Professores por página em lista_professores
+TAMANHO_PAGINA_PROFESSORES = 20
+SALT_CURSOR_PROFESSORES = 'avaliacoes.lista_professores'
+
+# Máximo de itens em salvar_avaliacoes_lote_api
+MAX_AVALIACOES_POR_LOTE = 20
+
+# Máximo de alunos (ids + CPFs/e-mails) por chamada de matricular_alunos_lote_api
+MAX_MATRICULAS_POR_LOTE = 1000
+
 @login_required(login_url='login')
 
 
 def home(request):
-    # 1. Calcular a média geral da faculdade (de 0 a 10)
-    media_geral_dict = AvaliacaoCategoria.objects.aggregate(media=Avg('nota'))
-    media_geral = media_geral_dict.get('media') or 0.0
+    # 1. Números gerais vêm da MediaUniversidade, mantida a cada avaliação gravada
+    #    (evita o Avg/Count sobre todas as notas a cada acesso)
+    resumo = resumo_universidade()
+    media_geral = float(resumo['media'])
 
-    # 2. Calcular o total de avaliações
-    total_avaliacoes = Avaliacao.objects.count()
+    # 2. Total de avaliações (com notas)
+    total_avaliacoes = resumo['qtde_avaliacoes']
     
     # 3. NOVO: Calcular a porcentagem para o gráfico
     # (media_geral / 10) * 100 = media_geral * 10
@@ -60,6 +90,8 @@ def home(request):
         'media_geral_faculdade': round(media_geral, 1),
         'media_percent_faculdade': media_percent, # <-- Variável para o gráfico
         'total_avaliacoes': total_avaliacoes,
+        'total_professores': resumo['qtde_professores'],
+        'total_disciplinas': resumo['qtde_disciplinas'],
         # (Não precisamos mais do 'nome_aluno', usamos request.user.first_name no template)
     }
     return render(request, 'avaliacoes/home.html', context)
@@ -86,44 +118,94 @@ def login_view(request):
 
 @login_required(login_url='login')
 def lista_professores(request):
-    # Inicia a query base
-    professores = Professor.objects.annotate(
-        media_nota=Avg('user__disciplinas_pessoa__avaliacoes__categorias_avaliacao__nota')
-    ).filter(id__isnull=False).order_by('user__first_name')
+    # Inicia a query base. Tudo o que o template usa vem junto:
+    # - user e a média (MediaProfessor) num único JOIN
+    # - as turmas e suas matérias numa única consulta extra (prefetch)
+    professores = Professor.objects.select_related('user').annotate(
+        media_nota=F('user__media_professor__media')
+    ).prefetch_related(
+        Prefetch('user__disciplinas_pessoa', queryset=DisciplinaPessoa.objects.select_related('disciplina'))
+    )
 
     # --- LÓGICA DE PESQUISA ---
     query_professor = request.GET.get('q_professor', '').strip()
     query_disciplina = request.GET.get('q_disciplina', '').strip()
 
     if query_professor:
-        # AQUI ESTA A CORREÇÃO:
-        # Criamos um campo virtual 'nome_completo' juntando First + Espaço + Last
-        professores = professores.annotate(
-            nome_completo=Concat(
-                'user__first_name', 
-                Value(' '), 
-                'user__last_name', 
-                output_field=CharField()
-            )
-        ).filter(
-            # Agora pesquisamos no nome, no sobrenome OU na junção dos dois
-            Q(user__first_name__icontains=query_professor) | 
-            Q(user__last_name__icontains=query_professor) |
-            Q(nome_completo__icontains=query_professor)
-        )
+        # Busca sem acento por prefixo de cada palavra do nome ("joao sil" acha "João Silva"),
+        # no mesmo índice FTS usado para as matérias (avaliacoes/busca.py)
+        professores = professores.filter(filtro_busca('busca_professor', query_professor))
 
     if query_disciplina:
-        professores = professores.filter(
-            user__disciplinas_pessoa__disciplina__nome__icontains=query_disciplina
-        ).distinct()
+        # EXISTS em vez de JOIN + distinct(): cada professor aparece uma vez só.
+        # O nome da matéria é procurado no índice FTS (avaliacoes/busca.py)
+        professores = professores.filter(Exists(
+            DisciplinaPessoa.objects.filter(
+                filtro_busca('busca_materia', query_disciplina, campo='disciplina_id'),
+                pessoa_id=OuterRef('user_id'),
+            )
+        ))
+
+    # --- PAGINAÇÃO POR CHAVE (nome, id) ---
+    pagina, cursor_anterior, cursor_proximo = _paginar_por_chave(
+        professores, request.GET.get('cursor'), TAMANHO_PAGINA_PROFESSORES
+    )
 
     context = {
-        'professores': professores,
+        'professores': pagina,
         'query_professor': query_professor,
-        'query_disciplina': query_disciplina
+        'query_disciplina': query_disciplina,
+        'cursor_anterior': cursor_anterior,
+        'cursor_proximo': cursor_proximo,
     }
     return render(request, 'avaliacoes/lista_professores.html', context)
 
+
+def _paginar_por_chave(professores, cursor, tamanho):
+    """
+    Paginação por chave (keyset) na ordem (user.first_name, id).
+    Em vez de OFFSET, cada página continua a partir do último professor da anterior,
+    então o custo não cresce com o número da página.
+    O cursor é assinado e guarda (direção, nome, id); 'p' = próxima e 'a' = anterior.
+    Retorna (professores_da_pagina, cursor_anterior, cursor_proximo).
+    """
+    direcao, nome, pk = 'p', None, None
+    if cursor:
+        try:
+            direcao, nome, pk = signing.loads(cursor, salt=SALT_CURSOR_PROFESSORES)
+        except (signing.BadSignature, ValueError, TypeError):
+            # Cursor inválido ou adulterado: volta para a primeira página
+            direcao, nome, pk = 'p', None, None
+
+    if direcao == 'a':
+        professores = professores.filter(
+            Q(user__first_name__lt=nome) | Q(user__first_name=nome, id__lt=pk)
+        ).order_by('-user__first_name', '-id')
+    else:
+        if pk is not None:
+            professores = professores.filter(
+                Q(user__first_name__gt=nome) | Q(user__first_name=nome, id__gt=pk)
+            )
+        professores = professores.order_by('user__first_name', 'id')
+
+    # Busca um a mais para saber se existe outra página na mesma direção
+    pagina = list(professores[:tamanho + 1])
+    tem_mais = len(pagina) > tamanho
+    pagina = pagina[:tamanho]
+    if direcao == 'a':
+        pagina.reverse()
+
+    def _cursor(direcao, professor):
+        return signing.dumps([direcao, professor.user.first_name, professor.id], salt=SALT_CURSOR_PROFESSORES)
+
+    cursor_anterior = cursor_proximo = None
+    if pagina:
+        if (direcao == 'p' and pk is not None) or (direcao == 'a' and tem_mais):
+            cursor_anterior = _cursor('a', pagina[0])
+        if direcao == 'a' or tem_mais:
+            cursor_proximo = _cursor('p', pagina[-1])
+    return pagina, cursor_anterior, cursor_proximo
+
 @login_required(login_url='login')
 def enviar_avaliacao(request):
     professor_id = request.GET.get('professor_id')
@@ -151,12 +233,14 @@ def obrigado(request):
 
 @login_required(login_url='login')
 def dashboard_grafico(request):
-    professores = Professor.objects.annotate(
-        media_nota=Avg('user__disciplinas_pessoa__avaliacoes__categorias_avaliacao__nota')
+    # Usuário e média (MediaProfessor, mantida a cada avaliação) numa consulta só,
+    # sem varrer as notas nem buscar o usuário de cada professor
+    professores = Professor.objects.select_related('user').annotate(
+        media_nota=F('user__media_professor__media')
     )
 
     nomes = [prof.user.get_full_name() or prof.user.username for prof in professores]
-    medias = [prof.media_nota or 0 for prof in professores]
+    medias = [float(prof.media_nota or 0) for prof in professores]
 
     context = {
         'nomes_json': json.dumps(nomes),
@@ -166,14 +250,22 @@ def dashboard_grafico(request):
 
 @login_required(login_url='login')
 def lista_comentarios(request):
-    comentarios = Avaliacao.objects.filter(
-        comentario__isnull=False
-    ).exclude(
-        comentario=''
-    ).select_related(
-        'disciplina_pessoa__pessoa'
-    )
-    return render(request, 'avaliacoes/lista_comentarios.html', {'comentarios': comentarios})
+    query_comentario = request.GET.get('q', '').strip()
+    if query_comentario:
+        # Busca no texto dos comentários pelo índice FTS, mais relevantes primeiro
+        comentarios = [c for c in buscar_comentarios(query_comentario, limite=100) if c.comentario]
+    else:
+        comentarios = Avaliacao.objects.filter(
+            comentario__isnull=False
+        ).exclude(
+            comentario=''
+        ).select_related(
+            'disciplina_pessoa__pessoa'
+        )
+    return render(request, 'avaliacoes/lista_comentarios.html', {
+        'comentarios': comentarios,
+        'query_comentario': query_comentario,
+    })
 
 @staff_member_required
 def admin_cadastro(request):
@@ -378,6 +470,17 @@ def adicionar_usuario(request):
                     novo_user.is_staff = True
                     novo_user.is_superuser = True
                     novo_user.save()
+
+                # E-mail para definir a senha: só entra na caixa de saída (um INSERT, na
+                # mesma transação). O envio é feito pelo worker `manage.py send_outbox`.
+                reset_form = RedefinicaoSenhaEnfileirada({'email': email})
+                if reset_form.is_valid():
+                    reset_form.save(
+                        request=request,
+                        use_https=request.is_secure(),
+                        subject_template_name=TEMPLATE_ASSUNTO_SENHA,
+                        email_template_name=TEMPLATE_CORPO_SENHA,
+                    )
             
             # --- FIM DO BLOCO ATOMIC ---
             # O banco de dados foi salvo e liberado AQUI.
@@ -387,30 +490,12 @@ def adicionar_usuario(request):
             messages.error(request, f"Erro ao salvar no banco: {e}")
             return redirect('adicionar_usuario')
 
-        # --- 4. ENVIO DE EMAIL (LENTO) ---
-        # Agora estamos fora da transação, então se demorar, não trava o banco.
-        try:
-            print(f"DEBUG: Enviando email para {email}")
-            reset_form = PasswordResetForm({'email': email})
-            if reset_form.is_valid():
-                reset_form.save(
-                    request=request,
-                    use_https=request.is_secure(),
-                    subject_template_name='avaliacoes/password_reset_subject.txt',
-                    email_template_name='avaliacoes/password_reset_email.html',
-                )
-        except Exception as e_mail:
-            # Se o email falhar, o usuário JÁ FOI CRIADO. 
-            # Apenas avisamos o admin, não deletamos o usuário.
-            messages.warning(request, f"Usuário criado, mas erro ao enviar email: {e_mail}")
-            return redirect('adicionar_usuario')
-
         # Sucesso total
         if tipo == 'professor':
-            messages.success(request, f"Professor {nome} cadastrado e e-mail enviado!")
+            messages.success(request, f"Professor {nome} cadastrado! O e-mail de acesso será enviado em instantes.")
             return redirect('lista_professores')
         else:
-            messages.success(request, f"{tipo.capitalize()} {nome} cadastrado e e-mail enviado!")
+            messages.success(request, f"{tipo.capitalize()} {nome} cadastrado! O e-mail de acesso será enviado em instantes.")
             return redirect('adicionar_usuario')
 
     # --- GET Request ---
@@ -421,8 +506,8 @@ def adicionar_usuario(request):
 
 
 def detalhes_professor(request, professor_id):
-    # 1. Busca o professor
-    professor = get_object_or_404(Professor, pk=professor_id)
+    # 1. Busca o professor (já com o usuário, usado em todo o template)
+    professor = get_object_or_404(Professor.objects.select_related('user'), pk=professor_id)
     
     # 2. Busca as "turmas" (DisciplinaPessoa) deste professor
     disciplinas_do_professor = DisciplinaPessoa.objects.filter(pessoa=professor.user).select_related('disciplina')
@@ -469,68 +554,36 @@ def detalhes_professor(request, professor_id):
     # =======================================================
 
     # 4. === Lógica do Gráfico por Disciplina ===
-    
-    # Dicionário principal que será enviado como JSON
-    dados_grafico = {}
-    
-    # Listas para guardar a média GERAL (de todas as disciplinas)
-    dados_all = {
-        'didatica': [], 'dificuldade': [], 'relacionamento': [], 'pontualidade': []
-    }
+    #
+    # Os histogramas de notas (HistogramaNota) são mantidos a cada avaliação, então
+    # o box plot sai deles com custo fixo, seja a turma com 10 ou 100.000 notas.
+    # Enviamos só as estatísticas (mín, quartis, mediana, máx, média) de cada categoria.
 
-    # Busca as 4 categorias de uma vez para evitar buscas repetidas no loop
-    try:
-        cat_didatica = Categoria.objects.get(nome_categoria='Didática')
-        cat_dificuldade = Categoria.objects.get(nome_categoria='Dificuldade')
-        cat_relacionamento = Categoria.objects.get(nome_categoria='Relacionamento')
-        cat_pontualidade = Categoria.objects.get(nome_categoria='Pontualidade')
-    except Categoria.DoesNotExist as e:
-        # Se as categorias não existirem, envia dados vazios
-        context = {
-            'professor': professor,
-            'disciplinas_professor': disciplinas_do_professor,
-            'comentarios': comentarios,
-            'dados_grafico_json': json.dumps({'all': dados_all}),
-            'pode_avaliar': pode_avaliar,
-            'disciplinas_permitidas_json': json.dumps(disciplinas_permitidas_ids),
-            'disciplinas_avaliadas_json': json.dumps(disciplinas_avaliadas_ids), # ENVIADO AQUI
-        }
-        return render(request, 'avaliacoes/detalhes_professor.html', context)
+    # As categorias vêm do registro em memória (sem consulta); a chave no JSON é o slug
+    categorias = registro_categorias()
 
+    histogramas = histogramas_por_turma([dp.pk for dp in disciplinas_do_professor])
 
-    # Loop por cada disciplina que o professor ministra
-    for dp in disciplinas_do_professor:
-        # Pega as notas APENAS dessa disciplina (dp)
-        notas_disciplina = AvaliacaoCategoria.objects.filter(avaliacao__disciplina_pessoa=dp)
-        
-        # Filtra as notas por categoria
-        notas_didatica = list(notas_disciplina.filter(categoria=cat_didatica).values_list('nota', flat=True))
-        notas_dificuldade = list(notas_disciplina.filter(categoria=cat_dificuldade).values_list('nota', flat=True))
-        notas_relacionamento = list(notas_disciplina.filter(categoria=cat_relacionamento).values_list('nota', flat=True))
-        notas_pontualidade = list(notas_disciplina.filter(categoria=cat_pontualidade).values_list('nota', flat=True))
-        
-        # Adiciona os dados dessa disciplina ao dicionário principal, usando o ID como chave
-        dados_grafico[dp.pk] = {
-            'didatica': notas_didatica,
-            'dificuldade': notas_dificuldade,
-            'relacionamento': notas_relacionamento,
-            'pontualidade': notas_pontualidade,
-        }
-        
-        # Adiciona essas notas também à média GERAL (all)
-        dados_all['didatica'].extend(notas_didatica)
-        dados_all['dificuldade'].extend(notas_dificuldade)
-        dados_all['relacionamento'].extend(notas_relacionamento)
-        dados_all['pontualidade'].extend(notas_pontualidade)
+    dados_grafico = {}
+    dados_all = {}
+    for categoria in categorias:
+        por_turma = {dp.pk: histogramas[dp.pk].get(categoria.id, {}) for dp in disciplinas_do_professor}
+
+        for dp_id, histograma in por_turma.items():
+            dados_grafico.setdefault(dp_id, {})[categoria.slug] = estatisticas_histograma(histograma)
+        # Estatística GERAL (all): junta os histogramas de todas as turmas
+        dados_all[categoria.slug] = estatisticas_histograma(somar_histogramas(por_turma.values()))
 
-    # Adiciona a média GERAL ao dicionário com a chave 'all'
+    # Adiciona a estatística GERAL ao dicionário com a chave 'all'
     dados_grafico['all'] = dados_all
     
     context = {
         'professor': professor,
         'disciplinas_professor': disciplinas_do_professor, # Para o dropdown
         'comentarios': comentarios,
-        'dados_grafico_json': json.dumps(dados_grafico, default=str), # Envia o NOVO JSON
+        'dados_grafico_json': json.dumps(dados_grafico), # Estatísticas do box plot por turma/categoria
+        'categorias': categorias, # Campos do formulário de notas
+        'categorias_json': json.dumps(categorias.como_lista()), # Ordem e rótulos do gráfico
         'pode_avaliar': pode_avaliar,
         'disciplinas_permitidas_json': json.dumps(disciplinas_permitidas_ids),
         'disciplinas_avaliadas_json': json.dumps(disciplinas_avaliadas_ids), # ENVIADO AQUI
@@ -538,79 +591,246 @@ def detalhes_professor(request, professor_id):
 
     return render(request, 'avaliacoes/detalhes_professor.html', context)
 
+def contar_consultas(view):
+    """
+    Com DEBUG=True, devolve no cabeçalho X-Query-Count quantas consultas SQL a view executou
+    (incluindo sessão/usuário e o commit). Em produção não faz nada.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not settings.DEBUG:
+            return view(request, *args, **kwargs)
+        inicio = len(connection.queries)
+        response = view(request, *args, **kwargs)
+        response['X-Query-Count'] = str(len(connection.queries) - inicio)
+        return response
+    return wrapper
+
+def _ler_notas(dados, categorias):
+    """
+    {categoria_id: nota} com as categorias presentes em `dados` (chave = slug). Categorias
+    ausentes ficam sem nota: um cliente feito antes de uma categoria nova continua enviando.
+    Levanta ValueError com a mensagem para o usuário (nomeando a categoria com problema).
+    """
+    notas = {}
+    for categoria in categorias:
+        valor = dados.get(categoria.slug)
+        if valor is None:
+            continue
+        try:
+            nota = float(valor)
+        except (TypeError, ValueError):
+            nota = None
+        if nota is None or isinstance(valor, bool) or not math.isfinite(nota):
+            raise ValueError(f'Nota inválida para "{categoria.nome}".')
+        notas[categoria.id] = nota
+    if not notas:
+        raise ValueError('Envie a nota de pelo menos uma categoria.')
+    return notas
+
+
 @require_POST
+@contar_consultas
 @login_required # Garante que o usuário está logado
-@transaction.atomic # Garante que todas as operações de DB sejam bem-sucedidas
+@idempotente # Idempotency-Key + @escrita_atomica (transação única, fila de escrita e nova tentativa)
 def salvar_avaliacao_api(request):
+    # Caminho de escrita mais disputado na semana de avaliações (o SQLite serializa as escritas),
+    # por isso: 1 consulta de validação, 1 INSERT da avaliação, 1 INSERT das notas e os agregados.
     try:
         data = json.loads(request.body)
         disciplina_pessoa_id = data.get('disciplina_pessoa_id')
         
-        comentario_texto = data.get('comentario', '').strip()
+        comentario_texto = data.get('comentario') or ''
+        if not isinstance(comentario_texto, str):
+            return JsonResponse({'success': False, 'error': 'O comentário deve ser um texto.'}, status=400)
+        comentario_texto = comentario_texto.strip()
 
         if not disciplina_pessoa_id:
             return JsonResponse({'success': False, 'error': 'Disciplina não selecionada'}, status=400)
 
-        # 1. VALIDAÇÃO DE PERMISSÃO E MATRÍCULA
+        # 1. VALIDAÇÃO DE PERMISSÃO E DAS NOTAS (antes de qualquer escrita)
         
         # 1a. Verifica se o usuário logado é um Aluno
         if request.user.user_type != 'aluno':
             return JsonResponse({'success': False, 'error': 'Acesso negado. Apenas alunos podem enviar avaliações.'}, status=403)
-        
+
+        # 1b. Categorias do registro em memória (a nota de cada uma vem na chave = slug)
+        categorias = registro_categorias()
+        if not len(categorias):
+            return JsonResponse({'success': False, 'error': 'Categoria não encontrada no banco de dados. Contate o administrador.'}, status=500)
         try:
-            # Tenta buscar o perfil Aluno e o vínculo DisciplinaPessoa
-            aluno_logado = Aluno.objects.get(user=request.user)
-            disciplina_pessoa = get_object_or_404(DisciplinaPessoa, pk=disciplina_pessoa_id)
-            
-            # 1b. Verifica se o Aluno está ATUALMENTE matriculado
-            if not MatriculaAluno.objects.filter(aluno=aluno_logado, disciplina_professor=disciplina_pessoa).exists():
-                 return JsonResponse({'success': False, 'error': 'Você não está matriculado nesta disciplina e não pode avaliá-la.'}, status=403)
-                 
-            # 1c. NOVO BLOQUEIO: Verifica se a avaliação já existe
-            # ESTA CHECAGEM SÓ FUNCIONA SE SUA MODEL 'Avaliacao' TIVER UM CAMPO ForeignKey PARA 'aluno'
-            if Avaliacao.objects.filter(disciplina_pessoa=disciplina_pessoa, aluno=aluno_logado).exists():
-                 return JsonResponse({'success': False, 'error': 'Você já enviou uma avaliação para esta disciplina.'}, status=403)
-                 
-        except Aluno.DoesNotExist:
-            return JsonResponse({'success': False, 'error': 'Perfil de aluno não encontrado para o usuário logado.'}, status=403)
+            notas = _ler_notas(data, categorias)
+        except ValueError as erro:
+            return JsonResponse({'success': False, 'error': str(erro)}, status=400)
+
+        # 1c. Matrícula: UMA consulta traz o perfil Aluno e o vínculo DisciplinaPessoa.
+        #     Só no caminho de erro fazemos consultas extras para explicar o motivo.
+        matricula = MatriculaAluno.objects.filter(
+            aluno__user=request.user, disciplina_professor_id=disciplina_pessoa_id
+        ).select_related('disciplina_professor').first()
+        if matricula is None:
+            if not Aluno.objects.filter(user=request.user).exists():
+                return JsonResponse({'success': False, 'error': 'Perfil de aluno não encontrado para o usuário logado.'}, status=403)
+            if not DisciplinaPessoa.objects.filter(pk=disciplina_pessoa_id).exists():
+                return JsonResponse({'success': False, 'error': 'Disciplina inválida'}, status=404)
+            return JsonResponse({'success': False, 'error': 'Você não está matriculado nesta disciplina e não pode avaliá-la.'}, status=403)
+        disciplina_pessoa = matricula.disciplina_professor
 
         # --- A PARTIR DAQUI, AVALIAÇÃO É PERMITIDA ---
         
-        # 2. Cria a Avaliacao "pai"
-        # CORREÇÃO: Passa o objeto 'aluno_logado' para ligar a avaliação ao aluno.
-        nova_avaliacao = Avaliacao.objects.create(
-            disciplina_pessoa=disciplina_pessoa,
-            aluno=aluno_logado, 
-            comentario=comentario_texto if comentario_texto else None # <-- AQUI ESTÁ A MUDANÇA
-        )
-
-        # 3. Busca as categorias para usar as FKs
+        # 2. Cria a Avaliacao "pai". Avaliação repetida é barrada pelo
+        #    unique_together (disciplina_pessoa, aluno), sem consulta prévia.
         try:
-            categorias = {
-                'didatica': Categoria.objects.get(nome_categoria='Didática'),
-                'dificuldade': Categoria.objects.get(nome_categoria='Dificuldade'),
-                'relacionamento': Categoria.objects.get(nome_categoria='Relacionamento'),
-                'pontualidade': Categoria.objects.get(nome_categoria='Pontualidade'),
-            }
-        except Categoria.DoesNotExist as e:
-            # Garante que a transação seja desfeita se faltar categoria
-            transaction.set_rollback(True) 
-            return JsonResponse({'success': False, 'error': 'Categoria não encontrada no banco de dados. Contate o administrador.'}, status=500)
-
-        # 4. Cria as AvaliacaoCategoria (as 4 notas)
-        for key, categoria_obj in categorias.items():
-            AvaliacaoCategoria.objects.create(
-                avaliacao=nova_avaliacao, 
-                categoria=categoria_obj, 
-                nota=float(data.get(key))
+            nova_avaliacao = Avaliacao.objects.create(
+                disciplina_pessoa=disciplina_pessoa,
+                aluno_id=matricula.aluno_id, 
+                comentario=comentario_texto if comentario_texto else None # <-- AQUI ESTÁ A MUDANÇA
             )
+        except IntegrityError:
+            # Nada foi gravado ainda; desfaz a transação e avisa
+            transaction.set_rollback(True)
+            return JsonResponse({'success': False, 'error': 'Você já enviou uma avaliação para esta disciplina.'}, status=403)
+
+        # 3. Cria as AvaliacaoCategoria (uma nota por categoria) num único INSERT
+        AvaliacaoCategoria.objects.bulk_create([
+            AvaliacaoCategoria(avaliacao=nova_avaliacao, categoria_id=categoria_id, nota=nota)
+            for categoria_id, nota in notas.items()
+        ])
+
+        # 4. Atualiza as médias agregadas (na mesma transação)
+        registrar_avaliacao(disciplina_pessoa, notas)
         
         return JsonResponse({'success': True})
 
-    except DisciplinaPessoa.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'Disciplina inválida'}, status=404)
+    except OperationalError:
+        # "database is locked": sobe para o @escrita_atomica tentar de novo
+        raise
     except Exception as e:
         # Pega erros de JSON, conversão de float, ou outros erros inesperados
+        transaction.set_rollback(True)
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+
+@require_POST
+@contar_consultas
+@login_required
+@idempotente
+def salvar_avaliacoes_lote_api(request):
+    """
+    Várias avaliações (uma por turma) numa requisição e numa única transação de escrita.
+
+    Corpo: {"avaliacoes": [{"disciplina_pessoa_id": 1, "didatica": 8, ..., "comentario": "..."}]},
+    cada item no mesmo formato do corpo de salvar_avaliacao_api.
+    Resposta: {"success": true, "resultados": [{"disciplina_pessoa_id", "status", "erro"?}]}, na
+    ordem dos itens. status: 'criada', 'duplicada', 'nao_matriculado' ou 'invalida'. Cada item
+    tem o seu status; os que deram certo são gravados mesmo que outros falhem.
+    """
+    try:
+        data = json.loads(request.body)
+        itens = data.get('avaliacoes') if isinstance(data, dict) else None
+        if not isinstance(itens, list) or not itens:
+            return JsonResponse({'success': False, 'error': 'Envie uma lista em "avaliacoes".'}, status=400)
+        if len(itens) > MAX_AVALIACOES_POR_LOTE:
+            return JsonResponse({'success': False, 'error': f'No máximo {MAX_AVALIACOES_POR_LOTE} avaliações por envio.'}, status=400)
+
+        if request.user.user_type != 'aluno':
+            return JsonResponse({'success': False, 'error': 'Acesso negado. Apenas alunos podem enviar avaliações.'}, status=403)
+
+        categorias = registro_categorias()
+        if not len(categorias):
+            return JsonResponse({'success': False, 'error': 'Categoria não encontrada no banco de dados. Contate o administrador.'}, status=500)
+
+        # 1. Valida o formato e os tipos de cada item (sem banco); um item inválido não
+        #    derruba os demais
+        resultados = []
+        validos = [] # (posição, disciplina_pessoa_id, notas, comentario)
+        for posicao, item in enumerate(itens):
+            disciplina_pessoa_id = item.get('disciplina_pessoa_id') if isinstance(item, dict) else None
+            resultados.append({'disciplina_pessoa_id': disciplina_pessoa_id})
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError('Cada avaliação deve ser um objeto.')
+                # Inteiro (ou texto só com dígitos); recusa bool, float, listas...
+                if isinstance(disciplina_pessoa_id, bool) or not str(disciplina_pessoa_id).isdigit():
+                    raise ValueError('Disciplina inválida.')
+                disciplina_pessoa_id = int(disciplina_pessoa_id)
+                comentario = item.get('comentario')
+                if comentario is not None and not isinstance(comentario, str):
+                    raise ValueError('O comentário deve ser um texto.')
+                notas = _ler_notas(item, categorias)
+            except ValueError as erro:
+                resultados[posicao].update(status='invalida', erro=str(erro))
+                continue
+            validos.append((posicao, disciplina_pessoa_id, notas, (comentario or '').strip() or None))
+
+        # 2. UMA consulta para todas as matrículas do aluno nas turmas pedidas
+        matriculas = {
+            m.disciplina_professor_id: m
+            for m in MatriculaAluno.objects.filter(
+                aluno__user=request.user,
+                disciplina_professor_id__in={dp_id for _, dp_id, _, _ in validos},
+            ).select_related('disciplina_professor')
+        }
+        if not matriculas and not Aluno.objects.filter(user=request.user).exists():
+            return JsonResponse({'success': False, 'error': 'Perfil de aluno não encontrado para o usuário logado.'}, status=403)
+
+        # 3. Duplicadas: já avaliadas antes (uma consulta) ou repetidas dentro do próprio lote
+        ja_avaliadas = set(Avaliacao.objects.filter(
+            aluno__user=request.user, disciplina_pessoa_id__in=matriculas.keys()
+        ).values_list('disciplina_pessoa_id', flat=True))
+
+        novas = [] # (posição, Avaliacao, notas)
+        for posicao, dp_id, notas, comentario in validos:
+            matricula = matriculas.get(dp_id)
+            if matricula is None:
+                resultados[posicao].update(status='nao_matriculado', erro='Você não está matriculado nesta disciplina.')
+            elif dp_id in ja_avaliadas:
+                resultados[posicao].update(status='duplicada', erro='Você já enviou uma avaliação para esta disciplina.')
+            else:
+                ja_avaliadas.add(dp_id)
+                novas.append((posicao, Avaliacao(
+                    disciplina_pessoa=matricula.disciplina_professor,
+                    aluno_id=matricula.aluno_id,
+                    comentario=comentario,
+                ), notas))
+
+        # 4. Grava tudo com dois INSERTs (avaliações e notas) e atualiza os agregados uma vez
+        if novas:
+            try:
+                with transaction.atomic():
+                    Avaliacao.objects.bulk_create([avaliacao for _, avaliacao, _ in novas])
+            except IntegrityError:
+                # Outra requisição do mesmo aluno gravou alguma destas turmas entre a checagem e
+                # o INSERT: grava uma a uma (um savepoint por item) e só as que conflitaram
+                # ficam como duplicadas
+                gravadas = []
+                for posicao, avaliacao, notas in novas:
+                    try:
+                        with transaction.atomic():
+                            avaliacao.save(force_insert=True)
+                    except IntegrityError:
+                        resultados[posicao].update(status='duplicada', erro='Você já enviou uma avaliação para esta disciplina.')
+                    else:
+                        gravadas.append((posicao, avaliacao, notas))
+                novas = gravadas
+
+            AvaliacaoCategoria.objects.bulk_create([
+                AvaliacaoCategoria(avaliacao=avaliacao, categoria_id=categoria_id, nota=nota)
+                for _, avaliacao, notas in novas
+                for categoria_id, nota in notas.items()
+            ])
+            registrar_avaliacoes([(avaliacao.disciplina_pessoa, notas) for _, avaliacao, notas in novas])
+
+            for posicao, avaliacao, _ in novas:
+                resultados[posicao].update(status='criada', avaliacao_id=avaliacao.pk)
+
+        return JsonResponse({'success': True, 'resultados': resultados})
+
+    except OperationalError:
+        raise
+    except Exception as e:
+        # Pega erros de JSON ou outros erros inesperados
+        transaction.set_rollback(True)
         return JsonResponse({'success': False, 'error': str(e)}, status=400)
 
 
@@ -672,6 +892,7 @@ def salvar_avaliacao_api(request):
 
 @require_POST
 @login_required # Garante que o usuário está logado
+@idempotente # Reenvio com a mesma chave não duplica o comentário
 def salvar_comentario_api(request):
     # --- INÍCIO DA CORREÇÃO DE INDENTAÇÃO ---
     try:
@@ -697,6 +918,8 @@ def salvar_comentario_api(request):
 
     except DisciplinaPessoa.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'Disciplina inválida'}, status=404)
+    except OperationalError:
+        raise
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=400)
 # A FUNÇÃO 'salvar_comentario_api' TERMINA AQUI.
@@ -717,27 +940,29 @@ def ranking_geral(request):
     else:
         limite = 5
 
-    # 2. A unidade de ranking agora é a 'DisciplinaPessoa' (a turma)
-    #    Anotamos a média de notas em cada 'DisciplinaPessoa'
-    ranking = DisciplinaPessoa.objects.annotate(
-        media_nota=Avg('avaliacoes__categorias_avaliacao__nota')
-    )
-    
-    # 3. Lógica principal do Ranking:
-    #    - Filtra para incluir apenas quem JÁ TEM avaliações (media_nota não é Nula)
-    #    - Ordena pela 'media_nota' em ordem descendente
-    #    - select_related otimiza a busca, pegando dados do professor e disciplina
-    ranking_disciplinas = ranking.filter(
-        media_nota__isnull=False
-    ).select_related(
-        'pessoa', 'pessoa__professor', 'disciplina'
-    ).order_by('-media_nota')
-    
-    # 4. Limita o ranking (com o limite que definimos)
-    ranking_top = ranking_disciplinas[:limite]
+    # 2. A unidade de ranking é a 'DisciplinaPessoa' (a turma). A pontuação bayesiana já
+    #    está gravada nos agregados (ver avaliacoes/ranking.py), então o top-K é só uma
+    #    leitura do índice. Filtros opcionais: ?materia=<id> e ?categoria=<id>
+    materia_id = request.GET.get('materia')
+    categoria_id = request.GET.get('categoria')
+    materia_id = int(materia_id) if materia_id and materia_id.isdigit() else None
+    categoria_id = int(categoria_id) if categoria_id and categoria_id.isdigit() else None
+
+    if categoria_id:
+        medias = melhores_turmas_por_categoria(categoria_id, limite)
+    else:
+        medias = melhores_turmas(limite, materia_id=materia_id)
+
+    # 3. O template trabalha com a turma: copia os números do agregado para ela
+    ranking_top = []
+    for media in medias:
+        dp = media.disciplina_pessoa
+        dp.media_nota = media.media
+        dp.pontuacao = media.pontuacao
+        dp.qtde_avaliacoes = media.qtde_avaliacoes
+        ranking_top.append(dp)
 
     context = {
-        # O nome da variável mudou para refletir o que estamos enviando
         'ranking_disciplinas': ranking_top
         # O template vai usar 'request.user.is_staff' para decidir como exibir
     }
@@ -759,7 +984,7 @@ def editar_professor(request, professor_id):
     user = professor.user
     
     # Pega as disciplinas que o professor JÁ ministra
-    disciplinas_atuais = DisciplinaPessoa.objects.filter(pessoa=user)
+    disciplinas_atuais = DisciplinaPessoa.objects.filter(pessoa=user).select_related('disciplina')
 
     if request.method == 'POST':
         # --- LÓGICA PARA ATUALIZAR O PERFIL ---
@@ -798,8 +1023,12 @@ def editar_professor(request, professor_id):
         elif 'submit_delete' in request.POST:
             try:
                 nome_professor = professor.user.get_full_name()
-                # Deleta o CustomUser. O Professor profile e DisciplinaPessoa serão deletados em cascata.
-                professor.user.delete() 
+                with transaction.atomic():
+                    # Retira das médias gerais tudo o que as turmas do professor acumularam
+                    descontar_turmas(DisciplinaPessoa.objects.filter(pessoa=professor.user))
+                    apagar_avaliacoes(Avaliacao.objects.filter(disciplina_pessoa__pessoa=professor.user))
+                    # Deleta o CustomUser. O Professor profile e DisciplinaPessoa serão deletados em cascata.
+                    professor.user.delete() 
                 messages.success(request, f"Professor '{nome_professor}' foi excluído com sucesso.")
                 return redirect('lista_professores') # Redireciona para a lista de professores
             except Exception as e:
@@ -824,22 +1053,49 @@ def editar_professor(request, professor_id):
 
 def sugestoes_professores_api(request):
     term = request.GET.get('term', '').strip()
-    sugestoes = []
-    
-    # # Não busca se o termo for muito curto
-    # if len(term) < 2:
-    #     return JsonResponse({'sugestoes': []})
-    
-    # Busca por nome ou sobrenome
-    professores = Professor.objects.filter(
-        Q(user__first_name__icontains=term) |
-        Q(user__last_name__icontains=term)
-    ).select_related('user')[:10] # Limita a 10 sugestões
-    
-    # Cria uma lista de nomes completos, sem duplicatas
-    sugestoes_set = set(prof.user.get_full_name() for prof in professores)
-    
-    return JsonResponse({'sugestoes': list(sugestoes_set)})
+    # Se o termo for vazio, retorna lista vazia
+    if not term:
+        return JsonResponse({'sugestoes': []})
+
+    # Busca por prefixo do nome ou sobrenome (sem acento) no índice em memória,
+    # os mais avaliados primeiro. Limita a 10 sugestões, sem consultar o banco
+    return JsonResponse({'sugestoes': sugerir_professores(term, limite=10)})
+
+@login_required(login_url='login')
+def busca_api(request):
+    """
+    Busca geral por relevância: professores, disciplinas e comentários que casam com ?q=.
+    ?limite= controla quantos itens de cada tipo (padrão 10, máximo 50).
+    """
+    termo = request.GET.get('q', '').strip()
+    try:
+        limite = min(max(int(request.GET.get('limite', 10)), 1), 50)
+    except ValueError:
+        limite = 10
+
+    professores = buscar_professores(termo, limite)
+    disciplinas = buscar_materias(termo, limite)
+    comentarios = buscar_comentarios(termo, limite)
+
+    return JsonResponse({
+        'professores': [
+            {'id': p.id, 'nome': p.user.get_full_name() or p.user.username}
+            for p in professores
+        ],
+        'disciplinas': [
+            {'id': m.id, 'nome': m.nome, 'codigo': m.codigo}
+            for m in disciplinas
+        ],
+        'comentarios': [
+            {
+                'id': c.id,
+                'comentario': c.comentario,
+                'professor': c.disciplina_pessoa.pessoa.get_full_name() if c.disciplina_pessoa else None,
+                'disciplina': c.disciplina_pessoa.disciplina.nome if c.disciplina_pessoa else None,
+            }
+            for c in comentarios
+        ],
+    })
 
 def sugestoes_disciplinas_api(request):
     term = request.GET.get('term', '').strip()
@@ -847,26 +1103,8 @@ def sugestoes_disciplinas_api(request):
     if not term:
         return JsonResponse({'sugestoes': []})
 
-    normalized_term = unidecode(term).lower()
-    
-    # Tenta filtrar primeiro pelo campo normalizado, se ele existir
-    try:
-        # Se você tiver um campo customizado 'nome_normalized' no model Materia
-        disciplinas = Materia.objects.filter(
-            nome_normalized__icontains=normalized_term
-        ).values_list('nome', flat=True)[:10]
-        
-    except FieldError: 
-        # FieldError é o erro correto do Django quando um campo não existe no Model
-        # Fallback para o campo 'nome' padrão
-        disciplinas = Materia.objects.filter(
-            nome__icontains=term 
-        ).values_list('nome', flat=True)[:10]
-    
-    # Remove duplicatas e converte para lista
-    sugestoes_lista = list(set(disciplinas))
-    
-    return JsonResponse({'sugestoes': sugestoes_lista})
+    # Índice em memória (sem acento, por prefixo), as mais avaliadas primeiro e sem duplicatas
+    return JsonResponse({'sugestoes': sugerir_disciplinas(term, limite=10)})
 
 @login_required(login_url='login')
 def sobre_nos(request):
@@ -894,43 +1132,43 @@ def comparacao_disciplina(request):
     }
 
     if len(query_disciplina) > 0:
-        # 1. Encontra a matéria (disciplina)
-        materia = Materia.objects.filter(nome__icontains=query_disciplina).first()
+        # 1. Encontra a matéria (disciplina) mais relevante para o termo. O FTS casa o
+        #    início das palavras ("prog" acha "Programação"); se nada casar, volta à busca
+        #    por trecho do nome sem acento ("gramacao"), como era antes do índice
+        materias = buscar_materias(query_disciplina, limite=1)
+        materia = materias[0] if materias else Materia.objects.filter(
+            nome_normalized__contains=unidecode(query_disciplina).lower()
+        ).first()
         
         if materia:
             context['materia_encontrada'] = materia
             
-            # 2. Encontra todos os 'DisciplinaPessoa' (professores) para essa matéria
-            #    e usa annotate para calcular as médias de cada categoria
-            resultados = DisciplinaPessoa.objects.filter(
-                disciplina=materia
+            # 2. Encontra todos os 'DisciplinaPessoa' (professores) para essa matéria.
+            #    As médias por categoria vêm prontas de MediaDisciplinaCategoria (filtrada
+            #    por categoria_id), sem varrer as notas
+            resultados = list(DisciplinaPessoa.objects.filter(
+                disciplina=materia,
+                # Garante que só apareçam professores
+                pessoa__user_type='professor'
             ).select_related(
                 'pessoa', 'pessoa__professor', 'disciplina'
-            ).annotate(
-                # Média de Didática
-                media_didatica=Avg(
-                    'avaliacoes__categorias_avaliacao__nota',
-                    filter=Q(avaliacoes__categorias_avaliacao__categoria__nome_categoria='Didática')
-                ),
-                # Média de Dificuldade
-                media_dificuldade=Avg(
-                    'avaliacoes__categorias_avaliacao__nota',
-                    filter=Q(avaliacoes__categorias_avaliacao__categoria__nome_categoria='Dificuldade')
-                ),
-                # Média de Relacionamento
-                media_relacionamento=Avg(
-                    'avaliacoes__categorias_avaliacao__nota',
-                    filter=Q(avaliacoes__categorias_avaliacao__categoria__nome_categoria='Relacionamento')
-                ),
-                # Média de Pontualidade
-                media_pontualidade=Avg(
-                    'avaliacoes__categorias_avaliacao__nota',
-                    filter=Q(avaliacoes__categorias_avaliacao__categoria__nome_categoria='Pontualidade')
-                )
-            ).filter(
-                # Garante que só apareçam professores
-                pessoa__user_type='professor' 
-            ).order_by('pessoa__first_name') # Ordena por nome
+            ).order_by('pessoa__first_name')) # Ordena por nome
+
+            categorias = registro_categorias()
+            medias = {
+                # soma/qtde em vez do campo 'media' (já arredondado) para exibir igual ao Avg
+                (m['disciplina_pessoa_id'], m['categoria_id']): float(m['soma_notas']) / m['qtde_avaliacoes']
+                for m in MediaDisciplinaCategoria.objects.filter(
+                    disciplina_pessoa__in=resultados,
+                    categoria_id__in=categorias.por_id.keys(),
+                    qtde_avaliacoes__gt=0,
+                ).values('disciplina_pessoa_id', 'categoria_id', 'soma_notas', 'qtde_avaliacoes')
+            }
+            for dp in resultados:
+                # [(nome da categoria, média ou None)] na ordem do registro
+                dp.medias_categorias = [
+                    (categoria.nome, medias.get((dp.pk, categoria.id))) for categoria in categorias
+                ]
             
             context['resultados'] = resultados
         
@@ -940,6 +1178,7 @@ def comparacao_disciplina(request):
 
     return render(request, 'avaliacoes/comparacao.html', context)
 
+@escrita_atomica
 def contato(request):
     # 1. LÓGICA DE ADMINISTRADOR: Vê a lista de mensagens
     if request.user.is_authenticated and hasattr(request.user, 'user_type') and request.user.user_type == 'admin':
@@ -987,7 +1226,11 @@ def editar_aluno(request, aluno_id):
         if 'submit_delete' in request.POST:
             try:
                 nome_aluno = user.get_full_name()
-                user.delete() # Deleta o CustomUser (o Aluno some em cascata)
+                with transaction.atomic():
+                    # As avaliações do aluno somem em cascata, então saem das médias antes
+                    descontar_avaliacoes(Avaliacao.objects.filter(aluno=aluno))
+                    apagar_avaliacoes(Avaliacao.objects.filter(aluno=aluno))
+                    user.delete() # Deleta o CustomUser (o Aluno some em cascata)
                 messages.success(request, f"Aluno '{nome_aluno}' excluído com sucesso.")
                 return redirect('selecionar_aluno_para_editar')
             except Exception as e:
@@ -1079,7 +1322,7 @@ def get_disciplinas_professor(request):
 # 2. View para Adicionar Disciplina
 @staff_member_required # Assumindo que apenas staff pode adicionar matrícula
 @require_http_methods(["POST"])
-@transaction.atomic 
+@idempotente
 def adicionar_disciplina_professor(request):
     try:
         # Tenta decodificar o JSON
@@ -1119,16 +1362,116 @@ def adicionar_disciplina_professor(request):
     except IntegrityError:
         # Pega o erro de duplicação da restrição unique_together em MatriculaAluno
         return JsonResponse({'success': False, 'message': 'O aluno já está matriculado nesta disciplina com este professor.'}, status=409)
+    except OperationalError:
+        raise
     except Exception as e:
         # Erro genérico (ex: CustomUser ou Materia não encontrado)
         return JsonResponse({'success': False, 'message': f'Erro ao processar a matrícula: {e}'}, status=500)
 
+def _separar_identificadores(texto):
+    """
+    Texto colado (um por linha, ou separados por vírgula/espaço/ponto e vírgula) ->
+    (e-mails em minúsculas, CPFs). O CPF pode vir com pontuação: '123.456.789-01' vira '12345678901'.
+    """
+    emails, cpfs = set(), set()
+    for item in re.split(r'[\s,;]+', texto or ''):
+        if not item:
+            continue
+        if '@' in item:
+            emails.add(item.lower())
+        else:
+            cpfs.add(re.sub(r'[.\-/]', '', item))
+    return emails, cpfs
+
+
+@staff_member_required
+def matricular_alunos(request):
+    """Tela da matrícula em lote: escolhe a turma e cola a lista de CPFs/e-mails."""
+    turmas = DisciplinaPessoa.objects.filter(status='ativo').select_related(
+        'pessoa', 'disciplina'
+    ).order_by('disciplina__nome', 'pessoa__first_name')
+    return render(request, 'avaliacoes/matricular_alunos.html', {
+        'turmas': turmas,
+        'max_por_lote': MAX_MATRICULAS_POR_LOTE,
+    })
+
+
+@staff_member_required
+@require_http_methods(["POST"])
+@idempotente
+def matricular_alunos_lote_api(request):
+    """
+    Matricula vários alunos numa turma (DisciplinaPessoa) de uma vez.
+
+    Corpo: {"disciplina_pessoa_id": 5, "aluno_ids": [1, 2], "identificadores": "cpfs/e-mails colados"}
+    (aluno_ids e identificadores são opcionais, mas pelo menos um precisa ter alunos).
+    Resposta: {"success": true, "criadas", "ja_matriculados", "nao_encontrados": [...]}.
+
+    Custo fixo, independente do tamanho da turma: uma consulta para a turma, uma para
+    resolver todos os alunos, uma para as matrículas existentes, um INSERT em lote e uma
+    contagem do que ele realmente gravou.
+    """
+    try:
+        data = json.loads(request.body)
+        disciplina_pessoa_id = int(data.get('disciplina_pessoa_id'))
+        aluno_ids = {int(aluno_id) for aluno_id in data.get('aluno_ids') or []}
+        emails, cpfs = _separar_identificadores(data.get('identificadores'))
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return JsonResponse({'success': False, 'message': 'JSON inválido: informe a turma e ids numéricos.'}, status=400)
+
+    if not (aluno_ids or emails or cpfs):
+        return JsonResponse({'success': False, 'message': 'Informe ao menos um aluno.'}, status=400)
+    if len(aluno_ids) + len(cpfs) + len(emails) > MAX_MATRICULAS_POR_LOTE:
+        return JsonResponse({'success': False, 'message': f'No máximo {MAX_MATRICULAS_POR_LOTE} alunos por envio.'}, status=400)
+
+    # 1. A turma precisa existir e estar ativa (mesma regra de adicionar_disciplina_professor)
+    if not DisciplinaPessoa.objects.filter(pk=disciplina_pessoa_id, status='ativo').exists():
+        return JsonResponse({'success': False, 'message': 'Turma inválida ou inativa.'}, status=404)
+
+    # 2. UMA consulta resolve ids, CPFs e e-mails (sem diferenciar maiúsculas)
+    encontrados = list(Aluno.objects.annotate(email_minusculo=Lower('user__email')).filter(
+        Q(pk__in=aluno_ids) | Q(user__cpf__in=cpfs) | Q(email_minusculo__in=emails)
+    ).values_list('pk', 'user__cpf', 'user__email'))
+    ids_resolvidos = {pk for pk, _, _ in encontrados}
+    cpfs_resolvidos = {cpf for _, cpf, _ in encontrados}
+    emails_resolvidos = {email.lower() for _, _, email in encontrados}
+    nao_encontrados = sorted(
+        [str(pk) for pk in aluno_ids - ids_resolvidos]
+        + [cpf for cpf in cpfs - cpfs_resolvidos]
+        + [email for email in emails - emails_resolvidos]
+    )
+
+    # 3. Quem já está matriculado é pulado; o ignore_conflicts cobre o que escapar disso
+    ja_matriculados = set(MatriculaAluno.objects.filter(
+        disciplina_professor_id=disciplina_pessoa_id, aluno_id__in=ids_resolvidos
+    ).values_list('aluno_id', flat=True))
+    MatriculaAluno.objects.bulk_create([
+        MatriculaAluno(aluno_id=aluno_id, disciplina_professor_id=disciplina_pessoa_id)
+        for aluno_id in sorted(ids_resolvidos - ja_matriculados)
+    ], ignore_conflicts=True)
+    # O ignore_conflicts não diz quantas linhas entraram (as ignoradas não contam): conta de
+    # novo, na mesma transação da consulta de antes
+    criadas = MatriculaAluno.objects.filter(
+        disciplina_professor_id=disciplina_pessoa_id, aluno_id__in=ids_resolvidos
+    ).count() - len(ja_matriculados)
+
+    return JsonResponse({
+        'success': True,
+        'criadas': criadas,
+        'ja_matriculados': len(ja_matriculados),
+        'nao_encontrados': nao_encontrados,
+    })
+
 # 3. View para Excluir Disciplina
 @require_http_methods(["DELETE"])
 def excluir_disciplina_professor(request, id):
     try:
         disciplina_pessoa = get_object_or_404(DisciplinaPessoa, id=id)
-        disciplina_pessoa.delete() # Exclui do banco
+        with transaction.atomic():
+            descontar_turmas(DisciplinaPessoa.objects.filter(pk=disciplina_pessoa.pk))
+            # Avaliações num DELETE só; o cascata do Django leria e apagaria de 100 em 100
+            apagar_avaliacoes(Avaliacao.objects.filter(disciplina_pessoa=disciplina_pessoa))
+            disciplina_pessoa.delete() # Exclui do banco
         return JsonResponse({'success': True, 'message': 'Disciplina removida com sucesso.'})
     except Exception as e:
         return JsonResponse({'success': False, 'message': str(e)}, status=500)
@@ -1188,7 +1531,7 @@ def get_disciplinas_table(request):
 
 @staff_member_required
 @require_http_methods(["DELETE"])
-@transaction.atomic # Garante que as exclusões ocorram juntas
+@escrita_atomica # Garante que as exclusões ocorram juntas
 def excluir_matricula_aluno(request, matricula_id):
     """
     Exclui um registro de MatriculaAluno e, em cascata, remove 
@@ -1198,33 +1541,72 @@ def excluir_matricula_aluno(request, matricula_id):
     try:
         matricula = get_object_or_404(MatriculaAluno, pk=matricula_id)
         
-        # OBTÉM OS OBJETOS RELACIONADOS
-        aluno = matricula.aluno # O Aluno que fez a matrícula
-        disciplina_professor_vinculo = matricula.disciplina_professor
-        
-        # 1. REMOVE A AVALIAÇÃO FEITA PELO ALUNO PARA ESTE VÍNCULO
+        # Remove a matrícula e a avaliação feita pelo aluno para este vínculo (mesma regra
+        # da sincronização com a secretaria, ver matriculas.remover_matriculas).
         # Isso permite que o aluno avalie novamente após a rematrícula.
-        # Filtra pelo aluno e pelo vínculo DisciplinaPessoa
-        avaliacoes_para_deletar = Avaliacao.objects.filter(
-            aluno=aluno,
-            disciplina_pessoa=disciplina_professor_vinculo
-        )
-        
-        if avaliacoes_para_deletar.exists():
-            # Deletar Avaliacao também deleta AvaliacaoCategoria em cascata
-            avaliacoes_deletadas = avaliacoes_para_deletar.count()
-            avaliacoes_para_deletar.delete()
-        else:
-            avaliacoes_deletadas = 0
-
-        # 2. DELETA A MATRÍCULA
-        matricula.delete()
+        avaliacoes_deletadas = remover_matriculas(MatriculaAluno.objects.filter(pk=matricula.pk))
         
         return JsonResponse({
             'success': True, 
             'message': f'Matrícula removida com sucesso. ({avaliacoes_deletadas} avaliação(ões) limpa(s)).'
         })
         
+    except OperationalError:
+        raise
     except Exception as e:
-        # Se ocorrer um erro, a transação.atomic garante que nada será salvo/deletado
-        return JsonResponse({'success': False, 'message': f'Erro ao excluir matrícula e avaliação: {e}'}, status=500)
\ No newline at end of file
+        # Se ocorrer um erro, nada é salvo/deletado
+        transaction.set_rollback(True)
+        return JsonResponse({'success': False, 'message': f'Erro ao excluir matrícula e avaliação: {e}'}, status=500)
+
+
+@staff_member_required
+def metricas_painel(request):
+    # Piores views primeiro (ver avaliacoes/metricas.py); POST com "zerar" recomeça a contagem
+    if request.method == 'POST' and 'zerar' in request.POST:
+        metricas.registro.zerar()
+        messages.success(request, 'Métricas zeradas.')
+        return redirect('metricas')
+
+    ordem = request.GET.get('ordem', 'p95')
+    if ordem not in metricas.ORDENACOES:
+        ordem = 'p95'
+    linhas = metricas.resumo(ordem)
+    return render(request, 'avaliacoes/metricas.html', {
+        'linhas': linhas,
+        'ordem': ordem,
+        'desde': datetime.fromtimestamp(metricas.registro.inicio, tz=timezone.get_current_timezone()),
+        'total_requisicoes': sum(linha['requisicoes'] for linha in linhas),
+    })
+
+
+def metricas_prometheus(request):
+    """
+    As mesmas métricas no formato texto do Prometheus. Liberado para staff e para o
+    coletor que mandar "Authorization: Bearer <METRICAS_TOKEN>". Não se confia no IP:
+    atrás do proxy do host toda requisição chega de um endereço local.
+    """
+    token = getattr(settings, 'METRICAS_TOKEN', None)
+    cabecalho = request.META.get('HTTP_AUTHORIZATION', '')
+    # O token é conferido antes do usuário: assim a coleta nem carrega a sessão
+    coletor = bool(token) and hmac.compare_digest(cabecalho.encode(), f'Bearer {token}'.encode())
+    if not coletor and not request.user.is_staff:
+        return HttpResponse('Acesso negado.', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(metricas.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@staff_member_required
+def perfis(request):
+    # Perfis gravados pelo PerfilMiddleware (ver avaliacoes/perfilamento.py)
+    return render(request, 'avaliacoes/perfis.html', {
+        'perfis': perfilamento.listar(),
+        'parametro': perfilamento.PARAMETRO,
+        'amostragem_pct': getattr(settings, 'PERFIL_AMOSTRAGEM', 0) * 100,
+    })
+
+
+@staff_member_required
+def baixar_perfil(request, nome):
+    caminho = perfilamento.arquivo(nome)
+    if caminho is None:
+        raise Http404('Perfil não encontrado.')
+    return FileResponse(open(caminho, 'rb'), as_attachment=True, filename=nome)
@@ -0,0 +1,23 @@
+// Idempotency-Key (ver avaliacoes/idempotencia.py): o mesmo envio (mesmo corpo) reusa a
+// chave até o servidor responder. Assim, clicar de novo depois de um timeout não grava em dobro.
+let envioPendente = null;
+
+function chaveDoEnvio(corpo) {
+    if (!envioPendente || envioPendente.corpo !== corpo) {
+        const chave = (window.crypto && crypto.randomUUID)
+            ? crypto.randomUUID()
+            : Date.now() + '-' + Math.random().toString(16).slice(2);
+        envioPendente = { corpo: corpo, chave: chave };
+    }
+    return envioPendente.chave;
+}
+
+// POST de JSON com o Idempotency-Key do envio; devolve a Promise do corpo da resposta.
+function enviarJson(url, dados, csrfToken) {
+    const corpo = JSON.stringify(dados);
+    return fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken, 'Idempotency-Key': chaveDoEnvio(corpo) },
+        body: corpo
+    }).then(response => { envioPendente = null; return response.json(); });
+}